@@ -0,0 +1,213 @@
+"""Benchmark a full gmail-stats sync against the fake Gmail API.
+
+Starts a FakeGmailServer with a synthetic mailbox, runs get_sender_counts
+against it with a throwaway cache and reports threads per second, requests
+issued, bytes transferred and peak memory.
+
+Examples:
+
+    python -m benchmarks.bench_sync --threads 10000
+    python -m benchmarks.bench_sync --threads 100000 --latency 0.05 \\
+        --throttle-rate 0.01 --error-rate 0.01 --json results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Optional
+
+from gmail_stats import sync
+from gmail_stats.metrics import peak_rss, sync_metrics
+from gmail_stats.ratelimit import QuotaTokenBucket
+
+from .fake_gmail import FakeGmailServer, FakeMailbox
+
+
+def run_sync_benchmark(
+    thread_count: int,
+    sender_count: int = 1000,
+    unread_fraction: float = 0.5,
+    latency: float = 0.0,
+    throttle_rate: float = 0.0,
+    error_rate: float = 0.0,
+    fetch_format: str = "metadata",
+    unread_only: bool = True,
+    storage_backend: str = "sqlite",
+    quota_rate: Optional[float] = None,
+    trace_memory: bool = False,
+    max_memory: Optional[int] = None,
+) -> dict:
+    """Run one full sync against a fake mailbox.
+
+    Args:
+        thread_count: Number of threads in the fake inbox
+        sender_count: Number of distinct senders
+        unread_fraction: Fraction of threads that are unread
+        latency: Seconds the fake API adds to every HTTP request
+        throttle_rate: Fraction of requests answered with 429
+        error_rate: Fraction of requests answered with 500 or 503
+        fetch_format: Thread fetch format ('metadata' or 'full')
+        unread_only: List only unread threads
+        storage_backend: Storage backend for the throwaway cache
+        quota_rate: Quota units per second for the rate limiter, None to
+            not rate limit
+        trace_memory: Measure peak Python heap usage with tracemalloc, which
+            slows the sync down noticeably
+        max_memory: Run a bounded-memory sync flushing threads to storage
+            above this RSS in bytes (sqlite storage only)
+
+    Returns:
+        Dict of benchmark parameters and results
+    """
+    mailbox = FakeMailbox(thread_count, sender_count, unread_fraction)
+    expected = len(mailbox.unread) if unread_only else thread_count
+    limiter = sync.rate_limiter
+    if quota_rate is None:
+        sync.rate_limiter = QuotaTokenBucket(units_per_second=1e12, daily_limit=None)
+    else:
+        sync.rate_limiter = QuotaTokenBucket(units_per_second=quota_rate)
+
+    try:
+        with (
+            tempfile.TemporaryDirectory() as cache_dir,
+            FakeGmailServer(
+                mailbox,
+                latency=latency,
+                throttle_rate=throttle_rate,
+                error_rate=error_rate,
+            ) as server,
+        ):
+            sync_metrics.reset()
+            if trace_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            _, sender_threads = sync.get_sender_counts(
+                fetch_format=fetch_format,
+                incremental=False,
+                unread_only=unread_only,
+                storage_backend=storage_backend,
+                db_path=os.path.join(cache_dir, "gmail_stats.db"),
+                service_factory=server.build_service,
+                max_memory=max_memory,
+            )
+            elapsed = time.perf_counter() - start
+            heap_peak = None
+            if trace_memory:
+                heap_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            stats = server.stats.snapshot()
+    finally:
+        sync.rate_limiter = limiter
+
+    synced = sum(s.thread_count for s in (sender_threads or {}).values())
+    return {
+        "threads": thread_count,
+        "senders": sender_count,
+        "fetch_format": fetch_format,
+        "storage_backend": storage_backend,
+        "max_memory": max_memory,
+        "latency": latency,
+        "throttle_rate": throttle_rate,
+        "error_rate": error_rate,
+        "expected_threads": expected,
+        "synced_threads": synced,
+        "seconds": elapsed,
+        "threads_per_second": synced / elapsed if elapsed else 0.0,
+        "http_requests": stats["http_requests"],
+        "api_requests": stats["requests"],
+        "injected_errors": stats["errors"],
+        "bytes_sent": stats["bytes_received"],
+        "bytes_received": stats["bytes_sent"],
+        "peak_rss": peak_rss(),
+        "peak_heap": heap_peak,
+        "sync_metrics": sync_metrics.summary(),
+    }
+
+
+def format_bytes(size: Optional[int]) -> str:
+    if size is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def print_report(result: dict) -> None:
+    """Print benchmark results in a human-readable form."""
+    api_requests = ", ".join(
+        f"{method}={count}"
+        for method, count in sorted(result["api_requests"].items())
+        if method != "http"
+    )
+    print(
+        f"Synced {result['synced_threads']}/{result['expected_threads']} threads "
+        f"in {result['seconds']:.2f}s "
+        f"({result['threads_per_second']:.0f} threads/s)"
+    )
+    print(f"HTTP requests:   {result['http_requests']} ({api_requests})")
+    if result["injected_errors"]:
+        print(f"Injected errors: {result['injected_errors']}")
+    print(f"Bytes sent:      {format_bytes(result['bytes_sent'])}")
+    print(f"Bytes received:  {format_bytes(result['bytes_received'])}")
+    print(f"Peak RSS:        {format_bytes(result['peak_rss'])}")
+    if result["peak_heap"] is not None:
+        print(f"Peak heap:       {format_bytes(result['peak_heap'])}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=10_000)
+    parser.add_argument("--senders", type=int, default=1000)
+    parser.add_argument("--unread-fraction", type=float, default=0.5)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--format", choices=["metadata", "full"], default="metadata")
+    parser.add_argument("--all", action="store_true", help="List read threads too")
+    parser.add_argument(
+        "--storage", choices=["shelve", "sqlite", "chunked"], default="sqlite"
+    )
+    parser.add_argument(
+        "--quota-rate", type=float, help="Quota units per second (default: none)"
+    )
+    parser.add_argument("--trace-memory", action="store_true")
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        metavar="MB",
+        help="Run a bounded-memory sync that flushes threads above this RSS",
+    )
+    parser.add_argument("--json", metavar="PATH", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    result = run_sync_benchmark(
+        args.threads,
+        sender_count=args.senders,
+        unread_fraction=args.unread_fraction,
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        fetch_format=args.format,
+        unread_only=not args.all,
+        storage_backend=args.storage,
+        quota_rate=args.quota_rate,
+        trace_memory=args.trace_memory,
+        max_memory=args.max_memory * 2**20 if args.max_memory else None,
+    )
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0 if result["synced_threads"] == result["expected_threads"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
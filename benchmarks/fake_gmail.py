@@ -0,0 +1,508 @@
+"""Local stand-in for the parts of the Gmail API that gmail-stats uses.
+
+Serves users.threads.list, users.threads.get, batch requests,
+users.history.list and users.getProfile for a synthetic mailbox, with
+configurable latency and injected 429/5xx errors, and counts every request
+and byte so sync benchmarks can run without a real account.
+
+Run standalone with:
+
+    python -m benchmarks.fake_gmail --threads 100000 --port 8080
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+HISTORY_ID_BASE = 1_000_000
+# Size of the fake body attached to every message when format=full
+FULL_BODY_BYTES = 4096
+ERROR_REASONS = {
+    404: "Not Found",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class FakeMailbox:
+    """Deterministic synthetic mailbox of single-message threads.
+
+    Thread i gets its sender from a skewed distribution over sender_count
+    senders, so a few senders own most threads like in a real inbox, and is
+    unread with probability unread_fraction. Nothing is stored per thread
+    except the list of unread thread indexes used for listing.
+
+    Attributes:
+        thread_count: Number of threads in the inbox
+        sender_count: Number of distinct senders
+        history_id: Current historyId of the mailbox
+    """
+
+    def __init__(
+        self,
+        thread_count: int,
+        sender_count: int = 1000,
+        unread_fraction: float = 0.5,
+        seed: int = 0,
+    ):
+        """Initialize a FakeMailbox.
+
+        Args:
+            thread_count: Number of threads in the inbox
+            sender_count: Number of distinct senders
+            unread_fraction: Fraction of threads that are unread
+            seed: Seed varying which threads are unread and who sent them
+        """
+        self.thread_count = thread_count
+        self.sender_count = max(1, sender_count)
+        self.unread_fraction = unread_fraction
+        self.seed = seed
+        self.history_id = HISTORY_ID_BASE + thread_count
+        self.unread = [i for i in range(thread_count) if self.is_unread(i)]
+
+    def _fraction(self, index: int, salt: int) -> float:
+        # Knuth multiplicative hash, cheap enough for a million threads
+        value = ((index + 1) * 2654435761 + (self.seed + salt) * 40503) % 2**32
+        return value / 2**32
+
+    def is_unread(self, index: int) -> bool:
+        """Check whether thread index is unread."""
+        return self._fraction(index, 1) < self.unread_fraction
+
+    def sender(self, index: int) -> str:
+        """Get the From header of thread index."""
+        sender = int(self.sender_count * self._fraction(index, 2) ** 3)
+        return f"Sender {sender} <sender{sender}@example.com>"
+
+    def thread_id(self, index: int) -> str:
+        """Get the ID of thread index."""
+        return f"{index:012x}"
+
+    def index(self, thread_id: str) -> Optional[int]:
+        """Get the index of a thread ID, None if there is no such thread."""
+        try:
+            index = int(thread_id, 16)
+        except ValueError:
+            return None
+        return index if 0 <= index < self.thread_count else None
+
+    def labels(self, index: int) -> List[str]:
+        """Get the labels of thread index."""
+        return ["INBOX", "UNREAD"] if self.is_unread(index) else ["INBOX"]
+
+    def list_threads(
+        self, label_ids: List[str], page_token: Optional[str], max_results: int
+    ) -> dict:
+        """Build a threads.list response.
+
+        Args:
+            label_ids: Only list threads with all of these labels
+            page_token: Offset returned as nextPageToken by the previous page
+            max_results: Page size
+
+        Returns:
+            threads.list response body
+        """
+        indexes = self.unread if "UNREAD" in label_ids else range(self.thread_count)
+        start = int(page_token or 0)
+        end = min(start + max_results, len(indexes))
+        response = {
+            "threads": [
+                {
+                    "id": self.thread_id(i),
+                    "snippet": "",
+                    "historyId": str(HISTORY_ID_BASE + i),
+                }
+                for i in indexes[start:end]
+            ],
+            "resultSizeEstimate": len(indexes),
+        }
+        if end < len(indexes):
+            response["nextPageToken"] = str(end)
+        return response
+
+    def get_thread(self, index: int, fetch_format: str = "metadata") -> dict:
+        """Build a threads.get response.
+
+        Args:
+            index: Index of the thread
+            fetch_format: 'metadata' or 'full'
+
+        Returns:
+            threads.get response body
+        """
+        thread_id = self.thread_id(index)
+        message = {
+            "id": thread_id,
+            "threadId": thread_id,
+            "labelIds": self.labels(index),
+            "internalDate": str(1_600_000_000_000 + index * 60_000),
+            "payload": {
+                "headers": [
+                    {"name": "From", "value": self.sender(index)},
+                    {"name": "Subject", "value": f"Synthetic thread {index}"},
+                ]
+            },
+        }
+        if fetch_format == "full":
+            message["payload"]["body"] = {
+                "size": FULL_BODY_BYTES,
+                "data": "A" * FULL_BODY_BYTES,
+            }
+        return {
+            "id": thread_id,
+            "historyId": str(HISTORY_ID_BASE + index),
+            "messages": [message],
+        }
+
+
+class FakeGmailStats:
+    """Counters of the requests a FakeGmailServer has answered."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.errors: Dict[int, int] = {}
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def count(self, method: str) -> None:
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def count_error(self, status: int) -> None:
+        with self._lock:
+            self.errors[status] = self.errors.get(status, 0) + 1
+
+    def count_bytes(self, received: int, sent: int) -> None:
+        with self._lock:
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+    def snapshot(self) -> dict:
+        """Get the counters as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "http_requests": self.requests.get("http", 0),
+                "errors": {str(k): v for k, v in self.errors.items()},
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+            }
+
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    """Request handler answering Gmail API calls from the server's mailbox."""
+
+    protocol_version = "HTTP/1.1"
+    server: "FakeGmailServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle(b"")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self._handle(self.rfile.read(length))
+
+    def _handle(self, body: bytes) -> None:
+        self.server.stats.count("http")
+        self.server.delay()
+        if self.command == "POST" and urlsplit(self.path).path == "/batch":
+            status, headers, content = self._batch(body)
+        else:
+            status, content = self.server.route(self.command, self.path)
+            headers = {"Content-Type": "application/json; charset=UTF-8"}
+
+        # Counted before responding, so the counters are complete as soon
+        # as the client has its response
+        self.server.stats.count_bytes(
+            len(body) + len(self.requestline) + len(str(self.headers)), len(content)
+        )
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _batch(self, body: bytes) -> Tuple[int, dict, bytes]:
+        self.server.stats.count("batch")
+        error = self.server.inject_error()
+        if error:
+            return error, {}, self.server.error_body(error)
+
+        content_type = self.headers["Content-Type"]
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        boundary = "batch_fake_gmail"
+        parts = []
+        for part in message.iter_parts():
+            request = part.get_payload(decode=True).decode()
+            method, path = request.split("\n", 1)[0].split(" ")[:2]
+            status, content = self.server.route(method, path)
+            reason = ERROR_REASONS.get(status, "OK")
+            content_id = part["Content-ID"].strip()[1:-1]
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(content)}\r\n\r\n"
+                f"{content.decode()}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        return (
+            200,
+            {"Content-Type": f"multipart/mixed; boundary={boundary}"},
+            "".join(parts).encode(),
+        )
+
+
+class FakeGmailServer(ThreadingHTTPServer):
+    """HTTP server impersonating the Gmail API for a FakeMailbox.
+
+    Use as a context manager to serve from a background thread:
+
+        with FakeGmailServer(FakeMailbox(10_000)) as server:
+            service = server.build_service()
+
+    Attributes:
+        mailbox: Mailbox the API answers from
+        latency: Seconds added to every HTTP request
+        throttle_rate: Fraction of requests answered with 429
+        error_rate: Fraction of requests answered with 500 or 503
+        stats: Counters of the requests answered so far
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        mailbox: FakeMailbox,
+        latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int = 0,
+    ):
+        """Initialize a FakeGmailServer.
+
+        Args:
+            mailbox: Mailbox the API answers from
+            latency: Seconds added to every HTTP request
+            throttle_rate: Fraction of requests answered with 429
+            error_rate: Fraction of requests answered with 500 or 503
+            host: Interface to listen on
+            port: Port to listen on, 0 for any free port
+            seed: Seed for error injection
+        """
+        super().__init__((host, port), FakeGmailHandler)
+        self.mailbox = mailbox
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.stats = FakeGmailStats()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Get the root URL of the fake API."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self) -> "FakeGmailServer":
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="fake-gmail", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def delay(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def inject_error(self) -> Optional[int]:
+        """Pick an injected error status for a request, None for success."""
+        if not self.throttle_rate and not self.error_rate:
+            return None
+        with self._random_lock:
+            roll = self._random.random()
+            server_error = self._random.choice((500, 503))
+        if roll < self.throttle_rate:
+            status = 429
+        elif roll < self.throttle_rate + self.error_rate:
+            status = server_error
+        else:
+            return None
+        self.stats.count_error(status)
+        return status
+
+    def error_body(self, status: int) -> bytes:
+        reason = ERROR_REASONS.get(status, "Error")
+        return json.dumps(
+            {"error": {"code": status, "message": reason, "errors": []}}
+        ).encode()
+
+    def route(self, method: str, path: str) -> Tuple[int, bytes]:
+        """Answer a single (possibly batched) Gmail API request.
+
+        Args:
+            method: HTTP method
+            path: Request path with query string
+
+        Returns:
+            Tuple of HTTP status and JSON body
+        """
+        url = urlsplit(path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        # gmail/v1/users/{userId}/...
+        if parts[:3] != ["gmail", "v1", "users"] or len(parts) < 5 or method != "GET":
+            return 404, self.error_body(404)
+        resource = parts[4:]
+
+        if resource == ["threads"]:
+            api_method = "threads.list"
+        elif resource[0] == "threads" and len(resource) == 2:
+            api_method = "threads.get"
+        elif resource == ["history"]:
+            api_method = "history.list"
+        elif resource == ["profile"]:
+            api_method = "getProfile"
+        else:
+            return 404, self.error_body(404)
+
+        self.stats.count(api_method)
+        error = self.inject_error()
+        if error:
+            return error, self.error_body(error)
+
+        mailbox = self.mailbox
+        if api_method == "threads.list":
+            body = mailbox.list_threads(
+                query.get("labelIds", []),
+                query.get("pageToken", [None])[0],
+                int(query.get("maxResults", ["100"])[0]),
+            )
+        elif api_method == "threads.get":
+            index = mailbox.index(resource[1])
+            if index is None:
+                return 404, self.error_body(404)
+            body = mailbox.get_thread(index, query.get("format", ["full"])[0])
+        elif api_method == "history.list":
+            start = int(query.get("startHistoryId", ["0"])[0])
+            if start < HISTORY_ID_BASE:
+                return 404, self.error_body(404)
+            # The synthetic mailbox never changes
+            body = {"historyId": str(mailbox.history_id)}
+        else:
+            body = {
+                "emailAddress": "benchmark@example.com",
+                "messagesTotal": mailbox.thread_count,
+                "threadsTotal": mailbox.thread_count,
+                "historyId": str(mailbox.history_id),
+            }
+        return 200, json.dumps(body).encode()
+
+    def discovery_document(self) -> dict:
+        """Get the Gmail discovery document rewritten to point at this server."""
+        return fake_discovery_document(self.url)
+
+    def build_service(self, timeout: int = 60):
+        """Build a Gmail API service talking to this server.
+
+        Each call builds a service with its own httplib2.Http, like
+        gmail_stats.transport.build_service does with real credentials.
+        """
+        import httplib2
+        from googleapiclient.discovery import build_from_document
+
+        return build_from_document(
+            self.discovery_document(), http=httplib2.Http(timeout=timeout)
+        )
+
+
+_discovery_document = None
+
+
+def fake_discovery_document(root_url: str) -> dict:
+    """Get the bundled Gmail discovery document with its URLs replaced.
+
+    Args:
+        root_url: Root URL of the fake API, ending in a slash
+
+    Returns:
+        Discovery document for googleapiclient.discovery.build_from_document
+    """
+    global _discovery_document
+    if _discovery_document is None:
+        import googleapiclient
+
+        path = os.path.join(
+            os.path.dirname(googleapiclient.__file__),
+            "discovery_cache",
+            "documents",
+            "gmail.v1.json",
+        )
+        with open(path) as f:
+            _discovery_document = json.load(f)
+
+    document = copy.deepcopy(_discovery_document)
+    document["rootUrl"] = root_url
+    document["mtlsRootUrl"] = root_url
+    document["baseUrl"] = root_url
+    return document
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=10_000)
+    parser.add_argument("--senders", type=int, default=1000)
+    parser.add_argument("--unread-fraction", type=float, default=0.5)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    server = FakeGmailServer(
+        FakeMailbox(args.threads, args.senders, args.unread_fraction),
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        port=args.port,
+    )
+    print(f"Serving a {args.threads} thread mailbox at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats.snapshot(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""Microbenchmarks for the CPU-bound cache and CLI aggregation paths.
+
+Times storage save/load round trips for every backend, loads of sender
+counts only and of a single sender where a backend supports them, reads
+of a page of the stored rankings, building the rankings, sort_senders for every sort key with and without email grouping, and display_sender_table
+rendering on synthetic datasets at several scales. Each case records its
+best and median time and its peak traced allocation. Results can be saved
+as a JSON baseline, and later runs flag cases that got slower or allocate
+more than the baseline by more than a threshold.
+
+Examples:
+
+    # Record a baseline on this machine
+    python -m benchmarks.microbench --save-baseline
+
+    # Compare against it, exiting with 1 on regressions
+    python -m benchmarks.microbench
+
+    # Include the 1M thread scale
+    python -m benchmarks.microbench --scales 10k 100k 1m
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest import mock
+
+from rich.console import Console
+
+from gmail_stats import cli
+from gmail_stats.chunked_storage import ChunkedStorage
+from gmail_stats.grouping import EmailIndex, set_email_index
+from gmail_stats.rankings import SenderRankings, load_rankings
+from gmail_stats.sender import GmailSender
+from gmail_stats.sqlite_storage import SQLiteStorage
+from gmail_stats.storage import GmailStorage
+from gmail_stats.thread import GmailThread
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "microbench_baseline.json")
+BASELINE_VERSION = 1
+
+# Scale name -> (threads, senders)
+SCALES = {
+    "10k": (10_000, 1_000),
+    "100k": (100_000, 10_000),
+    "1m": (1_000_000, 100_000),
+}
+DEFAULT_SCALES = ("10k", "100k")
+
+# Senders per email address, so grouping by email has work to do
+NAMES_PER_EMAIL = 3
+# Rows rendered by the paged display case, like list-senders --limit
+DISPLAY_PAGE_SIZE = 50
+
+
+def build_dataset(
+    thread_count: int, sender_count: int, seed: int = 0
+) -> Tuple[OrderedDict, Dict[str, GmailSender]]:
+    """Build a synthetic sender dataset.
+
+    Threads are spread over senders with a skewed distribution, so a few
+    senders own most threads, and every email address is used by up to
+    NAMES_PER_EMAIL differently named senders.
+
+    Args:
+        thread_count: Number of threads
+        sender_count: Number of distinct sender strings
+        seed: Random seed
+
+    Returns:
+        Tuple of sender counts and GmailSender objects keyed by sender, as
+        returned by get_sender_counts
+    """
+    rng = random.Random(seed)
+    names = [
+        f"Sender {i % NAMES_PER_EMAIL} <sender{i // NAMES_PER_EMAIL}@example.com>"
+        for i in range(sender_count)
+    ]
+    sender_threads = {}
+    for index in range(thread_count):
+        name = names[int(sender_count * rng.random() ** 3)]
+        sender = sender_threads.get(name)
+        if sender is None:
+            sender = sender_threads[name] = GmailSender(name)
+        labels = ["INBOX", "UNREAD"] if rng.random() < 0.5 else ["INBOX"]
+        sender.add_thread(
+            GmailThread(
+                f"{index:012x}",
+                labels,
+                name,
+                f"Synthetic thread {index}",
+                history_id=str(1_000_000 + index),
+                message_count=rng.randint(1, 4),
+                date=1_600_000_000_000 + index * 60_000,
+            )
+        )
+    senders = OrderedDict(
+        sorted(
+            ((name, s.message_count) for name, s in sender_threads.items()),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+    )
+    return senders, sender_threads
+
+
+class Case:
+    """A benchmarked operation.
+
+    Attributes:
+        name: Case name, unique within a scale
+        run: Callable timed on every repetition, given the value returned
+            by setup
+        setup: Untimed callable run before every repetition, or None
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable,
+        setup: Optional[Callable] = None,
+    ):
+        """Initialize a Case.
+
+        Args:
+            name: Case name, unique within a scale
+            run: Callable timed on every repetition
+            setup: Untimed callable whose result is passed to run
+        """
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+    def _call(self):
+        arg = self.setup() if self.setup else None
+        start = time.perf_counter()
+        self.run(arg)
+        return time.perf_counter() - start
+
+    def measure(self, repeat: int) -> dict:
+        """Time the case and trace its peak allocation.
+
+        Args:
+            repeat: Number of timed repetitions
+
+        Returns:
+            Dict with the best and median time in seconds and the peak
+            traced allocation in bytes
+        """
+        times = [self._call() for _ in range(repeat)]
+
+        arg = self.setup() if self.setup else None
+        tracemalloc.start()
+        try:
+            self.run(arg)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            "seconds": min(times),
+            "median_seconds": statistics.median(times),
+            "peak_bytes": peak,
+        }
+
+
+def build_cases(
+    senders: OrderedDict, sender_threads: Dict[str, GmailSender], workdir: str
+) -> List[Case]:
+    """Build the benchmark cases for a dataset.
+
+    Args:
+        senders: Sender counts of the dataset
+        sender_threads: GmailSender objects of the dataset
+        workdir: Directory for the caches written by the storage cases
+
+    Returns:
+        List of cases
+    """
+    cases = []
+    paths = iter(range(sys.maxsize))
+
+    def fresh_path(suffix):
+        return os.path.join(workdir, f"{next(paths)}{suffix}")
+
+    backends = (
+        ("shelve", GmailStorage, ""),
+        ("sqlite", SQLiteStorage, ".sqlite3"),
+        ("chunked", ChunkedStorage, ".chunks"),
+    )
+    top_sender = next(iter(senders))
+    # Loads start without the chunked index a previous repetition read
+    forget_indexes = ChunkedStorage._mappings.clear
+    for name, storage_class, suffix in backends:
+        saved_path = fresh_path(suffix)
+        storage_class(saved_path).save_data(senders, sender_threads, "0")
+
+        cases.append(
+            Case(
+                f"storage.{name}.save",
+                lambda storage: storage.save_data(senders, sender_threads, "0"),
+                lambda c=storage_class, s=suffix: c(fresh_path(s)),
+            )
+        )
+        cases.append(
+            Case(
+                f"storage.{name}.load",
+                lambda _, c=storage_class, p=saved_path: c(
+                    p, cache_duration=None
+                ).load_data(),
+                forget_indexes,
+            )
+        )
+        cases.append(
+            Case(
+                f"storage.{name}.rankings_page",
+                lambda _, c=storage_class, p=saved_path: load_rankings(c(p)).page(
+                    limit=DISPLAY_PAGE_SIZE
+                ),
+            )
+        )
+        if not hasattr(storage_class, "load_sender_counts"):
+            continue
+        cases.append(
+            Case(
+                f"storage.{name}.load_counts",
+                lambda _, c=storage_class, p=saved_path: c(p).load_sender_counts(),
+                forget_indexes,
+            )
+        )
+        cases.append(
+            Case(
+                f"storage.{name}.load_sender",
+                lambda _, c=storage_class, p=saved_path: c(p).load_sender(top_sender),
+                forget_indexes,
+            )
+        )
+
+    cases.append(Case("email_index.build", lambda _: EmailIndex(sender_threads)))
+    cases.append(Case("rankings.build", lambda _: SenderRankings.build(sender_threads)))
+    for sort_by in cli.SORT_KEYS:
+        cases.append(
+            Case(
+                f"sort_senders.{sort_by}",
+                lambda _, k=sort_by: cli.sort_senders(sender_threads, k),
+            )
+        )
+        cases.append(
+            Case(
+                f"sort_senders.{sort_by}.grouped",
+                lambda _, k=sort_by: cli.sort_senders(sender_threads, k, True),
+                lambda: set_email_index(EmailIndex(sender_threads)),
+            )
+        )
+
+    def render(limit):
+        console = Console(file=io.StringIO(), width=120, color_system=None)
+        with mock.patch.object(cli, "console", console):
+            cli.display_sender_table(sender_threads, limit=limit)
+
+    cases.append(
+        Case(
+            f"display_sender_table.top{DISPLAY_PAGE_SIZE}",
+            lambda _: render(DISPLAY_PAGE_SIZE),
+        )
+    )
+    cases.append(Case("display_sender_table.all", lambda _: render(None)))
+    return cases
+
+
+def run_microbenchmarks(
+    scales: Dict[str, Tuple[int, int]],
+    repeat: int = 3,
+    cases: Optional[List[str]] = None,
+    on_result: Optional[Callable[[str, str, dict], None]] = None,
+) -> dict:
+    """Run every case at every scale.
+
+    Args:
+        scales: Scale name -> (threads, senders)
+        repeat: Timed repetitions per case
+        cases: Only run cases whose name starts with one of these prefixes
+        on_result: Called with the scale, case name and result of each case
+
+    Returns:
+        Results in baseline format
+    """
+    results = {}
+    for scale, (thread_count, sender_count) in scales.items():
+        senders, sender_threads = build_dataset(thread_count, sender_count)
+        results[scale] = {}
+        with tempfile.TemporaryDirectory() as workdir:
+            for case in build_cases(senders, sender_threads, workdir):
+                if cases and not any(case.name.startswith(c) for c in cases):
+                    continue
+                result = case.measure(repeat)
+                results[scale][case.name] = result
+                if on_result:
+                    on_result(scale, case.name, result)
+        set_email_index(None)
+    return {
+        "version": BASELINE_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scales": {name: list(scales[name]) for name in scales},
+        "results": results,
+    }
+
+
+def find_regressions(
+    results: dict,
+    baseline: dict,
+    time_threshold: float = 0.25,
+    memory_threshold: float = 0.10,
+) -> List[dict]:
+    """Compare results against a baseline.
+
+    Only cases present in both are compared, and scales whose dataset size
+    differs from the baseline's are skipped.
+
+    Args:
+        results: Results of run_microbenchmarks
+        baseline: Earlier results of run_microbenchmarks
+        time_threshold: Allowed relative increase of the best time
+        memory_threshold: Allowed relative increase of the peak allocation
+
+    Returns:
+        List of regressions with the scale, case, metric, baseline value,
+        current value and their ratio
+    """
+    regressions = []
+    if baseline.get("version") != BASELINE_VERSION:
+        return regressions
+    for scale, cases in results["results"].items():
+        if baseline.get("scales", {}).get(scale) != results["scales"].get(scale):
+            continue
+        baseline_cases = baseline.get("results", {}).get(scale, {})
+        for name, result in cases.items():
+            previous = baseline_cases.get(name)
+            if previous is None:
+                continue
+            for metric, threshold in (
+                ("seconds", time_threshold),
+                ("peak_bytes", memory_threshold),
+            ):
+                old, new = previous.get(metric), result[metric]
+                if old and new > old * (1 + threshold):
+                    regressions.append(
+                        {
+                            "scale": scale,
+                            "case": name,
+                            "metric": metric,
+                            "baseline": old,
+                            "current": new,
+                            "ratio": new / old,
+                        }
+                    )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scales", nargs="+", choices=list(SCALES), default=list(DEFAULT_SCALES)
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--case", action="append", help="Only run cases starting with this name"
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file")
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="Save results as the baseline"
+    )
+    parser.add_argument("--time-threshold", type=float, default=0.25)
+    parser.add_argument("--memory-threshold", type=float, default=0.10)
+    parser.add_argument("--json", metavar="PATH", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    def report(scale, name, result):
+        print(
+            f"{scale:>5} {name:<40} {result['seconds'] * 1000:10.1f} ms "
+            f"{result['peak_bytes'] / 2**20:10.1f} MiB"
+        )
+
+    results = run_microbenchmarks(
+        {name: SCALES[name] for name in args.scales},
+        repeat=args.repeat,
+        cases=args.case,
+        on_result=report,
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(
+        results, baseline, args.time_threshold, args.memory_threshold
+    )
+    for regression in regressions:
+        print(
+            f"REGRESSION {regression['scale']} {regression['case']} "
+            f"{regression['metric']}: {regression['baseline']:.4g} -> "
+            f"{regression['current']:.4g} ({regression['ratio']:.2f}x)"
+        )
+    if not regressions:
+        print("No regressions against the baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
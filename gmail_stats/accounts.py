@@ -0,0 +1,400 @@
+import json
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional
+
+from .sender import GmailSender
+from .storage import DEFAULT_STORAGE_BACKEND, STORAGE_BACKENDS, open_storage
+
+logger = logging.getLogger(__name__)
+
+# Registry of the mailboxes synced by sync-all
+REGISTRY_PATH = os.path.join(".env", "accounts.json")
+# Directory holding one subdirectory of token and cache files per account
+ACCOUNTS_DIR = os.path.join(".env", "accounts")
+# Account names are used as directory names
+ACCOUNT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9@._+-]+$")
+# Upper bound of the default number of accounts synced at once
+MAX_SYNC_WORKERS = 32
+
+# Cache file name of each storage backend inside an account directory
+STORAGE_FILES = {
+    "shelve": "gmail_data",
+    "sqlite": "gmail_data.sqlite3",
+    "chunked": "gmail_data.chunks",
+}
+
+
+class Account:
+    """A mailbox with its own credentials, cache and quota budget.
+
+    Attributes:
+        name: Account name, unique in the registry
+        credentials_path: OAuth client secrets file, None for the shared
+            .env/credentials.json
+        token_path: Saved token file of the account
+        storage_backend: Storage backend for the account's cache
+        db_path: Path of the account's cache
+        quota_rate: Quota units per second the account may use, None for
+            Gmail's per-user limit
+        daily_quota: Quota units per day the account may use, None for
+            the rate limiter's default
+    """
+
+    def __init__(
+        self,
+        name: str,
+        credentials_path: Optional[str] = None,
+        token_path: Optional[str] = None,
+        storage_backend: str = DEFAULT_STORAGE_BACKEND,
+        db_path: Optional[str] = None,
+        quota_rate: Optional[float] = None,
+        daily_quota: Optional[int] = None,
+    ):
+        """Initialize an Account.
+
+        Args:
+            name: Account name, unique in the registry
+            credentials_path: OAuth client secrets file, None for the shared one
+            token_path: Saved token file, a file in the account directory if None
+            storage_backend: Storage backend for the account's cache
+            db_path: Path of the cache, a file in the account directory if None
+            quota_rate: Quota units per second the account may use
+            daily_quota: Quota units per day the account may use
+
+        Raises:
+            ValueError: If the name can't be used as a directory name or the
+                storage backend is unknown
+        """
+        if not ACCOUNT_NAME_PATTERN.match(name) or name in (".", ".."):
+            raise ValueError(f"Invalid account name: {name!r}")
+        if storage_backend not in STORAGE_BACKENDS:
+            raise ValueError(f"Invalid storage backend: {storage_backend}")
+        directory = os.path.join(ACCOUNTS_DIR, name)
+        self.name = name
+        self.credentials_path = credentials_path
+        self.token_path = token_path or os.path.join(directory, "token.pickle")
+        self.storage_backend = storage_backend
+        self.db_path = db_path or os.path.join(
+            directory, STORAGE_FILES[storage_backend]
+        )
+        self.quota_rate = quota_rate
+        self.daily_quota = daily_quota
+
+    @property
+    def logged_in(self) -> bool:
+        """Check whether the account has a saved token."""
+        return os.path.exists(self.token_path)
+
+    def sync_options(self) -> dict:
+        """Get the get_sender_counts arguments selecting this account."""
+        return {
+            "storage_backend": self.storage_backend,
+            "db_path": self.db_path,
+            "credentials_path": self.credentials_path,
+            "token_path": self.token_path,
+        }
+
+    def to_dict(self) -> dict:
+        """Convert the account to a JSON-serializable dictionary."""
+        return {
+            "credentials_path": self.credentials_path,
+            "token_path": self.token_path,
+            "storage_backend": self.storage_backend,
+            "db_path": self.db_path,
+            "quota_rate": self.quota_rate,
+            "daily_quota": self.daily_quota,
+        }
+
+    @classmethod
+    def from_dict(cls, name: str, data: dict) -> "Account":
+        """Create an account from a dictionary returned by to_dict()."""
+        return cls(name, **data)
+
+    def __repr__(self) -> str:
+        return f"Account(name={self.name!r}, storage_backend={self.storage_backend!r})"
+
+
+class AccountRegistry:
+    """The accounts known to this installation, stored as JSON.
+
+    Attributes:
+        path: Path of the registry file
+        accounts: Accounts keyed by name, in the order they were added
+    """
+
+    def __init__(self, path: str = REGISTRY_PATH):
+        """Load the registry, which is empty if the file doesn't exist.
+
+        Args:
+            path: Path of the registry file
+        """
+        self.path = path
+        self.accounts: Dict[str, Account] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            for name, account in data.get("accounts", {}).items():
+                self.accounts[name] = Account.from_dict(name, account)
+
+    def save(self) -> None:
+        """Write the registry, replacing the file atomically."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "accounts": {
+                        name: account.to_dict()
+                        for name, account in self.accounts.items()
+                    }
+                },
+                f,
+                indent=2,
+            )
+        os.replace(tmp_path, self.path)
+
+    def add(self, account: Account) -> None:
+        """Register an account and save the registry.
+
+        Args:
+            account: Account to register
+
+        Raises:
+            ValueError: If an account with the same name exists
+        """
+        if account.name in self.accounts:
+            raise ValueError(f"Account {account.name} already exists")
+        self.accounts[account.name] = account
+        self.save()
+
+    def remove(self, name: str) -> Account:
+        """Unregister an account and save the registry.
+
+        Its token and cache files are left in place.
+
+        Args:
+            name: Account name
+
+        Returns:
+            The removed account
+
+        Raises:
+            KeyError: If there is no such account
+        """
+        account = self.get(name)
+        del self.accounts[name]
+        self.save()
+        return account
+
+    def get(self, name: str) -> Account:
+        """Get an account by name.
+
+        Raises:
+            KeyError: If there is no such account
+        """
+        try:
+            return self.accounts[name]
+        except KeyError:
+            raise KeyError(f"No account named {name}") from None
+
+    def __iter__(self) -> Iterator[Account]:
+        return iter(self.accounts.values())
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+
+def init_worker() -> None:
+    """Prepare a sync-all worker process.
+
+    Interrupts only ask the sync to stop, so it checkpoints and returns
+    instead of the worker dying, and progress bars are turned off since
+    several syncs share the terminal.
+    """
+    from . import sync
+
+    sync.show_progress = False
+    signal.signal(signal.SIGINT, lambda signum, frame: sync.shutdown_event.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: sync.shutdown_event.set())
+
+
+def sender_counts(sender_threads: Dict[str, GmailSender]) -> Dict[str, list]:
+    """Get the aggregates of every sender, without their threads.
+
+    Args:
+        sender_threads: Dict of GmailSender objects keyed by sender
+
+    Returns:
+        Dict of [message count, thread count, unread count, first seen,
+        last seen] keyed by sender
+    """
+    return {
+        key: [
+            sender.message_count,
+            sender.thread_count,
+            sender.unread_count,
+            sender.first_seen,
+            sender.last_seen,
+        ]
+        for key, sender in sender_threads.items()
+    }
+
+
+def sync_account(account: Account, sync_options: dict, offline: bool = False) -> dict:
+    """Sync one account, in the worker process running it.
+
+    The rate limiter, fetch scheduler and metrics of the sync module are
+    per process, so they are reset here for the account in case the worker
+    synced another account before.
+
+    Args:
+        account: Account to sync
+        sync_options: get_sender_counts arguments shared by every account
+        offline: Only read the account's cache instead of syncing
+
+    Returns:
+        Dict with the account name, whether it succeeded, the error if not,
+        the time taken, the sender aggregates and the sync metrics summary
+    """
+    from .metrics import sync_metrics
+
+    start = time.perf_counter()
+    result = {"account": account.name, "ok": False, "error": None, "senders": {}}
+    try:
+        if offline:
+            storage = open_storage(
+                account.storage_backend, account.db_path, cache_duration=None
+            )
+            if hasattr(storage, "load_sender_counts"):
+                # Only the aggregates are sent back
+                _, sender_threads = storage.load_sender_counts()
+            else:
+                _, sender_threads, _ = storage.load_data()
+        else:
+            from . import sync
+            from .ratelimit import QuotaTokenBucket
+
+            limits = {}
+            if account.quota_rate is not None:
+                limits["units_per_second"] = account.quota_rate
+            if account.daily_quota is not None:
+                limits["daily_limit"] = account.daily_quota
+            sync.rate_limiter = QuotaTokenBucket(**limits)
+            sync.shutdown_event.clear()
+            sync.cleanup_resources()
+            sync_metrics.reset()
+            _, sender_threads = sync.get_sender_counts(
+                **{**sync_options, **account.sync_options()}
+            )
+            if sync.shutdown_event.is_set():
+                raise InterruptedError("Sync interrupted, run again to resume")
+        result["senders"] = sender_counts(sender_threads or {})
+        result["ok"] = True
+    except Exception as e:
+        logger.error(f"Error syncing account {account.name}: {str(e)}")
+        result["error"] = str(e) or type(e).__name__
+    result["seconds"] = time.perf_counter() - start
+    result["metrics"] = sync_metrics.summary()
+    return result
+
+
+def default_workers(account_count: int) -> int:
+    """Get how many accounts to sync at once by default.
+
+    Syncs wait on the network rather than the CPU, so every account gets
+    its own process, up to MAX_SYNC_WORKERS.
+    """
+    return max(1, min(account_count, MAX_SYNC_WORKERS))
+
+
+def sync_accounts(
+    accounts: List[Account],
+    sync_options: dict,
+    offline: bool = False,
+    workers: Optional[int] = None,
+    on_result: Optional[Callable[[dict], None]] = None,
+) -> List[dict]:
+    """Sync several accounts concurrently, each in its own process.
+
+    Every process has its own credentials, cache, rate limiter, scheduler
+    and shutdown flag, so syncing N accounts takes about as long as the
+    slowest of them when there are at least N workers.
+
+    Args:
+        accounts: Accounts to sync
+        sync_options: get_sender_counts arguments shared by every account
+        offline: Only read each account's cache instead of syncing
+        workers: Number of worker processes, see default_workers if None
+        on_result: Called with each account's result as it finishes
+
+    Returns:
+        Results of sync_account, in the order of accounts
+    """
+    if not accounts:
+        return []
+    workers = workers or default_workers(len(accounts))
+    results = {}
+    # Workers are spawned rather than forked, since the parent may already
+    # run threads
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(accounts)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+    ) as executor:
+        futures = {
+            executor.submit(sync_account, account, sync_options, offline): account
+            for account in accounts
+        }
+        for future in as_completed(futures):
+            account = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process died
+                result = {
+                    "account": account.name,
+                    "ok": False,
+                    "error": str(e) or type(e).__name__,
+                    "senders": {},
+                    "seconds": None,
+                    "metrics": None,
+                }
+            results[account.name] = result
+            if on_result:
+                on_result(result)
+    return [results[account.name] for account in accounts]
+
+
+def combine_account_senders(results: List[dict]) -> Dict[str, GmailSender]:
+    """Add up the senders of several accounts.
+
+    Args:
+        results: Results of sync_account
+
+    Returns:
+        Dict of count-only GmailSender objects keyed by sender, with each
+        sender's counts summed over every account
+    """
+    combined = {}
+    for result in results:
+        for key, (messages, threads, unread, first, last) in result["senders"].items():
+            total = combined.get(key)
+            if total is None:
+                combined[key] = [messages, threads, unread, first, last]
+                continue
+            total[0] += messages
+            total[1] += threads
+            total[2] += unread
+            if first is not None:
+                total[3] = first if total[3] is None else min(total[3], first)
+            if last is not None:
+                total[4] = last if total[4] is None else max(total[4], last)
+    return {
+        key: GmailSender.from_counts(key, *counts) for key, counts in combined.items()
+    }
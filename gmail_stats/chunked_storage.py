@@ -0,0 +1,330 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from .profiling import timed
+from .rankings import RANKINGS_KEY, update_rankings_state
+from .sender import GmailSender
+from .thread import GmailThread
+
+logger = logging.getLogger(__name__)
+
+# Identifies a chunked cache file and the version of its layout
+MAGIC = b"GMSC"
+FORMAT_VERSION = 1
+# Magic, format version, then the offset and length of the index
+HEADER = struct.Struct("<4sHxxQQ")
+
+
+class ChunkedStorage:
+    """Handles persistence of Gmail data in a chunked, memory-mapped file.
+
+    The file holds one zlib-compressed block of threads per sender followed
+    by a compressed index of every sender's block offset and aggregate
+    counts, so listing senders only reads the index and showing a sender
+    only decompresses its block. Files are read through mmap and replaced
+    atomically on save, so readers never see a partly written file.
+
+    Sync state is kept as JSON in a file next to the cache.
+
+    Attributes:
+        db_path: Path to the cache file
+        state_path: Path to the sync state file
+        cache_duration: How long to keep cached data (default: 24 hours)
+    """
+
+    # Mapping and index of each file as last read, keyed by path, so the
+    # storages a command opens share one read of the index
+    _mappings: Dict[str, tuple] = {}
+
+    def __init__(
+        self,
+        db_path: str = ".env/gmail_data.chunks",
+        cache_duration: Optional[int] = 24,
+    ):
+        """Initialize ChunkedStorage.
+
+        Args:
+            db_path: Path to the cache file
+            cache_duration: How long to keep cached data in hours, None to
+                keep it until it is replaced
+        """
+        self.db_path = db_path
+        self.state_path = f"{db_path}.state"
+        self.cache_duration = (
+            timedelta(hours=cache_duration) if cache_duration is not None else None
+        )
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+
+    def _is_cache_valid(self, last_sync: str) -> bool:
+        """Check if cached data is still valid.
+
+        Args:
+            last_sync: ISO format timestamp of last sync
+
+        Returns:
+            True if cache is valid, False otherwise
+        """
+        if not last_sync:
+            return False
+        if self.cache_duration is None:
+            return True
+
+        last_sync_time = datetime.fromisoformat(last_sync)
+        return datetime.now() - last_sync_time < self.cache_duration
+
+    def _map(self) -> Optional[Tuple[mmap.mmap, dict, dict]]:
+        """Map the cache file and read its index.
+
+        The mapping is reused until the file is replaced by a save.
+
+        Returns:
+            Tuple of the mapping, the index and the index's blocks keyed by
+            sender, or None if there is no cache file
+
+        Raises:
+            ValueError: If the file is not a chunked cache
+        """
+        try:
+            stat = os.stat(self.db_path)
+        except FileNotFoundError:
+            return None
+        path = os.path.abspath(self.db_path)
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        mapping = self._mappings.get(path)
+        if mapping is not None and mapping[0] == identity:
+            return mapping[1:]
+
+        with open(self.db_path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(data) < HEADER.size:
+            raise ValueError(f"{self.db_path} is not a chunked cache")
+        magic, version, index_offset, index_length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{self.db_path} is not a chunked cache")
+        index = json.loads(
+            zlib.decompress(data[index_offset : index_offset + index_length])
+        )
+        blocks = {block[0]: block for block in index["blocks"]}
+        # Readers still holding the previous mapping keep it open
+        self._mappings[path] = (identity, data, index, blocks)
+        return data, index, blocks
+
+    def _read_block(self, data: mmap.mmap, block: list) -> GmailSender:
+        """Decompress one sender's block of threads."""
+        _, name, offset, length = block[:4]
+        sender = GmailSender(name)
+        for row in json.loads(zlib.decompress(data[offset : offset + length])):
+            sender.add_thread(GmailThread(*row))
+        return sender
+
+    @timed("storage.save")
+    def save_data(
+        self,
+        senders: OrderedDict,
+        sender_threads: Dict[str, GmailSender],
+        last_thread_id: str,
+    ) -> None:
+        """Save Gmail data, writing a new file and replacing the old one.
+
+        Args:
+            senders: OrderedDict of sender email addresses and their message counts
+            sender_threads: Dict of GmailSender objects keyed by sender email
+            last_thread_id: ID of the last processed thread
+        """
+        tmp_path = f"{self.db_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, 0))
+                blocks = []
+                for key, sender in sender_threads.items():
+                    rows = [
+                        [
+                            t.thread_id,
+                            t.labels,
+                            t.sender,
+                            t.subject,
+                            t.history_id,
+                            t.message_count,
+                            t.date,
+                        ]
+                        for t in sender.threads
+                    ]
+                    block = zlib.compress(json.dumps(rows).encode())
+                    blocks.append(
+                        [
+                            key,
+                            sender.sender,
+                            f.tell(),
+                            len(block),
+                            sender.message_count,
+                            sender.thread_count,
+                            sender.unread_count,
+                            sender.first_seen,
+                            sender.last_seen,
+                        ]
+                    )
+                    f.write(block)
+
+                index = zlib.compress(
+                    json.dumps(
+                        {
+                            "senders": list(senders.items()),
+                            "blocks": blocks,
+                            "last_thread_id": last_thread_id,
+                            "last_sync": datetime.now().isoformat(),
+                        }
+                    ).encode()
+                )
+                index_offset = f.tell()
+                f.write(index)
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, index_offset, len(index)))
+            os.replace(tmp_path, self.db_path)
+            self.set_state(
+                RANKINGS_KEY,
+                update_rankings_state(self.get_state(RANKINGS_KEY), sender_threads),
+            )
+
+            logger.info(f"Successfully saved compressed data to {self.db_path}")
+        except Exception as e:
+            logger.error(f"Error saving data: {str(e)}")
+            raise
+
+    @timed("storage.load")
+    def load_data(
+        self,
+    ) -> Tuple[Optional[OrderedDict], Optional[Dict[str, GmailSender]], Optional[str]]:
+        """Load Gmail data, decompressing every sender's block.
+
+        Returns:
+            Tuple containing:
+            - OrderedDict of sender email addresses and their message counts
+            - Dict of GmailSender objects keyed by sender email
+            - ID of the last processed thread
+        """
+        try:
+            mapping = self._map()
+            if mapping is None:
+                logger.info("No existing data found")
+                return None, None, None
+            data, index, blocks = mapping
+
+            if not self._is_cache_valid(index.get("last_sync")):
+                logger.info("Cache expired, will fetch fresh data")
+                return None, None, None
+
+            logger.info(f"Last sync: {index['last_sync']}")
+            sender_threads = {
+                key: self._read_block(data, block) for key, block in blocks.items()
+            }
+            return (
+                OrderedDict(index["senders"]),
+                sender_threads,
+                index["last_thread_id"],
+            )
+
+        except Exception as e:
+            logger.error(f"Error loading data: {str(e)}")
+            return None, None, None
+
+    @timed("storage.load")
+    def load_sender_counts(
+        self,
+    ) -> Tuple[Optional[OrderedDict], Optional[Dict[str, GmailSender]]]:
+        """Load sender counts from the index without decompressing any thread.
+
+        Returns:
+            Tuple containing:
+            - OrderedDict of sender email addresses and their message counts
+            - Dict of GmailSender objects keyed by sender email, holding
+              counts and dates only (see GmailSender.from_counts)
+            Both are None if nothing is cached.
+        """
+        try:
+            mapping = self._map()
+        except Exception as e:
+            logger.error(f"Error loading data: {str(e)}")
+            return None, None
+        if mapping is None:
+            logger.info("No existing data found")
+            return None, None
+        _, index, blocks = mapping
+        sender_threads = {
+            key: GmailSender.from_counts(block[1], *block[4:])
+            for key, block in blocks.items()
+        }
+        return OrderedDict(index["senders"]), sender_threads
+
+    def load_sender(self, sender: str) -> Optional[GmailSender]:
+        """Load a single sender by decompressing only its block.
+
+        Args:
+            sender: Sender key as used in sender_threads
+
+        Returns:
+            The GmailSender, or None if there are no threads from it
+        """
+        mapping = self._map()
+        if mapping is None or sender not in mapping[2]:
+            return None
+        data, _, blocks = mapping
+        return self._read_block(data, blocks[sender])
+
+    def _read_state(self) -> dict:
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def get_state(self, key: str, default=None):
+        """Read a piece of sync state stored next to the cached data.
+
+        Args:
+            key: Name of the state entry
+            default: Value to return if the entry does not exist
+
+        Returns:
+            The stored value or default
+        """
+        try:
+            return self._read_state().get(key, default)
+        except Exception as e:
+            logger.error(f"Error loading state {key}: {str(e)}")
+            return default
+
+    def set_state(self, key: str, value) -> None:
+        """Store a piece of sync state next to the cached data.
+
+        Args:
+            key: Name of the state entry
+            value: JSON-serializable value to store
+        """
+        try:
+            state = self._read_state()
+            state[key] = value
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            logger.error(f"Error saving state {key}: {str(e)}")
+            raise
+
+    def clear_cache(self) -> None:
+        """Clear all cached data."""
+        try:
+            for path in (self.db_path, self.state_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._mappings.pop(os.path.abspath(self.db_path), None)
+            logger.info("Cache cleared successfully")
+        except Exception as e:
+            logger.error(f"Error clearing cache: {str(e)}")
+            raise
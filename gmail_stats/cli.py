@@ -1,103 +1,313 @@
 import click
+import heapq
 import logging
+import signal
+import threading
+import tracemalloc
 from typing import Dict, Optional, List
 from collections import OrderedDict
+from datetime import datetime
+from operator import attrgetter
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
 from rich import box
+from rich.progress import (
+    BarColumn,
+    Progress,
+    SpinnerColumn,
+    TextColumn,
+    TimeElapsedColumn,
+)
 
-from . import get_sender_counts
+from .accounts import (
+    Account,
+    AccountRegistry,
+    combine_account_senders,
+    sync_accounts,
+)
+from .daemon import (
+    CONNECT_TIMEOUT,
+    DEFAULT_REFRESH_MINUTES,
+    REFRESH_TIMEOUT,
+    DaemonClient,
+    GmailStatsDaemon,
+    connect_daemon,
+    socket_path,
+)
 from .sender import GmailSender
+from .grouping import (
+    EMAIL_INDEX_KEY,
+    EmailIndex,
+    SenderGroup,
+    get_email_index,
+    set_email_index,
+)
+from .metrics import SyncMetrics, sync_metrics
+from .profiling import profiler, timed
+from .rankings import load_rankings
+from .storage import STORAGE_BACKENDS, open_storage
 from .thread import GmailThread
 
 console = Console()
 
 
-def group_senders_by_email(
-    senders: Dict[str, GmailSender],
-) -> Dict[str, List[GmailSender]]:
-    """Group senders by their email address.
+def get_sender_counts(**sync_options):
+    """Sync with Gmail and get sender counts and threads.
+
+    gmail_stats.sync and the Google client libraries are only imported here,
+    so commands answered from the cache start quickly.
 
     Args:
-        senders: Dict of GmailSender objects
+        **sync_options: Keyword arguments for gmail_stats.sync.get_sender_counts
+
+    Returns:
+        Tuple of sender counts and GmailSender objects keyed by sender
+    """
+    with profiler.span("import sync"):
+        from . import sync
+
+    sync.install_signal_handlers()
+    return sync.get_sender_counts(**sync_options)
+
+
+def load_cached_sender_counts(storage_backend: str = None, db_path: str = None):
+    """Get sender counts and threads from the cache without syncing.
+
+    Backends that can load sender counts without threads do so, and the
+    threads of a sender are read when it is shown, see load_evicted_threads.
+
+    Args:
+        storage_backend: Storage backend for cached data
+        db_path: Path of the cache, the backend's default path if None
+
+    Returns:
+        Tuple of sender counts and GmailSender objects keyed by sender, or
+        (None, None) if nothing is cached
+    """
+    storage = open_storage(storage_backend, db_path, cache_duration=None)
+    if hasattr(storage, "load_sender_counts"):
+        senders, sender_threads = storage.load_sender_counts()
+    else:
+        senders, sender_threads, _ = storage.load_data()
+    if not sender_threads:
+        console.print("[yellow]No cached data, run without --offline to sync.[/yellow]")
+        return None, None
+    set_email_index(EmailIndex.load(sender_threads, storage.get_state(EMAIL_INDEX_KEY)))
+    return senders, sender_threads
+
+
+def load_sender_counts(ctx: click.Context):
+    """Get sender data for a command, from the cache only if --offline.
+
+    Args:
+        ctx: Click context holding the group options
+
+    Returns:
+        Tuple of sender counts and GmailSender objects keyed by sender
+    """
+    if ctx.obj.get("offline"):
+        return load_cached_sender_counts(
+            ctx.obj["sync_options"]["storage_backend"],
+            ctx.obj["sync_options"].get("db_path"),
+        )
+    return get_sender_counts(**ctx.obj["sync_options"])
+
+
+def load_evicted_threads(ctx: click.Context, sender):
+    """Reload threads a bounded-memory sync left in storage.
+
+    Args:
+        ctx: Click context holding the group options
+        sender: GmailSender or SenderGroup about to be displayed
 
     Returns:
-        Dict mapping email addresses to lists of GmailSender objects
+        sender, with the threads of every evicted member loaded
     """
-    email_groups = {}
-    for sender in senders.values():
-        email = sender.get_email()
-        if email not in email_groups:
-            email_groups[email] = []
-        email_groups[email].append(sender)
-    return email_groups
+    evicted = [m for m in getattr(sender, "members", [sender]) if m.threads_evicted]
+    if evicted:
+        storage = open_storage(
+            ctx.obj["sync_options"]["storage_backend"],
+            ctx.obj["sync_options"].get("db_path"),
+            cache_duration=None,
+        )
+        for member in evicted:
+            stored = storage.load_sender(member.sender)
+            if stored is not None:
+                member.threads = stored.threads
+    return sender
 
 
-def merge_sender_group(group: List[GmailSender]) -> GmailSender:
-    """Merge a group of senders into a single GmailSender object.
+def connect_to_daemon(ctx: click.Context) -> Optional[DaemonClient]:
+    """Find a running daemon that can answer a command.
 
     Args:
-        group: List of GmailSender objects to merge
+        ctx: Click context holding the group options
 
     Returns:
-        Merged GmailSender object
+        Client of the daemon, or None to load the data in-process
     """
-    if not group:
+    sync_options = ctx.obj["sync_options"]
+    # --full-sync asks for a sync now rather than the daemon's last one
+    if ctx.obj.get("no_daemon") or not sync_options["incremental"]:
         return None
+    return connect_daemon(sync_options)
+
+
+def find_sender(
+    ctx: click.Context,
+    client: Optional[DaemonClient],
+    sender_threads: Optional[Dict[str, GmailSender]],
+    key: str,
+    group_by_email: bool = False,
+):
+    """Look up a sender with its threads, from the daemon if there is one.
 
-    # Use the first sender's email as the base
-    merged = GmailSender(group[0].get_email())
+    Args:
+        ctx: Click context holding the group options
+        client: Client of a running daemon, None to use sender_threads
+        sender_threads: Dict of GmailSender objects keyed by sender
+        key: Sender key, or email address if group_by_email
+        group_by_email: Whether key is an email address
+
+    Returns:
+        GmailSender or SenderGroup, or None if there is no such sender
+    """
+    if client is not None:
+        return client.sender(key, group_by_email)
+    if group_by_email:
+        sender = get_email_index(sender_threads).get(key)
+    else:
+        sender = sender_threads.get(key)
+    return load_evicted_threads(ctx, sender) if sender is not None else None
+
+
+def find_stored_sender(ctx: click.Context, key: str, group_by_email: bool = False):
+    """Look up a sender with its threads in the cache, without loading others.
+
+    Args:
+        ctx: Click context holding the group options
+        key: Sender key, or email address if group_by_email
+        group_by_email: Whether key is an email address
+
+    Returns:
+        Tuple of whether the backend can look up a single sender, and the
+        GmailSender or SenderGroup, or None if there is no such sender
+    """
+    storage = open_storage(
+        ctx.obj["sync_options"]["storage_backend"],
+        ctx.obj["sync_options"].get("db_path"),
+        cache_duration=None,
+    )
+    if not group_by_email:
+        if not hasattr(storage, "load_sender"):
+            return False, None
+        return True, storage.load_sender(key)
+    if not hasattr(storage, "load_senders_by_email"):
+        return False, None
+    group = SenderGroup(key)
+    group.members = storage.load_senders_by_email(key)
+    return True, group if group.members else None
 
-    # Merge all threads
-    for sender in group:
-        merged.add_threads(sender.threads)
 
-    return merged
+# Per-sender count each sort criteria orders by
+SORT_KEYS = {
+    "messages": attrgetter("message_count"),
+    "threads": attrgetter("thread_count"),
+    "unread_threads": attrgetter("unread_count"),
+}
 
 
+@timed("sort")
 def sort_senders(
     senders: Dict[str, GmailSender],
     sort_by: str = "messages",
     group_by_email: bool = False,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    min_count: int = 0,
 ) -> List[tuple]:
     """Sort senders by different criteria.
 
+    With a limit only the top offset + limit senders are selected with a
+    heap, so showing the first page of a large mailbox doesn't sort every
+    sender.
+
     Args:
         senders: Dict of GmailSender objects
         sort_by: Criteria to sort by ('messages', 'threads', or 'unread_threads')
         group_by_email: Whether to group senders by email address
+        limit: Maximum number of senders to return, None for all
+        offset: Number of top senders to skip
+        min_count: Only include senders whose sort count is at least this
 
     Returns:
-        List of (email, count) tuples sorted by the specified criteria
+        List of (email, GmailSender) tuples sorted by the specified criteria
     """
-    if group_by_email:
-        # Group senders by email
-        email_groups = group_senders_by_email(senders)
-        # Merge each group into a single sender
-        merged_senders = {
-            email: merge_sender_group(group) for email, group in email_groups.items()
-        }
-        senders = merged_senders
-
-    if sort_by == "messages":
-        return sorted(senders.items(), key=lambda x: x[1].message_count, reverse=True)
-    elif sort_by == "threads":
-        return sorted(senders.items(), key=lambda x: len(x[1].threads), reverse=True)
-    elif sort_by == "unread_threads":
-        return sorted(
-            senders.items(),
-            key=lambda x: sum(1 for t in x[1].threads if "UNREAD" in t.labels),
-            reverse=True,
-        )
-    else:
+    if sort_by not in SORT_KEYS:
         raise ValueError(f"Invalid sort criteria: {sort_by}")
 
+    if group_by_email:
+        # Senders sharing an address are looked up in the email index
+        senders = get_email_index(senders).groups
+
+    count = SORT_KEYS[sort_by]
+    items = senders.items()
+    if min_count > 0:
+        items = [item for item in items if count(item[1]) >= min_count]
+
+    def key(item):
+        return count(item[1])
+
+    if limit is None:
+        return sorted(items, key=key, reverse=True)[offset:]
+    return heapq.nlargest(offset + limit, items, key=key)[offset:]
+
+
+def count_senders(
+    senders: Dict[str, GmailSender],
+    sort_by: str = "messages",
+    group_by_email: bool = False,
+    min_count: int = 0,
+) -> int:
+    """Count the senders a listing would include before paging.
+
+    Args:
+        senders: Dict of GmailSender objects
+        sort_by: Criteria min_count applies to
+        group_by_email: Whether senders are grouped by email address
+        min_count: Only count senders whose sort count is at least this
+
+    Returns:
+        Number of senders
+    """
+    if group_by_email:
+        senders = get_email_index(senders).groups
+    if min_count <= 0:
+        return len(senders)
+    count = SORT_KEYS[sort_by]
+    return sum(1 for sender in senders.values() if count(sender) >= min_count)
+
+
+def format_date(timestamp_ms: int) -> str:
+    """Format a Gmail internalDate for display.
+
+    Args:
+        timestamp_ms: Milliseconds since the epoch
+
+    Returns:
+        Local date and time as 'YYYY-MM-DD HH:MM'
+    """
+    return datetime.fromtimestamp(timestamp_ms / 1000).strftime("%Y-%m-%d %H:%M")
+
 
 def display_sender_table(
     senders: Dict[str, GmailSender],
     sort_by: str = "messages",
     group_by_email: bool = False,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    min_count: int = 0,
 ) -> None:
     """Display a table of senders and their counts.
 
@@ -105,29 +315,139 @@ def display_sender_table(
         senders: Dict of GmailSender objects
         sort_by: Criteria to sort by ('messages', 'threads', or 'unread_threads')
         group_by_email: Whether to group senders by email address
+        limit: Maximum number of senders to show, None for all
+        offset: Number of top senders to skip
+        min_count: Only show senders whose sort count is at least this
+    """
+    sorted_senders = sort_senders(
+        senders, sort_by, group_by_email, limit, offset, min_count
+    )
+    total = None
+    if limit is not None or offset:
+        total = count_senders(senders, sort_by, group_by_email, min_count)
+    render_sender_table(sorted_senders, sort_by, offset, total)
+
+
+def display_daemon_sender_table(
+    client: DaemonClient,
+    sort_by: str = "messages",
+    group_by_email: bool = False,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    min_count: int = 0,
+) -> bool:
+    """Display a table of senders sorted and paged by a running daemon.
+
+    Args:
+        client: Client of the daemon
+        sort_by: Criteria to sort by ('messages', 'threads', or 'unread_threads')
+        group_by_email: Whether to group senders by email address
+        limit: Maximum number of senders to show, None for all
+        offset: Number of top senders to skip
+        min_count: Only show senders whose sort count is at least this
+
+    Returns:
+        Whether the daemon had data to display
+    """
+    page = client.senders(
+        sort_by=sort_by,
+        group_by_email=group_by_email,
+        limit=limit,
+        offset=offset,
+        min_count=min_count,
+    )
+    if page is None:
+        return False
+    rows, total = page
+    if limit is None and not offset:
+        total = None
+    render_sender_table(rows, sort_by, offset, total)
+    return True
+
+
+def display_ranked_sender_table(
+    ctx: click.Context,
+    sort_by: str = "messages",
+    group_by_email: bool = False,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    min_count: int = 0,
+) -> bool:
+    """Display a table of senders from the rankings stored with the cache.
+
+    Only the requested page of the ranking is read, no sender or thread.
+
+    Args:
+        ctx: Click context holding the group options
+        sort_by: Criteria to sort by ('messages', 'threads', or 'unread_threads')
+        group_by_email: Whether to group senders by email address
+        limit: Maximum number of senders to show, None for all
+        offset: Number of top senders to skip
+        min_count: Only show senders whose sort count is at least this
+
+    Returns:
+        Whether the cache had rankings to display
     """
-    sorted_senders = sort_senders(senders, sort_by, group_by_email)
+    storage = open_storage(
+        ctx.obj["sync_options"]["storage_backend"],
+        ctx.obj["sync_options"].get("db_path"),
+        cache_duration=None,
+    )
+    rankings = load_rankings(storage)
+    if rankings is None or not rankings.senders.rows:
+        return False
+    page, total = rankings.page(sort_by, group_by_email, limit, offset, min_count)
+    rows = [
+        (key, GmailSender.from_counts(key, messages, threads, unread))
+        for key, messages, threads, unread in page
+    ]
+    if limit is None and not offset:
+        total = None
+    render_sender_table(rows, sort_by, offset, total)
+    return True
+
+
+@timed("render")
+def render_sender_table(
+    rows: List[tuple], sort_by: str, offset: int = 0, total: Optional[int] = None
+) -> None:
+    """Render one page of sorted senders as a table.
+
+    Args:
+        rows: (email, GmailSender) tuples returned by sort_senders
+        sort_by: Criteria the rows are sorted by
+        offset: Number of top senders skipped before the rows
+        total: Number of senders before paging, None if the rows aren't paged
+    """
+    caption = None
+    if total is not None:
+        if rows:
+            caption = f"Showing {offset + 1}-{offset + len(rows)} of {total} senders"
+        else:
+            caption = f"No senders after the first {offset} of {total}"
 
     table = Table(
-        title=f"Senders sorted by {sort_by.replace('_', ' ')}", box=box.ROUNDED
+        title=f"Senders sorted by {sort_by.replace('_', ' ')}",
+        caption=caption,
+        box=box.ROUNDED,
     )
     table.add_column("Sender", style="cyan")
     table.add_column("Messages", justify="right", style="green")
     table.add_column("Total Threads", justify="right", style="blue")
     table.add_column("Unread Threads", justify="right", style="yellow")
 
-    for email, sender in sorted_senders:
-        unread_count = sum(1 for t in sender.threads if "UNREAD" in t.labels)
+    for email, sender in rows:
         table.add_row(
             email,
             str(sender.message_count),
-            str(len(sender.threads)),
-            str(unread_count),
+            str(sender.thread_count),
+            str(sender.unread_count),
         )
 
     console.print(table)
 
 
+@timed("render")
 def display_sender_details(sender: GmailSender) -> None:
     """Display detailed information about a sender."""
     console.print(
@@ -135,10 +455,12 @@ def display_sender_details(sender: GmailSender) -> None:
     )
 
     # Add summary statistics
-    unread_count = sum(1 for t in sender.threads if "UNREAD" in t.labels)
     console.print(f"[bold]Total Messages:[/bold] {sender.message_count}")
-    console.print(f"[bold]Total Threads:[/bold] {len(sender.threads)}")
-    console.print(f"[bold]Unread Threads:[/bold] {unread_count}")
+    console.print(f"[bold]Total Threads:[/bold] {sender.thread_count}")
+    console.print(f"[bold]Unread Threads:[/bold] {sender.unread_count}")
+    if sender.first_seen is not None:
+        console.print(f"[bold]First Seen:[/bold] {format_date(sender.first_seen)}")
+        console.print(f"[bold]Last Seen:[/bold] {format_date(sender.last_seen)}")
     console.print()
 
     table = Table(box=box.ROUNDED)
@@ -148,7 +470,7 @@ def display_sender_details(sender: GmailSender) -> None:
     table.add_column("Status", style="magenta")
 
     for thread in sender.threads:
-        is_unread = "UNREAD" in thread.labels
+        is_unread = thread.is_unread
         status = "[red]Unread[/red]" if is_unread else "[green]Read[/green]"
         labels = ", ".join(thread.labels)
         table.add_row(thread.thread_id, thread.subject, labels, status)
@@ -156,10 +478,288 @@ def display_sender_details(sender: GmailSender) -> None:
     console.print(table)
 
 
+def format_bytes(size: Optional[int]) -> str:
+    """Format a memory size for the stats tables."""
+    if size is None:
+        return "-"
+    return f"{size / 2**20:.1f} MiB"
+
+
+def format_seconds(seconds: Optional[float]) -> str:
+    """Format a duration for the stats tables."""
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return "inf"
+    return f"{seconds * 1000:.0f} ms" if seconds < 1 else f"{seconds:.1f} s"
+
+
+def display_sync_stats(metrics: SyncMetrics) -> None:
+    """Display where the sync spent its time.
+
+    Args:
+        metrics: Metrics recorded by the sync
+    """
+    summary = metrics.summary()
+    if not summary["requests"] and not summary["phases"]:
+        console.print("[yellow]No sync ran, no stats to show.[/yellow]")
+        return
+
+    requests = Table(title="Requests", box=box.ROUNDED)
+    requests.add_column("Method", style="cyan")
+    requests.add_column("Requests", justify="right", style="green")
+    requests.add_column("Quota units", justify="right")
+    requests.add_column("Mean", justify="right")
+    requests.add_column("p50", justify="right")
+    requests.add_column("p95", justify="right")
+    requests.add_column("p99", justify="right")
+    for method, count in sorted(summary["requests"].items()):
+        histogram = metrics.latency.get(method)
+        mean = (
+            histogram.sum / histogram.count if histogram and histogram.count else None
+        )
+        requests.add_row(
+            method,
+            str(count),
+            str(summary["quota_units"].get(method, "-")),
+            format_seconds(mean),
+            *(
+                format_seconds(histogram.quantile(q) if histogram else None)
+                for q in (0.5, 0.95, 0.99)
+            ),
+        )
+    console.print(requests)
+
+    waits = Table(title="Errors and waiting", box=box.ROUNDED)
+    waits.add_column("Cause", style="cyan")
+    waits.add_column("Errors", justify="right", style="red")
+    waits.add_column("Retries", justify="right", style="yellow")
+    waits.add_column("Time", justify="right")
+    for error_class in sorted(set(summary["errors"]) | set(summary["retries"])):
+        waits.add_row(
+            error_class.replace("_", " "),
+            str(summary["errors"].get(error_class, 0)),
+            str(summary["retries"].get(error_class, 0)),
+            format_seconds(summary["backoff_seconds"].get(error_class, 0.0)),
+        )
+    waits.add_row(
+        "rate limiter", "-", "-", format_seconds(summary["limiter_wait_seconds"])
+    )
+    console.print(waits)
+
+    phases = Table(title="Phases", box=box.ROUNDED)
+    phases.add_column("Phase", style="cyan")
+    phases.add_column("Time", justify="right")
+    phases.add_column("Threads", justify="right", style="green")
+    phases.add_column("Threads/s", justify="right", style="magenta")
+    phases.add_column("RSS", justify="right")
+    phases.add_column("Peak RSS", justify="right")
+    traced = any(
+        p.get("traced_peak_bytes") is not None for p in summary["phases"].values()
+    )
+    if traced:
+        phases.add_column("Traced peak", justify="right")
+    for name, phase in summary["phases"].items():
+        phases.add_row(
+            name,
+            format_seconds(phase["seconds"]),
+            str(phase["threads"]),
+            f"{phase['threads_per_second']:.1f}",
+            format_bytes(phase.get("rss_bytes")),
+            format_bytes(phase.get("peak_rss_bytes")),
+            *([format_bytes(phase.get("traced_peak_bytes"))] if traced else []),
+        )
+    console.print(phases)
+
+
+def display_account_results(results: List[dict]) -> None:
+    """Display the outcome of syncing each account.
+
+    Args:
+        results: Results of gmail_stats.accounts.sync_accounts
+    """
+    table = Table(title="Accounts", box=box.ROUNDED)
+    table.add_column("Account", style="cyan")
+    table.add_column("Senders", justify="right")
+    table.add_column("Threads", justify="right", style="green")
+    table.add_column("Unread", justify="right", style="yellow")
+    table.add_column("Time", justify="right")
+    table.add_column("Status")
+    for result in results:
+        counts = result["senders"].values()
+        table.add_row(
+            result["account"],
+            str(len(counts)),
+            str(sum(c[1] for c in counts)),
+            str(sum(c[2] for c in counts)),
+            format_seconds(result["seconds"]),
+            "[green]ok[/green]" if result["ok"] else f"[red]{result['error']}[/red]",
+        )
+    console.print(table)
+
+
+def display_profile() -> None:
+    """Display the time spent in each phase of the command."""
+    wall = profiler.wall_seconds
+    table = Table(
+        title="Profile",
+        caption=f"Total {format_seconds(wall)}",
+        box=box.ROUNDED,
+    )
+    table.add_column("Phase", style="cyan")
+    table.add_column("Calls", justify="right")
+    table.add_column("Time", justify="right", style="green")
+    table.add_column("% of total", justify="right", style="magenta")
+    for depth, span in profiler.breakdown():
+        table.add_row(
+            "  " * depth + span.name,
+            str(span.calls),
+            format_seconds(span.seconds),
+            f"{100 * span.seconds / wall:.1f}%" if wall > 0 else "-",
+        )
+    console.print(table)
+
+
 @click.group()
-def cli():
+@click.option(
+    "--fetch-format",
+    type=click.Choice(["metadata", "full"]),
+    default="metadata",
+    help="How much of each thread to download while syncing",
+)
+@click.option(
+    "--full-sync",
+    is_flag=True,
+    help="Relist the whole inbox instead of only fetching changes since last sync",
+)
+@click.option(
+    "--all-threads",
+    is_flag=True,
+    help="List every inbox thread instead of letting Gmail filter to unread ones",
+)
+@click.option("--query", "-q", help="Gmail search query to narrow the thread listing")
+@click.option(
+    "--storage",
+    type=click.Choice(list(STORAGE_BACKENDS)),
+    default="shelve",
+    help="Storage backend for cached data",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Only read cached data, without syncing or loading the Gmail client",
+)
+@click.option(
+    "--account",
+    "-a",
+    help="Use the credentials and cache of this registered account",
+)
+@click.option(
+    "--max-memory",
+    type=click.IntRange(min=1),
+    metavar="MB",
+    help="Keep the sync under this much memory by streaming threads into "
+    "storage as they are fetched (needs --storage sqlite)",
+)
+@click.option(
+    "--trace-memory",
+    is_flag=True,
+    help="Trace Python allocations so --stats shows the traced peak of each phase",
+)
+@click.option(
+    "--no-daemon",
+    is_flag=True,
+    help="Load the data in-process even if a daemon is running",
+)
+@click.option(
+    "--stats",
+    is_flag=True,
+    help="Show request, retry, quota and phase statistics of the sync",
+)
+@click.option(
+    "--stats-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write sync statistics to this file, in the Prometheus text format "
+    "if it ends in .prom and as JSON otherwise",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Show how long each phase of the command took",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Run the command under cProfile and write the statistics to this "
+    ".prof file",
+)
+@click.pass_context
+def cli(
+    ctx,
+    fetch_format: str,
+    full_sync: bool,
+    all_threads: bool,
+    query: str,
+    storage: str,
+    offline: bool,
+    account: Optional[str],
+    max_memory: Optional[int],
+    trace_memory: bool,
+    no_daemon: bool,
+    stats: bool,
+    stats_file: Optional[str],
+    profile: bool,
+    profile_output: Optional[str],
+):
     """Gmail Statistics CLI - Analyze your Gmail inbox."""
-    pass
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    ctx.ensure_object(dict)
+    ctx.obj["offline"] = offline
+    ctx.obj["no_daemon"] = no_daemon
+    ctx.obj["sync_options"] = {
+        "fetch_format": fetch_format,
+        "incremental": not full_sync,
+        "unread_only": not all_threads,
+        "query": query,
+        "storage_backend": storage,
+        "max_memory": max_memory * 2**20 if max_memory else None,
+    }
+    if account is not None:
+        try:
+            ctx.obj["sync_options"].update(
+                AccountRegistry().get(account).sync_options()
+            )
+        except KeyError as e:
+            raise click.UsageError(e.args[0])
+    # sync-all accounts have their own backends and report errors per account
+    if (
+        max_memory is not None
+        and ctx.obj["sync_options"]["storage_backend"] != "sqlite"
+        and ctx.invoked_subcommand != "sync-all"
+    ):
+        raise click.UsageError("--max-memory needs --storage sqlite")
+
+    if profile or profile_output:
+        profiler.start(cprofile=bool(profile_output))
+    if trace_memory:
+        tracemalloc.start()
+
+    def report_stats():
+        profiler.stop()
+        if trace_memory:
+            tracemalloc.stop()
+        if profile:
+            display_profile()
+        if profile_output:
+            profiler.dump_stats(profile_output)
+        if stats:
+            display_sync_stats(sync_metrics)
+        if stats_file:
+            sync_metrics.write(stats_file)
+
+    ctx.call_on_close(report_stats)
 
 
 @cli.command(name="list-senders")
@@ -172,12 +772,42 @@ def cli():
 @click.option(
     "--group-by-email", is_flag=True, help="Group senders by their email address"
 )
-def list_senders(sort_by: str, group_by_email: bool):
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Only show this many senders",
+)
+@click.option(
+    "--offset",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Skip this many top senders",
+)
+@click.option(
+    "--min-count",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Only show senders with at least this many of the sorted count",
+)
+@click.pass_context
+def list_senders(ctx, sort_by: str, group_by_email: bool, limit, offset, min_count):
     """List all senders with their message and thread counts."""
     try:
-        _, sender_threads = get_sender_counts()
+        client = connect_to_daemon(ctx)
+        if client is not None and display_daemon_sender_table(
+            client, sort_by, group_by_email, limit, offset, min_count
+        ):
+            return
+        if ctx.obj.get("offline") and display_ranked_sender_table(
+            ctx, sort_by, group_by_email, limit, offset, min_count
+        ):
+            return
+        _, sender_threads = load_sender_counts(ctx)
         if sender_threads:
-            display_sender_table(sender_threads, sort_by, group_by_email)
+            display_sender_table(
+                sender_threads, sort_by, group_by_email, limit, offset, min_count
+            )
         else:
             console.print("[yellow]No messages found.[/yellow]")
     except Exception as e:
@@ -189,20 +819,25 @@ def list_senders(sort_by: str, group_by_email: bool):
 @click.option(
     "--group-by-email", is_flag=True, help="Group senders by their email address"
 )
-def show(sender_email: str, group_by_email: bool):
+@click.pass_context
+def show(ctx, sender_email: str, group_by_email: bool):
     """Show detailed information about a specific sender."""
     try:
-        _, sender_threads = get_sender_counts()
-        if group_by_email:
-            # Group senders by email and merge them
-            email_groups = group_senders_by_email(sender_threads)
-            if sender_email in email_groups:
-                merged_sender = merge_sender_group(email_groups[sender_email])
-                display_sender_details(merged_sender)
-            else:
-                console.print(f"[yellow]No messages found from {sender_email}[/yellow]")
-        elif sender_email in sender_threads:
-            display_sender_details(sender_threads[sender_email])
+        client = connect_to_daemon(ctx)
+        found, sender = False, None
+        # Read just this sender when the cache can look it up
+        if client is None and ctx.obj.get("offline"):
+            found, sender = find_stored_sender(ctx, sender_email, group_by_email)
+        if not found:
+            sender_threads = None
+            if client is None:
+                _, sender_threads = load_sender_counts(ctx)
+            if client is not None or sender_threads:
+                sender = find_sender(
+                    ctx, client, sender_threads, sender_email, group_by_email
+                )
+        if sender is not None:
+            display_sender_details(sender)
         else:
             console.print(f"[yellow]No messages found from {sender_email}[/yellow]")
     except Exception as e:
@@ -219,57 +854,410 @@ def show(sender_email: str, group_by_email: bool):
 @click.option(
     "--group-by-email", is_flag=True, help="Group senders by their email address"
 )
-def interactive(sort_by: str, group_by_email: bool):
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Show this many senders per page",
+)
+@click.option(
+    "--offset",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Skip this many top senders",
+)
+@click.option(
+    "--min-count",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Only show senders with at least this many of the sorted count",
+)
+@click.pass_context
+def interactive(ctx, sort_by: str, group_by_email: bool, limit, offset, min_count):
     """Start an interactive session to explore your Gmail data."""
     try:
-        _, sender_threads = get_sender_counts()
-        if not sender_threads:
-            console.print("[yellow]No messages found.[/yellow]")
-            return
+        client = connect_to_daemon(ctx)
+        sender_threads = None
+        if client is None:
+            _, sender_threads = load_sender_counts(ctx)
+            if not sender_threads:
+                console.print("[yellow]No messages found.[/yellow]")
+                return
 
         while True:
-            display_sender_table(sender_threads, sort_by, group_by_email)
+            if client is not None:
+                # The daemon may have refreshed since the previous page
+                display_daemon_sender_table(
+                    client, sort_by, group_by_email, limit, offset, min_count
+                )
+            else:
+                display_sender_table(
+                    sender_threads, sort_by, group_by_email, limit, offset, min_count
+                )
             console.print("\n[bold]Options:[/bold]")
             console.print("1. Enter sender email to see details")
             console.print("2. Type 's' to change sort criteria")
             console.print("3. Type 'g' to toggle email grouping")
-            console.print("4. Type 'q' to quit")
+            if limit is not None:
+                console.print("4. Type 'n' or 'p' for the next or previous page")
+                console.print("5. Type 'q' to quit")
+            else:
+                console.print("4. Type 'q' to quit")
 
             choice = click.prompt("\nEnter your choice", type=str)
 
             if choice.lower() == "q":
                 break
+            elif limit is not None and choice.lower() == "n":
+                offset += limit
+            elif limit is not None and choice.lower() == "p":
+                offset = max(0, offset - limit)
             elif choice.lower() == "s":
                 sort_by = click.prompt(
                     "Sort by",
                     type=click.Choice(["messages", "threads", "unread_threads"]),
                     default=sort_by,
                 )
+                offset = 0
             elif choice.lower() == "g":
                 group_by_email = not group_by_email
+                offset = 0
                 console.print(
                     f"Email grouping {'enabled' if group_by_email else 'disabled'}"
                 )
-            elif choice in sender_threads:
-                if group_by_email:
-                    email_groups = group_senders_by_email(sender_threads)
-                    if choice in email_groups:
-                        merged_sender = merge_sender_group(email_groups[choice])
-                        display_sender_details(merged_sender)
-                    else:
-                        console.print(
-                            f"[yellow]No messages found from {choice}[/yellow]"
-                        )
-                else:
-                    display_sender_details(sender_threads[choice])
-                click.pause()
             else:
-                console.print("[yellow]Invalid choice. Please try again.[/yellow]")
+                # Grouped rows are keyed by email address, not by sender
+                sender = find_sender(
+                    ctx, client, sender_threads, choice, group_by_email
+                )
+                if sender is not None:
+                    display_sender_details(sender)
+                    click.pause()
+                else:
+                    console.print("[yellow]Invalid choice. Please try again.[/yellow]")
 
     except Exception as e:
         console.print(f"[red]Error: {str(e)}[/red]")
 
 
+@cli.group()
+def accounts():
+    """Manage the accounts synced by sync-all."""
+
+
+@accounts.command(name="add")
+@click.argument("name")
+@click.option(
+    "--credentials",
+    type=click.Path(dir_okay=False),
+    help="OAuth client secrets file, the shared .env/credentials.json if omitted",
+)
+@click.option(
+    "--storage",
+    type=click.Choice(list(STORAGE_BACKENDS)),
+    default="shelve",
+    help="Storage backend for the account's cache",
+)
+@click.option(
+    "--quota-rate",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Quota units per second the account may use (default: Gmail's limit)",
+)
+@click.option(
+    "--daily-quota",
+    type=click.IntRange(min=1),
+    help="Quota units per day the account may use",
+)
+def add_account(name: str, credentials, storage: str, quota_rate, daily_quota):
+    """Register an account."""
+    registry = AccountRegistry()
+    try:
+        registry.add(
+            Account(
+                name,
+                credentials_path=credentials,
+                storage_backend=storage,
+                quota_rate=quota_rate,
+                daily_quota=daily_quota,
+            )
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    console.print(
+        f"Added account {name}, run 'gmail-stats accounts login {name}' to sign in."
+    )
+
+
+@accounts.command(name="remove")
+@click.argument("name")
+def remove_account(name: str):
+    """Unregister an account, keeping its token and cache files."""
+    try:
+        AccountRegistry().remove(name)
+    except KeyError as e:
+        raise click.UsageError(e.args[0])
+    console.print(f"Removed account {name}")
+
+
+@accounts.command(name="list")
+def list_accounts():
+    """List the registered accounts."""
+    registry = AccountRegistry()
+    if not registry:
+        console.print("[yellow]No accounts, add one with 'accounts add'.[/yellow]")
+        return
+    table = Table(title="Accounts", box=box.ROUNDED)
+    table.add_column("Account", style="cyan")
+    table.add_column("Storage")
+    table.add_column("Cache", style="dim")
+    table.add_column("Quota/s", justify="right")
+    table.add_column("Daily quota", justify="right")
+    table.add_column("Signed in")
+    for account in registry:
+        table.add_row(
+            account.name,
+            account.storage_backend,
+            account.db_path,
+            "-" if account.quota_rate is None else f"{account.quota_rate:g}",
+            "-" if account.daily_quota is None else str(account.daily_quota),
+            "[green]yes[/green]" if account.logged_in else "[red]no[/red]",
+        )
+    console.print(table)
+
+
+@accounts.command(name="login")
+@click.argument("name")
+def login_account(name: str):
+    """Sign in to an account in the browser and save its token."""
+    try:
+        account = AccountRegistry().get(name)
+    except KeyError as e:
+        raise click.UsageError(e.args[0])
+    from . import sync
+
+    sync.get_credentials(account.credentials_path, account.token_path)
+    console.print(f"Signed in to {name}")
+
+
+@cli.command(name="sync-all")
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Accounts to sync at once (default: every account, up to 32)",
+)
+@click.option(
+    "--only",
+    multiple=True,
+    help="Only sync this account, can be repeated",
+)
+@click.option(
+    "--sort-by",
+    type=click.Choice(["messages", "threads", "unread_threads"]),
+    default="messages",
+    help="Sort criteria for the combined senders",
+)
+@click.option(
+    "--group-by-email", is_flag=True, help="Group senders by their email address"
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=20,
+    help="Show this many of the combined top senders",
+)
+@click.pass_context
+def sync_all(ctx, workers, only, sort_by: str, group_by_email: bool, limit):
+    """Sync every registered account concurrently and report on all of them."""
+    registry = AccountRegistry()
+    try:
+        selected = [registry.get(name) for name in only] if only else list(registry)
+    except KeyError as e:
+        raise click.UsageError(e.args[0])
+    if not selected:
+        console.print("[yellow]No accounts, add one with 'accounts add'.[/yellow]")
+        return
+
+    offline = ctx.obj.get("offline")
+    runnable = []
+    results = []
+    for account in selected:
+        if offline or account.logged_in:
+            runnable.append(account)
+        else:
+            results.append(
+                {
+                    "account": account.name,
+                    "ok": False,
+                    "error": f"not signed in, run 'accounts login {account.name}'",
+                    "senders": {},
+                    "seconds": None,
+                }
+            )
+
+    sync_options = {
+        key: value
+        for key, value in ctx.obj["sync_options"].items()
+        if key not in ("storage_backend", "db_path", "credentials_path", "token_path")
+    }
+    with Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TextColumn("{task.completed}/{task.total} accounts"),
+        TimeElapsedColumn(),
+        console=console,
+    ) as progress:
+        task = progress.add_task("[cyan]Syncing accounts...", total=len(runnable))
+
+        def on_result(result: dict) -> None:
+            progress.advance(task)
+            status = "done" if result["ok"] else f"failed: {result['error']}"
+            progress.console.print(f"{result['account']}: {status}")
+
+        try:
+            results.extend(
+                sync_accounts(
+                    runnable, sync_options, offline, workers, on_result=on_result
+                )
+            )
+        except KeyboardInterrupt:
+            console.print(
+                "[yellow]Interrupted, accounts resume on the next run.[/yellow]"
+            )
+            ctx.exit(130)
+
+    order = {account.name: index for index, account in enumerate(selected)}
+    results.sort(key=lambda result: order[result["account"]])
+    display_account_results(results)
+    combined = combine_account_senders(results)
+    if combined:
+        display_sender_table(combined, sort_by, group_by_email, limit)
+    if not all(result["ok"] for result in results):
+        ctx.exit(1)
+
+
+@cli.group()
+def daemon():
+    """Keep the sender data loaded and answer commands from a background daemon.
+
+    While a daemon runs, list-senders, show and interactive ask it over a
+    local socket instead of loading the data themselves, unless they use
+    --no-daemon or --full-sync or sync with different options.
+    """
+
+
+def daemon_client(ctx: click.Context, timeout: float = CONNECT_TIMEOUT) -> DaemonClient:
+    """Get a client of the daemon serving the selected cache.
+
+    Raises:
+        click.ClickException: If no daemon is running
+    """
+    sync_options = ctx.obj["sync_options"]
+    path = socket_path(sync_options["storage_backend"], sync_options.get("db_path"))
+    client = DaemonClient(path, timeout)
+    if not client.alive():
+        raise click.ClickException(f"No daemon running on {path}")
+    return client
+
+
+def display_daemon_status(status: dict) -> None:
+    """Display what a daemon serves and how its last refresh went."""
+    table = Table(title="Daemon", box=box.ROUNDED, show_header=False)
+    table.add_column("Field", style="cyan")
+    table.add_column("Value")
+    options = status["sync_options"]
+    table.add_row("PID", str(status["pid"]))
+    table.add_row(
+        "Cache", f"{options['storage_backend']} {options.get('db_path') or ''}"
+    )
+    table.add_row("Senders", str(status["senders"]))
+    table.add_row("Threads", str(status["threads"]))
+    table.add_row("Loaded at", status["loaded_at"] or "-")
+    refresh = status["last_refresh"]
+    if refresh:
+        result = "ok" if refresh["ok"] else f"[red]{refresh['error']}[/red]"
+        table.add_row(
+            "Last refresh",
+            f"{refresh['finished_at']} ({format_seconds(refresh['seconds'])}, "
+            f"{result})",
+        )
+    else:
+        table.add_row("Last refresh", "no refresh yet")
+    mode = "cache reload" if status["offline"] else "sync"
+    table.add_row("Refresh", f"{mode} every {status['refresh_interval'] / 60:g} min")
+    console.print(table)
+
+
+@daemon.command(name="start")
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=DEFAULT_REFRESH_MINUTES,
+    help=f"Minutes between syncs (default: {DEFAULT_REFRESH_MINUTES})",
+)
+@click.pass_context
+def start_daemon(ctx, interval: float):
+    """Run a daemon in the foreground until it is stopped.
+
+    With --offline the daemon reloads the cache instead of syncing.
+    """
+    server = GmailStatsDaemon(
+        ctx.obj["sync_options"],
+        offline=ctx.obj.get("offline"),
+        refresh_interval=interval * 60,
+    )
+    try:
+        server.start()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    # The server stops from another thread, serve_forever() waits for it
+    signal.signal(
+        signal.SIGTERM,
+        lambda signum, frame: threading.Thread(target=server.stop).start(),
+    )
+    console.print(
+        f"Serving on {server.path}, refreshing every {interval:g} minutes. "
+        "Press Ctrl+C to stop."
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        console.print("[yellow]Daemon stopped.[/yellow]")
+
+
+@daemon.command(name="status")
+@click.pass_context
+def daemon_status(ctx):
+    """Show what a running daemon serves."""
+    display_daemon_status(daemon_client(ctx).request("status"))
+
+
+@daemon.command(name="refresh")
+@click.option(
+    "--no-wait", is_flag=True, help="Return without waiting for the sync to finish"
+)
+@click.pass_context
+def refresh_daemon(ctx, no_wait: bool):
+    """Make a running daemon sync now."""
+    result = daemon_client(ctx, REFRESH_TIMEOUT).request("refresh", wait=not no_wait)
+    if no_wait:
+        console.print("Refresh started")
+        return
+    display_daemon_status(result)
+    # Empty if the daemon stopped before its first refresh finished
+    if not result["last_refresh"].get("ok"):
+        ctx.exit(1)
+
+
+@daemon.command(name="stop")
+@click.pass_context
+def stop_daemon(ctx):
+    """Stop a running daemon."""
+    daemon_client(ctx).request("stop")
+    console.print("Daemon stopped")
+
+
 def main():
     """Main entry point for the CLI."""
     cli()
@@ -0,0 +1,574 @@
+"""Background sync daemon answering sender queries over a Unix socket.
+
+The daemon keeps the sender data in memory, refreshes it on a schedule or
+on request, and answers list and detail queries from the command line, so
+a query only costs a round trip over a local socket instead of loading
+credentials, syncing and decompressing the cache.
+
+Requests and responses are single lines of JSON. A request names an op
+and its parameters, a response is {"ok": true, "result": ...} or
+{"ok": false, "error": "..."}.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .grouping import EMAIL_INDEX_KEY, EmailIndex, get_email_index, set_email_index
+from .rankings import SenderRankings, load_rankings
+from .sender import GmailSender
+from .storage import open_storage
+from .thread import GmailThread
+
+logger = logging.getLogger(__name__)
+
+# Bumped when requests or responses change incompatibly
+PROTOCOL_VERSION = 1
+# Default minutes between two syncs of a running daemon
+DEFAULT_REFRESH_MINUTES = 15
+# Seconds a client waits for the daemon before falling back to in-process
+CONNECT_TIMEOUT = 0.5
+# Seconds a client waits for a refresh it asked for
+REFRESH_TIMEOUT = 3600
+# Sync options the daemon's data must have been synced with to answer a
+# command, the others only change how a sync runs
+DATA_OPTIONS = ("storage_backend", "db_path", "fetch_format", "unread_only", "query")
+
+
+class DaemonError(Exception):
+    """Raised when the daemon answers a request with an error."""
+
+
+def socket_path(storage_backend: str = None, db_path: str = None) -> str:
+    """Get the socket of the daemon serving a cache.
+
+    Args:
+        storage_backend: Storage backend of the cache
+        db_path: Path of the cache, the backend's default path if None
+
+    Returns:
+        Path of the Unix socket
+    """
+    if db_path:
+        return f"{db_path}.sock"
+    return os.path.join(".env", f"gmail-stats-{storage_backend or 'shelve'}.sock")
+
+
+def thread_to_dict(thread: GmailThread) -> dict:
+    """Convert a thread to the dictionary the cache and daemon use."""
+    return {
+        "thread_id": thread.thread_id,
+        "labels": thread.labels,
+        "sender": thread.sender,
+        "subject": thread.subject,
+        "history_id": thread.history_id,
+        "message_count": thread.message_count,
+        "date": thread.date,
+    }
+
+
+def sender_to_dict(sender) -> dict:
+    """Convert a GmailSender or SenderGroup with its threads to a dictionary."""
+    return {
+        "sender": sender.sender,
+        "counts": [
+            sender.message_count,
+            sender.thread_count,
+            sender.unread_count,
+            sender.first_seen,
+            sender.last_seen,
+        ],
+        "threads": [thread_to_dict(t) for t in sender.threads],
+    }
+
+
+def sender_from_dict(data: dict) -> GmailSender:
+    """Create a GmailSender from a dictionary returned by sender_to_dict().
+
+    The counts are taken as sent, since a group's threads belong to
+    several senders.
+    """
+    sender = GmailSender.from_counts(data["sender"], *data["counts"])
+    sender.threads = [GmailThread(**thread) for thread in data["threads"]]
+    return sender
+
+
+class SenderDataset:
+    """One loaded copy of the sender data and the queries run on it.
+
+    Attributes:
+        sender_threads: Dict of GmailSender objects keyed by sender
+        loaded_at: When the data was loaded or synced
+    """
+
+    def __init__(
+        self,
+        sender_threads: Dict[str, GmailSender],
+        storage=None,
+        email_index: Optional[EmailIndex] = None,
+        rankings: Optional[SenderRankings] = None,
+    ):
+        """Initialize a SenderDataset.
+
+        Args:
+            sender_threads: Dict of GmailSender objects keyed by sender
+            storage: Storage to read threads evicted by a bounded-memory
+                sync from
+            email_index: Index of sender_threads, built if None
+            rankings: Rankings of sender_threads, built if None
+        """
+        self.sender_threads = sender_threads
+        self.storage = storage
+        self.loaded_at = datetime.now()
+        # Built up front so the first grouped query doesn't pay for it
+        self.email_index = email_index or get_email_index(sender_threads)
+        set_email_index(self.email_index)
+        # Pages are slices of the rankings, so no query sorts the senders
+        self.rankings = rankings or SenderRankings.build(sender_threads)
+        self._lock = threading.Lock()
+
+    @property
+    def thread_count(self) -> int:
+        """Get the number of threads in the dataset."""
+        return sum(s.thread_count for s in self.sender_threads.values())
+
+    def senders(
+        self,
+        sort_by: str = "messages",
+        group_by_email: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        min_count: int = 0,
+    ) -> dict:
+        """Get one page of senders sorted by a count.
+
+        Args:
+            sort_by: Criteria to sort by ('messages', 'threads', or 'unread_threads')
+            group_by_email: Whether to group senders by email address
+            limit: Maximum number of senders to return, None for all
+            offset: Number of top senders to skip
+            min_count: Only include senders whose sort count is at least this
+
+        Returns:
+            Dict with the page as [sender, messages, threads, unread] rows
+            and the number of senders before paging
+        """
+        rows, total = self.rankings.page(
+            sort_by, group_by_email, limit, offset, min_count
+        )
+        return {"rows": [list(row) for row in rows], "total": total}
+
+    def sender(self, key: str, group_by_email: bool = False) -> Optional[dict]:
+        """Get a sender or email address group with its threads.
+
+        Args:
+            key: Sender key, or email address if group_by_email
+            group_by_email: Whether key is an email address
+
+        Returns:
+            Dict returned by sender_to_dict(), or None if there is no such
+            sender
+        """
+        if group_by_email:
+            sender = self.email_index.get(key)
+        else:
+            sender = self.sender_threads.get(key)
+        if sender is None:
+            return None
+        with self._lock:
+            for member in getattr(sender, "members", [sender]):
+                if member.threads_evicted and self.storage is not None:
+                    stored = self.storage.load_sender(member.sender)
+                    if stored is not None:
+                        member.threads = stored.threads
+        return sender_to_dict(sender)
+
+
+class SenderQueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server handing each request line to a handler."""
+
+    daemon_threads = True
+
+    def __init__(self, path: str, handle: Callable[[dict], dict]):
+        """Bind the socket.
+
+        Args:
+            path: Path of the Unix socket
+            handle: Called with each request, returning its response
+        """
+        self.handle = handle
+        super().__init__(path, SenderQueryHandler)
+
+
+class SenderQueryHandler(socketserver.StreamRequestHandler):
+    """Answers the request lines of one connection."""
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                response = self.server.handle(json.loads(line))
+            except Exception as e:
+                logger.exception("Error answering request")
+                response = {"ok": False, "error": str(e) or type(e).__name__}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class GmailStatsDaemon:
+    """Keeps the sender data loaded and answers queries about it.
+
+    The cache is loaded before the socket starts answering, then a refresh
+    thread syncs every refresh_interval seconds and whenever a client asks
+    for it. Queries keep being answered from the previous data while a
+    sync runs, and see the new data as soon as it finished.
+
+    Attributes:
+        sync_options: get_sender_counts arguments of every refresh
+        offline: Refresh by reloading the cache instead of syncing
+        refresh_interval: Seconds between two refreshes
+        path: Path of the Unix socket
+        dataset: The data queries are answered from
+        last_refresh: Status of the last refresh
+    """
+
+    def __init__(
+        self,
+        sync_options: dict,
+        offline: bool = False,
+        refresh_interval: float = DEFAULT_REFRESH_MINUTES * 60,
+        path: Optional[str] = None,
+        sync: Optional[Callable[..., Tuple]] = None,
+    ):
+        """Initialize a GmailStatsDaemon.
+
+        Args:
+            sync_options: get_sender_counts arguments of every refresh
+            offline: Refresh by reloading the cache instead of syncing
+            refresh_interval: Seconds between two refreshes
+            path: Path of the Unix socket, see socket_path() if None
+            sync: Replacement for gmail_stats.sync.get_sender_counts
+        """
+        self.sync_options = sync_options
+        self.offline = offline
+        self.refresh_interval = refresh_interval
+        self.path = path or socket_path(
+            sync_options.get("storage_backend"), sync_options.get("db_path")
+        )
+        self.dataset: Optional[SenderDataset] = None
+        self.last_refresh: dict = {}
+        self._sync = sync
+        self._server: Optional[SenderQueryServer] = None
+        self._stop = threading.Event()
+        self._stop_lock = threading.Lock()
+        self._stopped = False
+        self._wake = threading.Event()
+        self._refreshed = threading.Condition()
+        self._generation = 0
+        self._refreshing = False
+        self._thread: Optional[threading.Thread] = None
+
+    def _storage(self):
+        return open_storage(
+            self.sync_options.get("storage_backend"),
+            self.sync_options.get("db_path"),
+            cache_duration=None,
+        )
+
+    def load_cache(self) -> None:
+        """Load the cached data, so queries are answered before a sync."""
+        storage = self._storage()
+        _, sender_threads, _ = storage.load_data()
+        if sender_threads is not None:
+            self.dataset = SenderDataset(
+                sender_threads,
+                storage,
+                EmailIndex.load(sender_threads, storage.get_state(EMAIL_INDEX_KEY)),
+                load_rankings(storage),
+            )
+
+    def refresh(self) -> None:
+        """Sync, or reload the cache if offline, and swap in the new data."""
+        start = time.perf_counter()
+        try:
+            if self.offline:
+                self.load_cache()
+            else:
+                sync = self._sync
+                if sync is None:
+                    from . import sync as sync_module
+                    from .metrics import sync_metrics
+
+                    # Nobody watches a daemon's progress bars, and its
+                    # metrics would otherwise add up over every refresh
+                    sync_module.show_progress = False
+                    sync_metrics.reset()
+                    sync = sync_module.get_sender_counts
+                _, sender_threads = sync(**self.sync_options)
+                if sender_threads is not None:
+                    self.dataset = SenderDataset(sender_threads, self._storage())
+            self.last_refresh = {"ok": True, "error": None}
+        except Exception as e:
+            logger.error(f"Error refreshing sender data: {str(e)}")
+            self.last_refresh = {"ok": False, "error": str(e) or type(e).__name__}
+        self.last_refresh["finished_at"] = datetime.now().isoformat()
+        self.last_refresh["seconds"] = time.perf_counter() - start
+        with self._refreshed:
+            self._generation += 1
+            self._refreshed.notify_all()
+
+    def _refresh_loop(self) -> None:
+        if self.offline:
+            # start() just loaded the cache
+            self._wake.wait(self.refresh_interval)
+        while not self._stop.is_set():
+            with self._refreshed:
+                self._wake.clear()
+                self._refreshing = True
+            self.refresh()
+            with self._refreshed:
+                self._refreshing = False
+            self._wake.wait(self.refresh_interval)
+
+    def request_refresh(self, wait: bool = True, timeout: float = None) -> bool:
+        """Ask the refresh thread to refresh now.
+
+        Args:
+            wait: Wait until the refresh finished
+            timeout: Maximum seconds to wait
+
+        Returns:
+            Whether a refresh finished, always True without wait
+        """
+        with self._refreshed:
+            # A refresh already running may have read the mailbox before
+            # the request, so wait for the one after it
+            target = self._generation + (2 if self._refreshing else 1)
+            self._wake.set()
+            if not wait:
+                return True
+            self._refreshed.wait_for(
+                lambda: self._generation >= target or self._stop.is_set(), timeout
+            )
+            return self._generation >= target
+
+    def status(self) -> dict:
+        """Get what the daemon serves and how its last refresh went."""
+        dataset = self.dataset
+        return {
+            "protocol": PROTOCOL_VERSION,
+            "pid": os.getpid(),
+            "sync_options": {key: self.sync_options.get(key) for key in DATA_OPTIONS},
+            "offline": self.offline,
+            "refresh_interval": self.refresh_interval,
+            "loaded": dataset is not None,
+            "loaded_at": dataset.loaded_at.isoformat() if dataset else None,
+            "senders": len(dataset.sender_threads) if dataset else 0,
+            "threads": dataset.thread_count if dataset else 0,
+            "last_refresh": self.last_refresh,
+        }
+
+    def handle(self, request: dict) -> dict:
+        """Answer one request.
+
+        Args:
+            request: Dict with the op and its parameters
+
+        Returns:
+            Response dict
+        """
+        op = request.get("op")
+        params = request.get("params", {})
+        if op == "status":
+            return {"ok": True, "result": self.status()}
+        if op == "refresh":
+            finished = self.request_refresh(params.get("wait", True))
+            return {"ok": True, "result": {"finished": finished, **self.status()}}
+        if op == "stop":
+            threading.Thread(target=self.stop, daemon=True).start()
+            return {"ok": True, "result": None}
+        if op in ("senders", "sender"):
+            dataset = self.dataset
+            if dataset is None:
+                return {"ok": True, "result": None}
+            return {"ok": True, "result": getattr(dataset, op)(**params)}
+        return {"ok": False, "error": f"Unknown op: {op}"}
+
+    def start(self) -> None:
+        """Load the cache, bind the socket and start refreshing.
+
+        Raises:
+            RuntimeError: If a daemon is already serving the socket
+        """
+        if os.path.exists(self.path):
+            if DaemonClient(self.path).alive():
+                raise RuntimeError(f"A daemon is already running on {self.path}")
+            # Left behind by a daemon that didn't shut down cleanly
+            os.remove(self.path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.load_cache()
+        # The socket serves mailbox data, so only its owner may connect.
+        # It is created 0600 rather than changed after bind, so there is no
+        # window in which others can connect.
+        umask = os.umask(0o177)
+        try:
+            self._server = SenderQueryServer(self.path, self.handle)
+        finally:
+            os.umask(umask)
+        self._thread = threading.Thread(
+            target=self._refresh_loop, name="gmail-refresh", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Serving sender data on {self.path}")
+
+    def serve_forever(self) -> None:
+        """Answer requests until stop() is called.
+
+        Returns once the refresh thread finished too, so a sync stopped
+        half way gets to save its checkpoint.
+        """
+        try:
+            self._server.serve_forever(poll_interval=0.2)
+        finally:
+            self.stop()
+            self._thread.join()
+
+    def stop(self) -> None:
+        """Stop answering requests, stop a running sync and remove the socket."""
+        # Called by both the stop request and serve_forever() returning
+        with self._stop_lock:
+            if self._stopped:
+                return
+            self._stop_daemon()
+            self._stopped = True
+
+    def _stop_daemon(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        with self._refreshed:
+            self._refreshed.notify_all()
+        if self._refreshing and not self.offline and self._sync is None:
+            # Makes a running sync save its checkpoint and return
+            from .sync import shutdown_event
+
+            shutdown_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        logger.info("Daemon stopped")
+
+
+class DaemonClient:
+    """Sends requests to a daemon over its Unix socket.
+
+    Attributes:
+        path: Path of the Unix socket
+        timeout: Seconds to wait for an answer
+    """
+
+    def __init__(self, path: str, timeout: float = CONNECT_TIMEOUT):
+        """Initialize a DaemonClient.
+
+        Args:
+            path: Path of the Unix socket
+            timeout: Seconds to wait for an answer
+        """
+        self.path = path
+        self.timeout = timeout
+
+    def request(self, op: str, timeout: float = None, **params):
+        """Send a request and wait for its answer.
+
+        Args:
+            op: Request op
+            timeout: Seconds to wait for the answer, self.timeout if None
+            **params: Request parameters
+
+        Returns:
+            The result of the request
+
+        Raises:
+            OSError: If the daemon can't be reached
+            DaemonError: If the daemon answered with an error
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout or self.timeout)
+            sock.connect(self.path)
+            sock.sendall(json.dumps({"op": op, "params": params}).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        if not line:
+            raise ConnectionError("Daemon closed the connection")
+        response = json.loads(line)
+        if not response.get("ok"):
+            raise DaemonError(response.get("error"))
+        return response["result"]
+
+    def alive(self) -> bool:
+        """Check whether a daemon answers on the socket."""
+        try:
+            self.request("status")
+            return True
+        except (OSError, ValueError, DaemonError):
+            return False
+
+    def senders(self, **params) -> Optional[Tuple[List[tuple], int]]:
+        """Get one page of senders, see SenderDataset.senders().
+
+        Returns:
+            Tuple of (key, GmailSender) rows holding counts only and the
+            number of senders before paging, or None if the daemon has no
+            data yet
+        """
+        result = self.request("senders", **params)
+        if result is None:
+            return None
+        rows = [
+            (key, GmailSender.from_counts(key, messages, threads, unread))
+            for key, messages, threads, unread in result["rows"]
+        ]
+        return rows, result["total"]
+
+    def sender(self, key: str, group_by_email: bool = False) -> Optional[GmailSender]:
+        """Get a sender or email address group with its threads.
+
+        Returns:
+            GmailSender, or None if there is no such sender
+        """
+        result = self.request("sender", key=key, group_by_email=group_by_email)
+        return sender_from_dict(result) if result is not None else None
+
+
+def connect_daemon(sync_options: dict) -> Optional[DaemonClient]:
+    """Find a running daemon that can answer for these sync options.
+
+    Args:
+        sync_options: get_sender_counts arguments of the command
+
+    Returns:
+        Client of the daemon, or None if none is running, it has no data
+        yet or it syncs with different options
+    """
+    path = socket_path(sync_options.get("storage_backend"), sync_options.get("db_path"))
+    if not os.path.exists(path):
+        return None
+    client = DaemonClient(path)
+    try:
+        status = client.request("status")
+    except (OSError, ValueError, DaemonError) as e:
+        logger.debug(f"Daemon on {path} not answering: {str(e)}")
+        return None
+    if status.get("protocol") != PROTOCOL_VERSION or not status.get("loaded"):
+        return None
+    wanted = {key: sync_options.get(key) for key in DATA_OPTIONS}
+    if status["sync_options"] != wanted:
+        logger.info("Daemon syncs with different options, not using it")
+        return None
+    return client
@@ -0,0 +1,232 @@
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .sender import GmailSender
+
+# Storage state key holding the email index of the cached senders
+EMAIL_INDEX_KEY = "email_index"
+
+
+class SenderGroup:
+    """All senders sharing one email address, viewed as a single sender.
+
+    A group references its member GmailSender objects instead of copying
+    their threads, and sums their aggregates when they are read.
+
+    Attributes:
+        sender: The shared email address
+        members: GmailSender objects using the address
+    """
+
+    def __init__(self, email: str):
+        """Initialize an empty SenderGroup.
+
+        Args:
+            email: The shared email address
+        """
+        self.sender = email
+        self.members: List[GmailSender] = []
+
+    @property
+    def threads(self) -> List:
+        """Get the threads of every member."""
+        return list(chain.from_iterable(m.threads for m in self.members))
+
+    @property
+    def message_count(self) -> int:
+        """Get the total number of messages from the group."""
+        return sum(m.message_count for m in self.members)
+
+    @property
+    def thread_count(self) -> int:
+        """Get the number of threads from the group."""
+        return sum(m.thread_count for m in self.members)
+
+    @property
+    def unread_count(self) -> int:
+        """Get the number of unread threads from the group."""
+        return sum(m.unread_count for m in self.members)
+
+    @property
+    def first_seen(self) -> Optional[int]:
+        """Get the date of the group's oldest thread."""
+        return min(
+            (m.first_seen for m in self.members if m.first_seen is not None),
+            default=None,
+        )
+
+    @property
+    def last_seen(self) -> Optional[int]:
+        """Get the date of the group's newest thread."""
+        return max(
+            (m.last_seen for m in self.members if m.last_seen is not None),
+            default=None,
+        )
+
+    def num_threads(self) -> int:
+        """Get the number of threads from the group."""
+        return self.thread_count
+
+    def get_email(self) -> str:
+        """Get the shared email address."""
+        return self.sender
+
+    def __str__(self) -> str:
+        """String representation of the group."""
+        return self.sender
+
+    def __repr__(self) -> str:
+        """String representation of the group."""
+        return self.sender
+
+
+class EmailIndex:
+    """Index of sender keys by canonical email address.
+
+    The index is built once for a sender_threads dict and then kept up to
+    date with add() and remove() as senders come and go, so grouped views
+    are dictionary lookups instead of regrouping every sender. Its mapping
+    can be stored with to_state() and restored with load() to skip parsing
+    every sender string on the next run.
+
+    Attributes:
+        senders: The sender_threads dict the index belongs to
+        groups: SenderGroup objects keyed by email address
+    """
+
+    def __init__(
+        self,
+        sender_threads: Dict[str, GmailSender],
+        emails: Optional[Dict[str, List[str]]] = None,
+    ):
+        """Initialize an EmailIndex.
+
+        Args:
+            sender_threads: Dict of GmailSender objects keyed by sender
+            emails: Stored mapping of email address to sender keys, built
+                from sender_threads if None
+        """
+        self.senders = sender_threads
+        self.groups: Dict[str, SenderGroup] = {}
+        # Sender key -> (email, GmailSender) for every indexed sender
+        self._entries: Dict[str, Tuple[str, GmailSender]] = {}
+        if emails is None:
+            for key in sender_threads:
+                self.add(key)
+        else:
+            for email, keys in emails.items():
+                for key in keys:
+                    self._add(key, email)
+
+    @classmethod
+    def load(
+        cls,
+        sender_threads: Dict[str, GmailSender],
+        emails: Optional[Dict[str, List[str]]],
+    ) -> "EmailIndex":
+        """Restore a stored index, rebuilding it if it doesn't match.
+
+        Args:
+            sender_threads: Dict of GmailSender objects keyed by sender
+            emails: Mapping returned by to_state(), or None
+
+        Returns:
+            EmailIndex for sender_threads
+        """
+        if emails is not None:
+            keys = [key for group in emails.values() for key in group]
+            if len(keys) == len(sender_threads) and all(
+                key in sender_threads for key in keys
+            ):
+                return cls(sender_threads, emails)
+        return cls(sender_threads)
+
+    def _add(self, key: str, email: str) -> None:
+        sender = self.senders[key]
+        self._entries[key] = (email, sender)
+        group = self.groups.get(email)
+        if group is None:
+            group = self.groups[email] = SenderGroup(email)
+        group.members.append(sender)
+
+    def add(self, key: str) -> None:
+        """Index a sender that was added to sender_threads.
+
+        Args:
+            key: Sender key in sender_threads
+        """
+        if key in self._entries:
+            self.remove(key)
+        self._add(key, self.senders[key].get_email())
+
+    def remove(self, key: str) -> None:
+        """Drop a sender that was removed from sender_threads.
+
+        Args:
+            key: Sender key that was in sender_threads
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        email, sender = entry
+        group = self.groups[email]
+        group.members = [m for m in group.members if m is not sender]
+        if not group.members:
+            del self.groups[email]
+
+    def get(self, email: str) -> Optional[SenderGroup]:
+        """Get the group of senders using an email address.
+
+        Args:
+            email: Email address as returned by GmailSender.get_email()
+
+        Returns:
+            The SenderGroup, or None if no sender uses the address
+        """
+        return self.groups.get(email)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.groups)
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def to_state(self) -> Dict[str, List[str]]:
+        """Get the index as a JSON-serializable mapping for storage.
+
+        Returns:
+            Dict of email address to the sender keys using it
+        """
+        emails = {}
+        for key, (email, _) in self._entries.items():
+            emails.setdefault(email, []).append(key)
+        return emails
+
+
+# Index of the sender data most recently synced or displayed
+_current_index: Optional[EmailIndex] = None
+
+
+def set_email_index(index: EmailIndex) -> None:
+    """Remember the index maintained for a sender_threads dict.
+
+    Args:
+        index: Index kept up to date with its sender_threads
+    """
+    global _current_index
+    _current_index = index
+
+
+def get_email_index(sender_threads: Dict[str, GmailSender]) -> EmailIndex:
+    """Get the email index for sender_threads, building it if needed.
+
+    Args:
+        sender_threads: Dict of GmailSender objects keyed by sender
+
+    Returns:
+        The remembered index if it belongs to sender_threads, otherwise a
+        new one
+    """
+    if _current_index is None or _current_index.senders is not sender_threads:
+        set_email_index(EmailIndex(sender_threads))
+    return _current_index
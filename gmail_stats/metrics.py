@@ -0,0 +1,473 @@
+import json
+import logging
+import os
+import socket
+import ssl
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Classes retries are counted under, see classify_error()
+ERROR_CLASSES = ("ssl", "rate_limit", "server_error", "timeout", "other")
+
+# Prefix of every exported Prometheus metric
+PROMETHEUS_PREFIX = "gmail_stats"
+
+
+def classify_error(error: BaseException) -> str:
+    """Get the retry class of an error raised by a Gmail API request.
+
+    Args:
+        error: Exception raised by the request
+
+    Returns:
+        One of ERROR_CLASSES
+    """
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status == 429:
+        return "rate_limit"
+    if status is not None and 500 <= status < 600:
+        return "server_error"
+    # urllib3's SSLError doesn't subclass ssl.SSLError, and importing
+    # urllib3 here would defeat the lazy loading of the sync
+    if isinstance(error, ssl.SSLError) or type(error).__name__ == "SSLError":
+        return "ssl"
+    if isinstance(error, (TimeoutError, socket.timeout)):
+        return "timeout"
+    return "other"
+
+
+def peak_rss() -> Optional[int]:
+    """Get the peak resident set size of the process in bytes, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss() -> Optional[int]:
+    """Get the current resident set size of the process in bytes, if known.
+
+    Falls back to the peak RSS where the current one can't be read cheaply.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def memory_snapshot() -> Dict[str, Optional[int]]:
+    """Get the current memory use of the process.
+
+    Returns:
+        Dict with the current and peak RSS, and the current and peak memory
+        traced by tracemalloc (None unless tracemalloc is tracing)
+    """
+    traced = traced_peak = None
+    if tracemalloc.is_tracing():
+        traced, traced_peak = tracemalloc.get_traced_memory()
+    rss, peak = current_rss(), peak_rss()
+    if rss is not None and peak is not None:
+        # The kernel only updates the high-water mark now and then
+        peak = max(peak, rss)
+    return {
+        "rss_bytes": rss,
+        "peak_rss_bytes": peak,
+        "traced_bytes": traced,
+        "traced_peak_bytes": traced_peak,
+    }
+
+
+class Histogram:
+    """Cumulative histogram of observed values, like a Prometheus histogram.
+
+    Attributes:
+        bounds: Upper bounds of the buckets, in increasing order
+        counts: Number of observations in each bucket, plus one for
+            observations above the last bound
+        count: Number of observations
+        sum: Sum of the observations
+    """
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        """Initialize an empty Histogram.
+
+        Args:
+            bounds: Upper bounds of the buckets, in increasing order
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Add an observation."""
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            index = len(self.bounds)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of the bucket holding it.
+
+        Args:
+            q: Quantile between 0 and 1
+
+        Returns:
+            Bucket bound, infinity if the quantile is above the last bound,
+            or None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> dict:
+        """Get the histogram as a JSON-serializable dict."""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {
+                str(bound): count for bound, count in zip(self.bounds, self.counts)
+            },
+            "overflow": self.counts[-1],
+        }
+
+
+class PhaseTimer:
+    """Time, item count and memory use of one sync phase.
+
+    Attributes:
+        seconds: Total time spent in the phase
+        items: Number of threads handled by the phase
+        memory: memory_snapshot() taken when the phase last ended, so
+            growth of the peak RSS between phases shows which one set it
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.items = 0
+        self.memory: Dict[str, Optional[int]] = {}
+
+    @property
+    def rate(self) -> float:
+        """Get the number of items handled per second."""
+        return self.items / self.seconds if self.seconds > 0 else 0.0
+
+
+class SyncMetrics:
+    """Thread-safe counters describing where a sync spends its time.
+
+    Records per-method request counts and latency histograms, retries and
+    backoff time by error class, time spent waiting for the rate limiter,
+    quota units consumed, and the duration and throughput of each sync
+    phase. Counters only ever grow until reset(), so they can be exported
+    while a sync is running.
+
+    Attributes:
+        requests: Number of requests per Gmail API method, counting each
+            sub-request of a batch, plus 'batch' for batch HTTP requests
+        latency: Latency histogram per method
+        errors: Number of failed requests per error class
+        retries: Number of retries per error class
+        backoff_seconds: Time slept before retrying per error class
+        limiter_wait_seconds: Time spent waiting for the rate limiter
+        quota_units: Quota units consumed per method
+        phases: PhaseTimer per sync phase
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear every counter."""
+        with self._lock:
+            self.started = time.time()
+            self.requests: Dict[str, int] = {}
+            self.latency: Dict[str, Histogram] = {}
+            self.errors: Dict[str, int] = {}
+            self.retries: Dict[str, int] = {}
+            self.backoff_seconds: Dict[str, float] = {}
+            self.limiter_wait_seconds = 0.0
+            self.quota_units: Dict[str, int] = {}
+            self.phases: Dict[str, PhaseTimer] = {}
+
+    def record_request(
+        self, method: str, seconds: Optional[float] = None, count: int = 1
+    ) -> None:
+        """Record requests to a Gmail API method.
+
+        Args:
+            method: Gmail API method name, e.g. 'users.threads.get', or
+                'batch' for a batch HTTP request
+            seconds: Latency of the request, None if not measured separately
+                (e.g. sub-requests of a batch)
+            count: Number of requests
+        """
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + count
+            if seconds is not None:
+                histogram = self.latency.get(method)
+                if histogram is None:
+                    histogram = self.latency[method] = Histogram()
+                histogram.observe(seconds)
+
+    def record_error(self, error: BaseException, count: int = 1) -> str:
+        """Record failed requests.
+
+        Args:
+            error: Exception the requests failed with
+            count: Number of failed requests
+
+        Returns:
+            Error class of the error
+        """
+        error_class = classify_error(error)
+        with self._lock:
+            self.errors[error_class] = self.errors.get(error_class, 0) + count
+        return error_class
+
+    def record_retry(self, error: BaseException, backoff: float) -> None:
+        """Record a retry after an error.
+
+        Args:
+            error: Exception that caused the retry
+            backoff: Seconds slept before retrying
+        """
+        error_class = classify_error(error)
+        with self._lock:
+            self.retries[error_class] = self.retries.get(error_class, 0) + 1
+            self.backoff_seconds[error_class] = (
+                self.backoff_seconds.get(error_class, 0.0) + backoff
+            )
+
+    def record_quota(self, method: str, units: int, waited: float) -> None:
+        """Record quota acquired from the rate limiter.
+
+        Args:
+            method: Gmail API method the quota was for
+            units: Quota units consumed
+            waited: Seconds spent waiting for them
+        """
+        with self._lock:
+            self.quota_units[method] = self.quota_units.get(method, 0) + units
+            self.limiter_wait_seconds += waited
+
+    def record_phase(self, name: str, seconds: float, items: int = 0) -> None:
+        """Add time and handled items to a sync phase.
+
+        Args:
+            name: Phase name, e.g. 'list' or 'fetch'
+            seconds: Time spent
+            items: Number of threads handled
+        """
+        memory = memory_snapshot()
+        with self._lock:
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = PhaseTimer()
+            phase.seconds += seconds
+            phase.items += items
+            phase.memory = memory
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[PhaseTimer]:
+        """Time a block as a sync phase.
+
+        Set items on the yielded PhaseTimer to the number of threads the
+        block handled.
+
+        Args:
+            name: Phase name
+        """
+        timer = PhaseTimer()
+        start = time.monotonic()
+        try:
+            yield timer
+        finally:
+            self.record_phase(name, time.monotonic() - start, timer.items)
+
+    def summary(self) -> dict:
+        """Get every counter as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                "started": self.started,
+                "requests": dict(self.requests),
+                "latency": {m: h.to_dict() for m, h in self.latency.items()},
+                "errors": dict(self.errors),
+                "retries": dict(self.retries),
+                "backoff_seconds": dict(self.backoff_seconds),
+                "limiter_wait_seconds": self.limiter_wait_seconds,
+                "quota_units": dict(self.quota_units),
+                "phases": {
+                    name: {
+                        "seconds": phase.seconds,
+                        "threads": phase.items,
+                        "threads_per_second": phase.rate,
+                        **phase.memory,
+                    }
+                    for name, phase in self.phases.items()
+                },
+            }
+
+    def to_json(self) -> str:
+        """Export the counters as JSON."""
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Export the counters in the Prometheus text exposition format.
+
+        The output can be written to a node_exporter textfile collector
+        directory.
+        """
+        summary = self.summary()
+        with self._lock:
+            latency = {
+                m: (h.bounds, list(h.counts), h.sum, h.count)
+                for m, h in self.latency.items()
+            }
+        p = PROMETHEUS_PREFIX
+        lines: List[str] = []
+
+        def sample(name, labels, value):
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            label_text = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"{p}_{name}{label_text} {value}")
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {kind}")
+            for labels, value in samples:
+                sample(name, labels, value)
+
+        metric(
+            "requests_total",
+            "counter",
+            "Gmail API requests by method.",
+            [({"method": m}, n) for m, n in sorted(summary["requests"].items())],
+        )
+
+        # One histogram family holds the _bucket, _sum and _count samples
+        metric(
+            "request_duration_seconds",
+            "histogram",
+            "Gmail API request latency by method.",
+            [],
+        )
+        for method, (bounds, counts, total, count) in sorted(latency.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                sample(
+                    "request_duration_seconds_bucket",
+                    {"method": method, "le": bound},
+                    cumulative,
+                )
+            sample(
+                "request_duration_seconds_bucket",
+                {"method": method, "le": "+Inf"},
+                cumulative + counts[-1],
+            )
+            sample("request_duration_seconds_sum", {"method": method}, total)
+            sample("request_duration_seconds_count", {"method": method}, count)
+
+        for name, key, help_text in (
+            ("request_errors_total", "errors", "Failed requests by error class."),
+            ("retries_total", "retries", "Request retries by error class."),
+            (
+                "backoff_seconds_total",
+                "backoff_seconds",
+                "Time slept before retries by error class.",
+            ),
+        ):
+            metric(
+                name,
+                "counter",
+                help_text,
+                [({"class": c}, v) for c, v in sorted(summary[key].items())],
+            )
+
+        metric(
+            "rate_limiter_wait_seconds_total",
+            "counter",
+            "Time spent waiting for quota.",
+            [({}, summary["limiter_wait_seconds"])],
+        )
+        metric(
+            "quota_units_total",
+            "counter",
+            "Gmail quota units consumed by method.",
+            [({"method": m}, u) for m, u in sorted(summary["quota_units"].items())],
+        )
+        phases = sorted(summary["phases"].items())
+        metric(
+            "phase_seconds_total",
+            "counter",
+            "Time spent in each sync phase.",
+            [({"phase": n}, v["seconds"]) for n, v in phases],
+        )
+        metric(
+            "phase_threads_total",
+            "counter",
+            "Threads handled by each sync phase.",
+            [({"phase": n}, v["threads"]) for n, v in phases],
+        )
+        for key, help_text in (
+            ("rss_bytes", "Resident set size when each phase last ended."),
+            ("peak_rss_bytes", "Peak resident set size when each phase last ended."),
+            ("traced_bytes", "Memory traced by tracemalloc when each phase ended."),
+            (
+                "traced_peak_bytes",
+                "Peak memory traced by tracemalloc when each phase ended.",
+            ),
+        ):
+            samples = [({"phase": n}, v[key]) for n, v in phases if v.get(key)]
+            if samples:
+                metric(f"phase_{key}", "gauge", help_text, samples)
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Write the counters to a file.
+
+        Files ending in .prom are written in the Prometheus text format,
+        everything else as JSON.
+
+        Args:
+            path: Output file path
+        """
+        content = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        # Write then rename, so a textfile collector never reads a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote sync metrics to {path}")
+
+
+# Metrics of every sync run in this process
+sync_metrics = SyncMetrics()
@@ -0,0 +1,186 @@
+import cProfile
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """Accumulated timing of a named phase and the phases nested in it.
+
+    Attributes:
+        name: Phase name
+        calls: Number of times the phase ran
+        seconds: Total wall time spent in the phase
+        children: Nested spans keyed by name, in first-seen order
+    """
+
+    def __init__(self, name: str):
+        """Initialize an empty Span.
+
+        Args:
+            name: Phase name
+        """
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.children: Dict[str, "Span"] = {}
+
+    def child(self, name: str) -> "Span":
+        """Get the nested span with a name, creating it if needed."""
+        span = self.children.get(name)
+        if span is None:
+            span = self.children[name] = Span(name)
+        return span
+
+
+class Profiler:
+    """Times named phases of a command, optionally under cProfile.
+
+    Phases are timed with span(), or with the timed() decorator on the
+    functions implementing them. Spans opened while another span is open
+    on the same thread are nested in it. Spans opened at the top level of
+    another thread, such as the listing thread of a sync, are kept at the
+    top level with the thread name appended, since they run concurrently
+    with the main thread.
+
+    While the profiler is not started, spans cost one attribute check.
+
+    Attributes:
+        enabled: Whether spans are being recorded
+        root: Span holding the top-level spans
+        wall_seconds: Wall time between start() and stop()
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.root = Span("total")
+        self.wall_seconds = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._thread = None
+        self._started = None
+        self._cprofile: Optional[cProfile.Profile] = None
+
+    def start(self, cprofile: bool = False) -> None:
+        """Start recording spans from a clean slate.
+
+        Args:
+            cprofile: Also run cProfile on the calling thread
+        """
+        self.root = Span("total")
+        self.wall_seconds = 0.0
+        self._thread = threading.current_thread()
+        self._started = time.perf_counter()
+        self._cprofile = None
+        if cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self.enabled = True
+
+    def stop(self) -> None:
+        """Stop recording spans and cProfile."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self.wall_seconds = time.perf_counter() - self._started
+
+    def dump_stats(self, path: str) -> None:
+        """Write the cProfile statistics to a .prof file.
+
+        The file can be read with pstats or tools such as snakeviz.
+
+        Args:
+            path: Output file path
+
+        Raises:
+            RuntimeError: If cProfile was not run
+        """
+        if self._cprofile is None:
+            raise RuntimeError("cProfile was not started")
+        self._cprofile.dump_stats(path)
+        logger.info(f"Wrote cProfile statistics to {path}")
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time a block as a named phase.
+
+        Args:
+            name: Phase name
+        """
+        if not self.enabled:
+            yield
+            return
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        if stack:
+            parent = stack[-1]
+        else:
+            parent = self.root
+            current = threading.current_thread()
+            if current is not self._thread:
+                name = f"{name} [{current.name}]"
+        with self._lock:
+            span = parent.child(name)
+        stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                span.calls += 1
+                span.seconds += elapsed
+
+    def breakdown(self) -> List[Tuple[int, Span]]:
+        """Get every recorded span with its nesting depth, depth first.
+
+        Returns:
+            List of (depth, span) tuples, top-level spans having depth 0
+        """
+        rows = []
+
+        def walk(span: Span, depth: int) -> None:
+            for child in span.children.values():
+                rows.append((depth, child))
+                walk(child, depth + 1)
+
+        with self._lock:
+            walk(self.root, 0)
+        return rows
+
+
+# Profiler of the running command
+profiler = Profiler()
+
+
+def timed(name: str) -> Callable:
+    """Decorate a function to time every call as a span of the profiler.
+
+    Args:
+        name: Phase name
+
+    Returns:
+        Decorator
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with profiler.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
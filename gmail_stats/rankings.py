@@ -0,0 +1,324 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, List, Optional, Tuple
+
+from .profiling import timed
+from .sender import GmailSender
+
+# Storage state key holding the rankings of the cached senders
+RANKINGS_KEY = "rankings"
+# Bumped when the stored rankings change incompatibly
+RANKINGS_VERSION = 1
+
+# Column of each sort criteria in a ranking row
+SORT_COLUMNS = {"messages": 0, "threads": 1, "unread_threads": 2}
+
+# Above this fraction of changed rows, re-sorting beats moving each row
+RESORT_FRACTION = 0.1
+
+
+class Ranking:
+    """Senders or email address groups kept sorted by every count.
+
+    Each row holds a key's message, thread and unread counts and a
+    sequence number that orders keys with equal counts by when they were
+    first ranked. For every sort criteria the keys are kept in descending
+    order of that count, so a page is a slice and update() only moves the
+    rows whose counts changed.
+
+    Attributes:
+        rows: [messages, threads, unread, sequence] keyed by sender or email
+        orders: Keys in ranking order for every sort criteria
+    """
+
+    def __init__(
+        self,
+        rows: Optional[Dict[str, list]] = None,
+        orders: Optional[Dict[str, List[str]]] = None,
+        next_seq: int = 0,
+    ):
+        """Initialize a Ranking.
+
+        Args:
+            rows: [messages, threads, unread, sequence] keyed by sender
+            orders: Keys in ranking order for every sort criteria, sorted
+                from rows if None
+            next_seq: Sequence number of the next key ranked
+        """
+        self.rows = rows or {}
+        self.next_seq = next_seq
+        if orders is None:
+            orders = {
+                sort_by: self._sorted(column)
+                for sort_by, column in SORT_COLUMNS.items()
+            }
+        self.orders = orders
+
+    def _sort_key(self, column: int):
+        rows = self.rows
+        return lambda key: (-rows[key][column], rows[key][3])
+
+    def _sorted(self, column: int) -> List[str]:
+        return sorted(self.rows, key=self._sort_key(column))
+
+    def _remove(self, key: str) -> None:
+        for sort_by, column in SORT_COLUMNS.items():
+            order = self.orders[sort_by]
+            row = self.rows[key]
+            del order[
+                bisect_left(order, (-row[column], row[3]), key=self._sort_key(column))
+            ]
+
+    def _insert(self, key: str) -> None:
+        for sort_by, column in SORT_COLUMNS.items():
+            insort(self.orders[sort_by], key, key=self._sort_key(column))
+
+    def update(self, counts: Dict[str, Tuple[int, int, int]]) -> int:
+        """Bring the ranking in line with the current counts.
+
+        Args:
+            counts: (messages, threads, unread) keyed by sender or email
+
+        Returns:
+            Number of keys added, removed or changed
+        """
+        removed = [key for key in self.rows if key not in counts]
+        changed = [
+            key
+            for key, row in counts.items()
+            if key not in self.rows or tuple(self.rows[key][:3]) != tuple(row)
+        ]
+        moves = len(removed) + len(changed)
+        if not moves:
+            return 0
+
+        if moves > RESORT_FRACTION * max(len(self.rows), 1):
+            for key in removed:
+                del self.rows[key]
+            for key in changed:
+                self._set_row(key, counts[key])
+            self.orders = {
+                sort_by: self._sorted(column)
+                for sort_by, column in SORT_COLUMNS.items()
+            }
+            return moves
+
+        for key in removed:
+            self._remove(key)
+            del self.rows[key]
+        for key in changed:
+            if key in self.rows:
+                self._remove(key)
+            self._set_row(key, counts[key])
+            self._insert(key)
+        return moves
+
+    def _set_row(self, key: str, counts: Tuple[int, int, int]) -> None:
+        row = self.rows.get(key)
+        if row is None:
+            self.rows[key] = [*counts, self.next_seq]
+            self.next_seq += 1
+        else:
+            row[:3] = counts
+
+    def page(
+        self,
+        sort_by: str = "messages",
+        limit: Optional[int] = None,
+        offset: int = 0,
+        min_count: int = 0,
+    ) -> Tuple[List[Tuple[str, int, int, int]], int]:
+        """Get one page of the ranking.
+
+        Args:
+            sort_by: Criteria to sort by ('messages', 'threads', or 'unread_threads')
+            limit: Maximum number of rows to return, None for all
+            offset: Number of top rows to skip
+            min_count: Only include keys whose sort count is at least this
+
+        Returns:
+            Tuple of (key, messages, threads, unread) rows and the number of
+            keys before paging
+        """
+        if sort_by not in SORT_COLUMNS:
+            raise ValueError(f"Invalid sort criteria: {sort_by}")
+        order = self.orders[sort_by]
+        total = len(order)
+        if min_count > 0:
+            # Keys are sorted by descending count, so the matches are a prefix
+            column = SORT_COLUMNS[sort_by]
+            total = bisect_right(
+                order, (-min_count, float("inf")), key=self._sort_key(column)
+            )
+        end = total if limit is None else min(total, offset + limit)
+        return [(key, *self.rows[key][:3]) for key in order[offset:end]], total
+
+    def to_state(self) -> dict:
+        """Get the ranking as a JSON-serializable mapping for storage."""
+        keys = list(self.rows)
+        position = {key: index for index, key in enumerate(keys)}
+        return {
+            "rows": [[key, *self.rows[key]] for key in keys],
+            "orders": {
+                sort_by: [position[key] for key in order]
+                for sort_by, order in self.orders.items()
+            },
+            "next_seq": self.next_seq,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Ranking":
+        """Restore a ranking from a mapping returned by to_state()."""
+        keys = [row[0] for row in state["rows"]]
+        return cls(
+            {row[0]: row[1:] for row in state["rows"]},
+            {
+                sort_by: [keys[index] for index in order]
+                for sort_by, order in state["orders"].items()
+            },
+            state["next_seq"],
+        )
+
+
+class SenderRankings:
+    """Rankings of the senders and of their email address groups.
+
+    Rankings only depend on each sender's counts, so they can be kept up to
+    date after every sync and stored next to the cache. Listing senders
+    then reads one page of a ranking instead of loading and sorting every
+    sender.
+
+    Attributes:
+        senders: Ranking of senders keyed by sender
+        groups: Ranking of senders grouped by email address
+    """
+
+    def __init__(
+        self, senders: Optional[Ranking] = None, groups: Optional[Ranking] = None
+    ):
+        """Initialize SenderRankings.
+
+        Args:
+            senders: Ranking of senders, empty if None
+            groups: Ranking of email address groups, empty if None
+        """
+        self.senders = senders or Ranking()
+        self.groups = groups or Ranking()
+
+    @classmethod
+    def build(cls, sender_threads: Dict[str, GmailSender]) -> "SenderRankings":
+        """Rank a set of senders.
+
+        Args:
+            sender_threads: Dict of GmailSender objects keyed by sender
+
+        Returns:
+            SenderRankings of sender_threads
+        """
+        rankings = cls()
+        rankings.update(sender_threads)
+        return rankings
+
+    def update(self, sender_threads: Dict[str, GmailSender]) -> int:
+        """Re-rank the senders and groups whose counts changed.
+
+        Only the senders' aggregates are read, never their threads.
+
+        Args:
+            sender_threads: Dict of GmailSender objects keyed by sender
+
+        Returns:
+            Number of senders and groups added, removed or changed
+        """
+        counts = {}
+        groups = {}
+        for key, sender in sender_threads.items():
+            row = (sender.message_count, sender.thread_count, sender.unread_count)
+            counts[key] = row
+            group = groups.get(sender.get_email())
+            if group is None:
+                groups[sender.get_email()] = row
+            else:
+                groups[sender.get_email()] = tuple(a + b for a, b in zip(group, row))
+        return self.senders.update(counts) + self.groups.update(groups)
+
+    def page(
+        self,
+        sort_by: str = "messages",
+        group_by_email: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        min_count: int = 0,
+    ) -> Tuple[List[Tuple[str, int, int, int]], int]:
+        """Get one page of senders, see Ranking.page().
+
+        Args:
+            sort_by: Criteria to sort by ('messages', 'threads', or 'unread_threads')
+            group_by_email: Whether to rank email address groups
+            limit: Maximum number of rows to return, None for all
+            offset: Number of top rows to skip
+            min_count: Only include rows whose sort count is at least this
+
+        Returns:
+            Tuple of (key, messages, threads, unread) rows and the number of
+            rows before paging
+        """
+        ranking = self.groups if group_by_email else self.senders
+        return ranking.page(sort_by, limit, offset, min_count)
+
+    def to_state(self) -> dict:
+        """Get the rankings as a JSON-serializable mapping for storage."""
+        return {
+            "version": RANKINGS_VERSION,
+            "senders": self.senders.to_state(),
+            "groups": self.groups.to_state(),
+        }
+
+    @classmethod
+    def from_state(cls, state: Optional[dict]) -> Optional["SenderRankings"]:
+        """Restore stored rankings.
+
+        Args:
+            state: Mapping returned by to_state(), or None
+
+        Returns:
+            SenderRankings, or None if nothing or an older version is stored
+        """
+        if not state or state.get("version") != RANKINGS_VERSION:
+            return None
+        return cls(
+            Ranking.from_state(state["senders"]), Ranking.from_state(state["groups"])
+        )
+
+
+@timed("storage.load")
+def load_rankings(storage) -> Optional[SenderRankings]:
+    """Read the rankings stored next to a cache.
+
+    Args:
+        storage: Storage holding the cache
+
+    Returns:
+        SenderRankings, or None if the cache has none
+    """
+    return SenderRankings.from_state(storage.get_state(RANKINGS_KEY))
+
+
+def update_rankings_state(
+    state: Optional[dict], sender_threads: Dict[str, GmailSender]
+) -> dict:
+    """Update stored rankings to match the senders being saved.
+
+    Storages call this when they save, so the rankings always describe the
+    saved senders. Stored rankings are updated rather than rebuilt, so a
+    save that changed a few senders only moves their rows.
+
+    Args:
+        state: Rankings stored so far, or None
+        sender_threads: Dict of GmailSender objects being saved
+
+    Returns:
+        Rankings to store
+    """
+    rankings = SenderRankings.from_state(state) or SenderRankings()
+    rankings.update(sender_threads)
+    return rankings.to_state()
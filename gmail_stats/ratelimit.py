@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Quota units charged per Gmail API method, see
+# https://developers.google.com/gmail/api/reference/quota
+# Each sub-request of a batch request is charged separately.
+METHOD_QUOTA_UNITS = {
+    "users.getProfile": 1,
+    "users.history.list": 2,
+    "users.labels.get": 1,
+    "users.labels.list": 1,
+    "users.messages.get": 5,
+    "users.messages.list": 5,
+    "users.threads.get": 10,
+    "users.threads.list": 10,
+}
+DEFAULT_QUOTA_UNITS = 10
+
+# Gmail allows 15,000 quota units per user per minute (250 per second) and
+# by default 1,000,000,000 quota units per project per day.
+PER_USER_UNITS_PER_SECOND = 250
+DAILY_PROJECT_UNITS = 1_000_000_000
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class QuotaExceededError(Exception):
+    """Raised when a request would exceed the daily quota budget."""
+
+
+class QuotaTokenBucket:
+    """Token bucket rate limiter that charges Gmail quota units per method.
+
+    Tokens are quota units refilled at units_per_second up to burst. A
+    request whose cost is larger than the bucket waits until the bucket is
+    full and then drives it negative, so large batch requests are allowed
+    but still pay for every sub-request before the next caller proceeds.
+
+    The daily limit is counted over fixed 24 hour windows, not a rolling
+    day. The first window starts when the bucket is created. Each later one
+    starts at the first request made after the previous window ended, and
+    the units count resets to zero.
+
+    Attributes:
+        units_per_second: Sustained quota units allowed per second
+        burst: Maximum number of units that can be spent at once
+        daily_limit: Maximum units per 24 hour window, or None for no limit
+        units_consumed: Total units handed out since creation
+    """
+
+    def __init__(
+        self,
+        units_per_second: float = PER_USER_UNITS_PER_SECOND,
+        burst: Optional[float] = None,
+        daily_limit: Optional[int] = DAILY_PROJECT_UNITS,
+        method_costs: Optional[Dict[str, int]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize a QuotaTokenBucket.
+
+        Args:
+            units_per_second: Sustained quota units allowed per second
+            burst: Bucket size, defaults to one second worth of units
+            daily_limit: Maximum units per 24 hour window, or None for no
+                limit
+            method_costs: Quota units per method, defaults to Gmail's costs
+            clock: Monotonic clock, replaceable for tests
+        """
+        self.units_per_second = float(units_per_second)
+        self.burst = float(burst if burst is not None else units_per_second)
+        self.daily_limit = daily_limit
+        self.method_costs = dict(method_costs or METHOD_QUOTA_UNITS)
+        self.units_consumed = 0
+        self._clock = clock
+        self._tokens = self.burst
+        self._last_refill = clock()
+        self._day_start = clock()
+        self._day_units = 0
+        self._condition = threading.Condition()
+
+    def cost(self, method: str, count: int = 1) -> int:
+        """Get the quota cost of calling a method count times.
+
+        Args:
+            method: Gmail API method name, e.g. 'users.threads.get'
+            count: Number of calls
+
+        Returns:
+            Total quota units
+        """
+        return self.method_costs.get(method, DEFAULT_QUOTA_UNITS) * count
+
+    def acquire(
+        self, method: str, count: int = 1, timeout: Optional[float] = None
+    ) -> float:
+        """Block until enough quota is available for count calls of method.
+
+        Args:
+            method: Gmail API method name, e.g. 'users.threads.get'
+            count: Number of calls, e.g. sub-requests in a batch
+            timeout: Maximum seconds to wait, None to wait as long as needed
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            QuotaExceededError: If the daily limit would be exceeded
+            TimeoutError: If the quota did not become available in time
+        """
+        cost = self.cost(method, count)
+        start = self._clock()
+        deadline = None if timeout is None else start + timeout
+
+        with self._condition:
+            while True:
+                now = self._clock()
+                self._roll_day(now)
+                if (
+                    self.daily_limit is not None
+                    and self._day_units + cost > self.daily_limit
+                ):
+                    raise QuotaExceededError(
+                        f"Daily quota of {self.daily_limit} units exhausted "
+                        f"({self._day_units} used, {method} needs {cost})"
+                    )
+
+                self._refill(now)
+                needed = min(cost, self.burst)
+                if self._tokens >= needed:
+                    self._tokens -= cost
+                    self._day_units += cost
+                    self.units_consumed += cost
+                    return now - start
+
+                wait = (needed - self._tokens) / self.units_per_second
+                if deadline is not None:
+                    if now >= deadline:
+                        raise TimeoutError(
+                            f"Timed out waiting for {cost} quota units for {method}"
+                        )
+                    wait = min(wait, deadline - now)
+                self._condition.wait(wait)
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last_refill
+        if elapsed > 0:
+            self._tokens = min(
+                self.burst, self._tokens + elapsed * self.units_per_second
+            )
+            self._last_refill = now
+
+    def _roll_day(self, now: float) -> None:
+        if now - self._day_start >= SECONDS_PER_DAY:
+            self._day_start = now
+            self._day_units = 0
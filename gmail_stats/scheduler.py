@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AIMDController:
+    """Additive-increase/multiplicative-decrease concurrency limit.
+
+    The limit grows by roughly one slot per round of successful requests
+    while latency stays under the target, and is cut by a constant factor
+    when the API throttles us (429) or fails (5xx). Decreases are limited to
+    one per cooldown period so that a burst of failures from requests that
+    were already in flight only counts once.
+
+    Attributes:
+        minimum: Lowest concurrency the controller will go down to
+        maximum: Highest concurrency the controller will go up to
+        latency_target: Request latency in seconds above which the limit
+            stops growing and starts shrinking
+    """
+
+    def __init__(
+        self,
+        initial: int = 2,
+        minimum: int = 1,
+        maximum: int = 16,
+        decrease_factor: float = 0.5,
+        latency_target: float = 10.0,
+        cooldown: float = 2.0,
+    ):
+        """Initialize an AIMDController.
+
+        Args:
+            initial: Starting concurrency
+            minimum: Lowest concurrency the controller will go down to
+            maximum: Highest concurrency the controller will go up to
+            decrease_factor: Factor the limit is multiplied by on congestion
+            latency_target: Request latency in seconds considered healthy
+            cooldown: Minimum seconds between two decreases
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self) -> int:
+        """Get the current number of requests allowed in flight."""
+        return int(self._limit)
+
+    def on_success(self, latency: float) -> None:
+        """Record a successful request.
+
+        Args:
+            latency: How long the request took in seconds
+        """
+        if latency > self.latency_target:
+            self._decrease()
+            return
+        with self._lock:
+            self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+
+    def on_throttle(self) -> None:
+        """Record a rate limit or server error response."""
+        self._decrease()
+
+    def _decrease(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            old_limit = self._limit
+            self._limit = max(self.minimum, self._limit * self.decrease_factor)
+        logger.debug(
+            f"Reduced fetch concurrency from {old_limit:.1f} to {self._limit:.1f}"
+        )
+
+
+class FetchScheduler:
+    """Long-lived worker pool whose concurrency is set by an AIMDController.
+
+    submit() blocks while the number of tasks in flight is at the
+    controller's current limit, so callers can feed work as fast as they
+    like without sleeping between batches.
+
+    Tasks report to the controller themselves, e.g. through the
+    on_throttle and on_latency callbacks of fetch_thread_batch. Only a task
+    knows which of its errors are throttling and how long its requests took
+    apart from quota waits and backoff. Other failures and slow tasks leave
+    the concurrency alone.
+
+    Attributes:
+        controller: Controller deciding how many tasks may run at once
+    """
+
+    def __init__(
+        self,
+        controller: Optional[AIMDController] = None,
+        throughput_window: float = 10.0,
+    ):
+        """Initialize a FetchScheduler.
+
+        Args:
+            controller: Concurrency controller, a default AIMDController if None
+            throughput_window: Seconds of history used to compute throughput
+        """
+        self.controller = controller or AIMDController()
+        self.throughput_window = throughput_window
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.controller.maximum, thread_name_prefix="gmail-fetch"
+        )
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._completions = deque()
+        self._closed = False
+
+    @property
+    def concurrency(self) -> int:
+        """Get the current concurrency limit."""
+        return self.controller.concurrency
+
+    @property
+    def in_flight(self) -> int:
+        """Get the number of tasks currently running."""
+        return self._in_flight
+
+    @property
+    def throughput(self) -> float:
+        """Get the number of items completed per second over the recent window."""
+        with self._condition:
+            self._expire_completions(time.monotonic())
+            if not self._completions:
+                return 0.0
+            items = sum(count for _, count in self._completions)
+            elapsed = max(
+                time.monotonic() - self._completions[0][0],
+                min(1.0, self.throughput_window),
+            )
+            return items / elapsed
+
+    def submit(self, fn: Callable, *args, items: int = 1, **kwargs) -> Future:
+        """Run a task once a concurrency slot is free.
+
+        Args:
+            fn: Callable to run on a worker thread
+            *args: Positional arguments for fn
+            items: Number of work items the task covers, used for throughput
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            Future for the task's result
+        """
+        with self._condition:
+            while self._in_flight >= self.controller.concurrency:
+                if self._closed:
+                    break
+                self._condition.wait(timeout=0.5)
+            if self._closed:
+                raise RuntimeError("FetchScheduler has been shut down")
+            self._in_flight += 1
+
+        try:
+            return self._executor.submit(self._run, fn, items, args, kwargs)
+        except Exception:
+            self._release(0)
+            raise
+
+    def _run(self, fn: Callable, items: int, args: tuple, kwargs: dict):
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self._release(0)
+            raise
+        self._release(items)
+        return result
+
+    def _release(self, items: int) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            if items:
+                now = time.monotonic()
+                self._completions.append((now, items))
+                self._expire_completions(now)
+            self._condition.notify_all()
+
+    def _expire_completions(self, now: float) -> None:
+        while self._completions and now - self._completions[0][0] > (
+            self.throughput_window
+        ):
+            self._completions.popleft()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting tasks and shut down the worker threads.
+
+        Args:
+            wait: Wait for running tasks to finish
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
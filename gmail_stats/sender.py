@@ -1,3 +1,4 @@
+import sys
 from typing import List, Optional
 from .thread import GmailThread
 
@@ -5,6 +6,11 @@ from .thread import GmailThread
 class GmailSender:
     """Represents a Gmail sender with their associated email threads.
 
+    Message, thread and unread counts and the first/last seen dates are kept
+    up to date as threads are added, removed or relabelled, so reading them
+    never scans the threads. The threads themselves can be evicted once they
+    are stored elsewhere, leaving only the counts, see evict_threads().
+
     Attributes:
         sender: The sender's email address or name
         threads: List of GmailThread objects associated with this sender
@@ -16,24 +22,133 @@ class GmailSender:
         Args:
             sender: The sender's email address or name
         """
-        self.sender = sender
+        # Interned so every thread from this sender shares the string
+        self.sender = sys.intern(sender) if sender else sender
         self.threads = []
+        self._email = None
         self._message_count = 0
+        self._thread_count = 0
+        self._unread_count = 0
+        self._first_seen = None
+        self._last_seen = None
 
     @property
     def message_count(self) -> int:
         """Get the total number of messages from this sender."""
         return self._message_count
 
+    @classmethod
+    def from_counts(
+        cls,
+        sender: str,
+        message_count: int,
+        thread_count: int,
+        unread_count: int,
+        first_seen: Optional[int] = None,
+        last_seen: Optional[int] = None,
+    ) -> "GmailSender":
+        """Create a sender holding only counts, with its threads evicted.
+
+        Args:
+            sender: The sender's email address or name
+            message_count: Total number of messages from the sender
+            thread_count: Number of threads from the sender
+            unread_count: Number of unread threads from the sender
+            first_seen: Date of the oldest thread in milliseconds
+            last_seen: Date of the newest thread in milliseconds
+
+        Returns:
+            GmailSender without threads
+        """
+        gmail_sender = cls(sender)
+        gmail_sender._message_count = message_count
+        gmail_sender._thread_count = thread_count
+        gmail_sender._unread_count = unread_count
+        gmail_sender._first_seen = first_seen
+        gmail_sender._last_seen = last_seen
+        return gmail_sender
+
+    @property
+    def thread_count(self) -> int:
+        """Get the number of threads from this sender."""
+        return self._thread_count
+
+    @property
+    def threads_evicted(self) -> bool:
+        """Check whether some of the sender's threads were evicted."""
+        return len(self.threads) < self._thread_count
+
+    @property
+    def unread_count(self) -> int:
+        """Get the number of unread threads from this sender."""
+        return self._unread_count
+
+    @property
+    def first_seen(self) -> Optional[int]:
+        """Get the date of the oldest thread in milliseconds since the epoch."""
+        return self._first_seen
+
+    @property
+    def last_seen(self) -> Optional[int]:
+        """Get the date of the newest thread in milliseconds since the epoch."""
+        return self._last_seen
+
+    def _count_thread(self, thread: GmailThread) -> None:
+        self._message_count += thread.message_count
+        self._thread_count += 1
+        if thread.is_unread:
+            self._unread_count += 1
+        if thread.date is not None:
+            if self._first_seen is None or thread.date < self._first_seen:
+                self._first_seen = thread.date
+            if self._last_seen is None or thread.date > self._last_seen:
+                self._last_seen = thread.date
+
     def add_thread(self, thread) -> None:
         """Add a thread to this sender's threads."""
         self.threads.append(thread)
-        self._message_count += 1
+        self._count_thread(thread)
 
     def add_threads(self, threads) -> None:
         """Add multiple threads to this sender's threads."""
-        self.threads.extend(threads)
-        self._message_count += len(threads)
+        for thread in threads:
+            self.add_thread(thread)
+
+    def remove_thread(self, thread_id: str):
+        """Remove a thread from this sender's threads.
+
+        Args:
+            thread_id: ID of the thread to remove
+
+        Returns:
+            The removed GmailThread, or None if the sender has no such thread
+        """
+        for index, thread in enumerate(self.threads):
+            if thread.thread_id == thread_id:
+                self.threads.pop(index)
+                self._message_count -= thread.message_count
+                self._thread_count -= 1
+                if thread.is_unread:
+                    self._unread_count -= 1
+                if thread.date is not None and thread.date in (
+                    self._first_seen,
+                    self._last_seen,
+                ):
+                    dates = [t.date for t in self.threads if t.date is not None]
+                    self._first_seen = min(dates, default=None)
+                    self._last_seen = max(dates, default=None)
+                return thread
+        return None
+
+    def evict_threads(self) -> int:
+        """Drop the threads, keeping the counts and dates they added up to.
+
+        Returns:
+            Number of threads dropped
+        """
+        evicted = len(self.threads)
+        self.threads = []
+        return evicted
 
     def num_threads(self) -> int:
         """Get the number of threads associated with this sender.
@@ -41,20 +156,24 @@ class GmailSender:
         Returns:
             The number of threads
         """
-        return len(self.threads)
+        return self._thread_count
 
     def get_email(self) -> str:
         """Extract the email address from the sender string.
 
         If the sender string is in the format "Name <email@example.com>",
         extracts just the email address. Otherwise returns the original string.
+        The result is computed once and cached.
 
         Returns:
             The sender's email address
         """
-        if self.sender and "<" not in self.sender:
-            return self.sender
-        return self.sender.split("<")[1].split(">")[0]
+        if self._email is None:
+            if self.sender and "<" not in self.sender:
+                self._email = self.sender
+            else:
+                self._email = self.sender.split("<")[1].split(">")[0]
+        return self._email
 
     def __str__(self) -> str:
         """String representation of the sender."""
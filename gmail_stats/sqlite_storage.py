@@ -0,0 +1,600 @@
+import sqlite3
+import os
+import logging
+import json
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from .profiling import timed
+from .rankings import RANKINGS_KEY, update_rankings_state
+from .sender import GmailSender
+from .thread import GmailThread
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS senders (
+    sender TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    message_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_senders_email ON senders (email);
+
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    sender TEXT NOT NULL,
+    email TEXT NOT NULL,
+    subject TEXT,
+    history_id TEXT,
+    message_count INTEGER NOT NULL DEFAULT 1,
+    date INTEGER,
+    sync_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_threads_sender ON threads (sender);
+CREATE INDEX IF NOT EXISTS idx_threads_email ON threads (email);
+
+CREATE TABLE IF NOT EXISTS thread_labels (
+    thread_id TEXT NOT NULL REFERENCES threads (thread_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    PRIMARY KEY (thread_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_thread_labels_label ON thread_labels (label);
+
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Columns of the threads table, in the order rows are snapshotted
+THREAD_COLUMNS = "thread_id, sender, email, subject, history_id, message_count, date"
+
+# Columns added to the threads table after its first release, added to older
+# databases when they are opened
+ADDED_THREAD_COLUMNS = {
+    "history_id": "TEXT",
+    "message_count": "INTEGER NOT NULL DEFAULT 1",
+    "date": "INTEGER",
+    "sync_id": "TEXT",
+}
+
+# Maximum number of SQL variables bound in one lookup query
+MAX_QUERY_VARIABLES = 500
+
+
+class SQLiteStorage:
+    """Handles persistence of Gmail data in a SQLite database.
+
+    Threads and senders are stored as one row each, so a save only writes
+    the rows that changed since the data was last loaded or saved, and a
+    single sender can be read through an index without loading everything.
+
+    A sync can also stream its results in pieces instead of saving them all
+    at once: stream_threads() writes threads as they are fetched tagged with
+    a sync ID, mark_synced() tags stored threads that are still current,
+    and finish_stream() drops every thread the sync did not tag.
+
+    Attributes:
+        db_path: Path to the SQLite database file
+        cache_duration: How long to keep cached data (default: 24 hours)
+    """
+
+    def __init__(
+        self,
+        db_path: str = ".env/gmail_data.sqlite3",
+        cache_duration: Optional[int] = 24,
+    ):
+        """Initialize SQLiteStorage.
+
+        Args:
+            db_path: Path to the SQLite database file
+            cache_duration: How long to keep cached data in hours, None to
+                keep it until it is replaced
+        """
+        self.db_path = db_path
+        self.cache_duration = (
+            timedelta(hours=cache_duration) if cache_duration is not None else None
+        )
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        # Rows as of the last load/save, used to only write what changed
+        self._saved_threads = None
+        self._saved_senders = None
+        # Whether the schema was created and migrated by this instance
+        self._schema_ready = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection in a transaction.
+
+        The first connection of an instance makes sure the schema exists and
+        switches the database to WAL, which it keeps for later connections.
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("PRAGMA foreign_keys = ON")
+            if not self._schema_ready:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.executescript(SCHEMA)
+                self._migrate(conn)
+                self._schema_ready = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        """Add columns missing from databases created by older versions."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(threads)")}
+        for column, definition in ADDED_THREAD_COLUMNS.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE threads ADD COLUMN {column} {definition}")
+
+    def _is_cache_valid(self, last_sync: str) -> bool:
+        """Check if cached data is still valid.
+
+        Args:
+            last_sync: ISO format timestamp of last sync
+
+        Returns:
+            True if cache is valid, False otherwise
+        """
+        if not last_sync:
+            return False
+        if self.cache_duration is None:
+            return True
+
+        last_sync_time = datetime.fromisoformat(last_sync)
+        return datetime.now() - last_sync_time < self.cache_duration
+
+    def _read_snapshot(self, conn: sqlite3.Connection) -> None:
+        """Remember the rows currently stored in the database."""
+        labels = {}
+        for thread_id, label in conn.execute(
+            "SELECT thread_id, label FROM thread_labels ORDER BY thread_id, position"
+        ):
+            labels.setdefault(thread_id, []).append(label)
+
+        self._saved_threads = {
+            row[0]: (*row[1:], tuple(labels.get(row[0], ())))
+            for row in conn.execute(f"SELECT {THREAD_COLUMNS} FROM threads")
+        }
+        self._saved_senders = {
+            sender: (email, message_count)
+            for sender, email, message_count in conn.execute(
+                "SELECT sender, email, message_count FROM senders"
+            )
+        }
+
+    def _get_state(self, conn: sqlite3.Connection, key: str, default=None):
+        row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_state(self, conn: sqlite3.Connection, key: str, value) -> None:
+        conn.execute(
+            "INSERT INTO state (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value)),
+        )
+
+    @timed("storage.save")
+    def save_data(
+        self,
+        senders: OrderedDict,
+        sender_threads: Dict[str, GmailSender],
+        last_thread_id: str,
+    ) -> None:
+        """Save Gmail data, writing only rows that changed.
+
+        Args:
+            senders: OrderedDict of sender email addresses and their message counts
+            sender_threads: Dict of GmailSender objects keyed by sender email
+            last_thread_id: ID of the last processed thread
+        """
+        try:
+            with self._connect() as conn:
+                if self._saved_threads is None:
+                    self._read_snapshot(conn)
+
+                thread_rows = {}
+                for key, sender in sender_threads.items():
+                    email = sender.get_email()
+                    for t in sender.threads:
+                        thread_rows[t.thread_id] = (
+                            key,
+                            email,
+                            t.subject,
+                            t.history_id,
+                            t.message_count,
+                            t.date,
+                            tuple(t.labels),
+                        )
+                sender_rows = {
+                    key: (
+                        (
+                            sender_threads[key].get_email()
+                            if key in sender_threads
+                            else GmailSender(key).get_email()
+                        ),
+                        count,
+                    )
+                    for key, count in senders.items()
+                }
+
+                changed_threads = [
+                    (thread_id, row)
+                    for thread_id, row in thread_rows.items()
+                    if self._saved_threads.get(thread_id) != row
+                ]
+                removed_threads = [
+                    (thread_id,)
+                    for thread_id in self._saved_threads
+                    if thread_id not in thread_rows
+                ]
+                changed_senders = [
+                    (key, email, count)
+                    for key, (email, count) in sender_rows.items()
+                    if self._saved_senders.get(key) != (email, count)
+                ]
+                removed_senders = [
+                    (key,) for key in self._saved_senders if key not in sender_rows
+                ]
+
+                conn.executemany(
+                    "DELETE FROM threads WHERE thread_id = ?", removed_threads
+                )
+                conn.executemany(
+                    f"INSERT INTO threads ({THREAD_COLUMNS}) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (thread_id) DO UPDATE "
+                    "SET sender = excluded.sender, email = excluded.email, "
+                    "subject = excluded.subject, history_id = excluded.history_id, "
+                    "message_count = excluded.message_count, date = excluded.date",
+                    [(thread_id, *row[:-1]) for thread_id, row in changed_threads],
+                )
+                conn.executemany(
+                    "DELETE FROM thread_labels WHERE thread_id = ?",
+                    [(thread_id,) for thread_id, _ in changed_threads],
+                )
+                conn.executemany(
+                    "INSERT INTO thread_labels (thread_id, position, label) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (thread_id, position, label)
+                        for thread_id, (*_, labels) in changed_threads
+                        for position, label in enumerate(labels)
+                    ],
+                )
+                conn.executemany(
+                    "DELETE FROM senders WHERE sender = ?", removed_senders
+                )
+                conn.executemany(
+                    "INSERT INTO senders (sender, email, message_count) "
+                    "VALUES (?, ?, ?) ON CONFLICT (sender) DO UPDATE SET "
+                    "email = excluded.email, message_count = excluded.message_count",
+                    changed_senders,
+                )
+
+                self._set_state(conn, "last_thread_id", last_thread_id)
+                self._set_state(conn, "last_sync", datetime.now().isoformat())
+                self._set_state(
+                    conn,
+                    f"state:{RANKINGS_KEY}",
+                    update_rankings_state(
+                        self._get_state(conn, f"state:{RANKINGS_KEY}"), sender_threads
+                    ),
+                )
+
+            self._saved_threads = thread_rows
+            self._saved_senders = sender_rows
+            logger.info(
+                f"Saved {len(changed_threads)} changed and removed "
+                f"{len(removed_threads)} threads in {self.db_path}"
+            )
+        except Exception as e:
+            logger.error(f"Error saving data: {str(e)}")
+            raise
+
+    def _build_senders(
+        self, conn: sqlite3.Connection, where: str = "", params: tuple = ()
+    ) -> Dict[str, GmailSender]:
+        """Build GmailSender objects from thread rows matching a condition."""
+        labels = {}
+        for thread_id, label in conn.execute(
+            "SELECT l.thread_id, l.label FROM thread_labels l "
+            f"JOIN threads t ON t.thread_id = l.thread_id {where} "
+            "ORDER BY l.thread_id, l.position",
+            params,
+        ):
+            labels.setdefault(thread_id, []).append(label)
+
+        sender_threads = {}
+        for thread_id, sender, subject, history_id, message_count, date in conn.execute(
+            "SELECT t.thread_id, t.sender, t.subject, t.history_id, "
+            f"t.message_count, t.date FROM threads t {where} ORDER BY t.rowid",
+            params,
+        ):
+            if sender not in sender_threads:
+                sender_threads[sender] = GmailSender(sender)
+            sender_threads[sender].add_thread(
+                GmailThread(
+                    thread_id=thread_id,
+                    labels=labels.get(thread_id, []),
+                    sender=sender,
+                    subject=subject,
+                    history_id=history_id,
+                    message_count=message_count,
+                    date=date,
+                )
+            )
+        return sender_threads
+
+    @timed("storage.load")
+    def load_data(
+        self,
+    ) -> Tuple[Optional[OrderedDict], Optional[Dict[str, GmailSender]], Optional[str]]:
+        """Load Gmail data from the database.
+
+        Returns:
+            Tuple containing:
+            - OrderedDict of sender email addresses and their message counts
+            - Dict of GmailSender objects keyed by sender email
+            - ID of the last processed thread
+        """
+        try:
+            with self._connect() as conn:
+                last_sync = self._get_state(conn, "last_sync")
+                if last_sync is None:
+                    logger.info("No existing data found")
+                    return None, None, None
+
+                if not self._is_cache_valid(last_sync):
+                    logger.info("Cache expired, will fetch fresh data")
+                    return None, None, None
+
+                logger.info(f"Last sync: {last_sync}")
+
+                senders = OrderedDict(
+                    conn.execute(
+                        "SELECT sender, message_count FROM senders "
+                        "ORDER BY message_count DESC, rowid"
+                    ).fetchall()
+                )
+                sender_threads = self._build_senders(conn)
+                last_thread_id = self._get_state(conn, "last_thread_id")
+                self._read_snapshot(conn)
+
+                return senders, sender_threads, last_thread_id
+
+        except Exception as e:
+            logger.error(f"Error loading data: {str(e)}")
+            return None, None, None
+
+    def load_sender(self, sender: str) -> Optional[GmailSender]:
+        """Load a single sender and its threads through the sender index.
+
+        Args:
+            sender: Sender key as used in sender_threads
+
+        Returns:
+            The GmailSender, or None if there are no threads from it
+        """
+        with self._connect() as conn:
+            return self._build_senders(conn, "WHERE t.sender = ?", (sender,)).get(
+                sender
+            )
+
+    def load_senders_by_email(self, email: str) -> List[GmailSender]:
+        """Load every sender using an email address through the email index.
+
+        Args:
+            email: Email address as returned by GmailSender.get_email()
+
+        Returns:
+            List of GmailSender objects for that address
+        """
+        with self._connect() as conn:
+            return list(
+                self._build_senders(conn, "WHERE t.email = ?", (email,)).values()
+            )
+
+    def lookup_history_ids(self, thread_ids: List[str]) -> Dict[str, Optional[str]]:
+        """Get the stored historyId of threads.
+
+        Args:
+            thread_ids: IDs of the threads to look up
+
+        Returns:
+            Dict of historyId keyed by thread ID, for stored threads only
+        """
+        history_ids = {}
+        with self._connect() as conn:
+            for start in range(0, len(thread_ids), MAX_QUERY_VARIABLES):
+                chunk = thread_ids[start : start + MAX_QUERY_VARIABLES]
+                placeholders = ", ".join("?" * len(chunk))
+                history_ids.update(
+                    conn.execute(
+                        "SELECT thread_id, history_id FROM threads "
+                        f"WHERE thread_id IN ({placeholders})",
+                        chunk,
+                    )
+                )
+        return history_ids
+
+    def mark_synced(self, thread_ids: List[str], sync_id: str) -> None:
+        """Tag stored threads as current in a streamed sync.
+
+        Args:
+            thread_ids: IDs of stored threads that did not change
+            sync_id: ID of the streamed sync
+        """
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE threads SET sync_id = ? WHERE thread_id = ?",
+                [(sync_id, thread_id) for thread_id in thread_ids],
+            )
+
+    @timed("storage.stream")
+    def stream_threads(
+        self, sender_threads: Dict[str, GmailSender], sync_id: str
+    ) -> int:
+        """Write the threads held by senders as part of a streamed sync.
+
+        Only threads still held in memory are written, so senders whose
+        threads were evicted after an earlier call are not written again.
+
+        Args:
+            sender_threads: Dict of GmailSender objects keyed by sender email
+            sync_id: ID of the streamed sync
+
+        Returns:
+            Number of threads written
+        """
+        rows = [
+            (
+                t.thread_id,
+                key,
+                sender.get_email(),
+                t.subject,
+                t.history_id,
+                t.message_count,
+                t.date,
+                sync_id,
+                t.labels,
+            )
+            for key, sender in sender_threads.items()
+            for t in sender.threads
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT INTO threads ({THREAD_COLUMNS}, sync_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (thread_id) DO UPDATE "
+                "SET sender = excluded.sender, email = excluded.email, "
+                "subject = excluded.subject, history_id = excluded.history_id, "
+                "message_count = excluded.message_count, date = excluded.date, "
+                "sync_id = excluded.sync_id",
+                [row[:-1] for row in rows],
+            )
+            conn.executemany(
+                "DELETE FROM thread_labels WHERE thread_id = ?",
+                [(row[0],) for row in rows],
+            )
+            conn.executemany(
+                "INSERT INTO thread_labels (thread_id, position, label) "
+                "VALUES (?, ?, ?)",
+                [
+                    (row[0], position, label)
+                    for row in rows
+                    for position, label in enumerate(row[-1])
+                ],
+            )
+        # The rows no longer match the snapshot of the last load/save
+        self._saved_threads = None
+        self._saved_senders = None
+        return len(rows)
+
+    def finish_stream(self, sync_id: str, last_thread_id: str) -> int:
+        """Complete a streamed sync.
+
+        Threads neither written nor marked by the sync are deleted and the
+        sender counts are rebuilt from the remaining threads.
+
+        Args:
+            sync_id: ID of the streamed sync
+            last_thread_id: ID of the last processed thread
+
+        Returns:
+            Number of threads deleted
+        """
+        with self._connect() as conn:
+            removed = conn.execute(
+                "DELETE FROM threads WHERE sync_id IS NULL OR sync_id != ?",
+                (sync_id,),
+            ).rowcount
+            conn.execute("DELETE FROM senders")
+            conn.execute(
+                "INSERT INTO senders (sender, email, message_count) "
+                "SELECT sender, MIN(email), COUNT(*) FROM threads GROUP BY sender"
+            )
+            self._set_state(conn, "last_thread_id", last_thread_id)
+            self._set_state(conn, "last_sync", datetime.now().isoformat())
+        self._saved_threads = None
+        self._saved_senders = None
+        # The streamed senders were evicted along the way, so rank the
+        # counts of the rebuilt table
+        _, sender_threads = self.load_sender_counts()
+        self.set_state(
+            RANKINGS_KEY,
+            update_rankings_state(self.get_state(RANKINGS_KEY), sender_threads),
+        )
+        logger.info(f"Finished streamed sync, removed {removed} threads")
+        return removed
+
+    @timed("storage.load")
+    def load_sender_counts(self) -> Tuple[OrderedDict, Dict[str, GmailSender]]:
+        """Load sender counts without loading any threads.
+
+        Returns:
+            Tuple containing:
+            - OrderedDict of sender email addresses and their thread counts
+            - Dict of GmailSender objects keyed by sender email, holding
+              counts and dates only (see GmailSender.from_counts)
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT t.sender, SUM(t.message_count), COUNT(*), "
+                "SUM(t.thread_id IN (SELECT thread_id FROM thread_labels "
+                "WHERE label = 'UNREAD')), "
+                "MIN(t.date), MAX(t.date) "
+                "FROM threads t GROUP BY t.sender "
+                "ORDER BY COUNT(*) DESC, MIN(t.rowid)"
+            ).fetchall()
+        sender_threads = {row[0]: GmailSender.from_counts(*row) for row in rows}
+        senders = OrderedDict((row[0], row[2]) for row in rows)
+        return senders, sender_threads
+
+    def get_state(self, key: str, default=None):
+        """Read a piece of sync state stored next to the cached data.
+
+        Args:
+            key: Name of the state entry
+            default: Value to return if the entry does not exist
+
+        Returns:
+            The stored value or default
+        """
+        try:
+            with self._connect() as conn:
+                return self._get_state(conn, f"state:{key}", default)
+        except Exception as e:
+            logger.error(f"Error loading state {key}: {str(e)}")
+            return default
+
+    def set_state(self, key: str, value) -> None:
+        """Store a piece of sync state next to the cached data.
+
+        Args:
+            key: Name of the state entry
+            value: JSON-serializable value to store
+        """
+        try:
+            with self._connect() as conn:
+                self._set_state(conn, f"state:{key}", value)
+        except Exception as e:
+            logger.error(f"Error saving state {key}: {str(e)}")
+            raise
+
+    def clear_cache(self) -> None:
+        """Clear all cached data."""
+        try:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.db_path + suffix):
+                    os.remove(self.db_path + suffix)
+            self._saved_threads = None
+            self._saved_senders = None
+            self._schema_ready = False
+            logger.info("Cache cleared successfully")
+        except Exception as e:
+            logger.error(f"Error clearing cache: {str(e)}")
+            raise
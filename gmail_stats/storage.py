@@ -7,11 +7,17 @@ from typing import Dict, Optional, Tuple
 from collections import OrderedDict
 from datetime import datetime, timedelta
 
+from .profiling import timed
+from .rankings import RANKINGS_KEY, update_rankings_state
 from .sender import GmailSender
 from .thread import GmailThread
 
 logger = logging.getLogger(__name__)
 
+# Available storage backends
+STORAGE_BACKENDS = ("shelve", "sqlite", "chunked")
+DEFAULT_STORAGE_BACKEND = "shelve"
+
 
 class GmailStorage:
     """Handles persistence of Gmail data using shelve with compression.
@@ -22,15 +28,20 @@ class GmailStorage:
         cache_duration: How long to keep cached data (default: 24 hours)
     """
 
-    def __init__(self, db_path: str = ".env/gmail_data", cache_duration: int = 24):
+    def __init__(
+        self, db_path: str = ".env/gmail_data", cache_duration: Optional[int] = 24
+    ):
         """Initialize GmailStorage.
 
         Args:
             db_path: Path to the shelve database file
-            cache_duration: How long to keep cached data in hours
+            cache_duration: How long to keep cached data in hours, None to
+                keep it until it is replaced
         """
         self.db_path = db_path
-        self.cache_duration = timedelta(hours=cache_duration)
+        self.cache_duration = (
+            timedelta(hours=cache_duration) if cache_duration is not None else None
+        )
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
 
     def _compress_data(self, data: dict) -> bytes:
@@ -66,10 +77,13 @@ class GmailStorage:
         """
         if not last_sync:
             return False
+        if self.cache_duration is None:
+            return True
 
         last_sync_time = datetime.fromisoformat(last_sync)
         return datetime.now() - last_sync_time < self.cache_duration
 
+    @timed("storage.save")
     def save_data(
         self,
         senders: OrderedDict,
@@ -95,6 +109,9 @@ class GmailStorage:
                                 "labels": t.labels,
                                 "sender": t.sender,
                                 "subject": t.subject,
+                                "history_id": t.history_id,
+                                "message_count": t.message_count,
+                                "date": t.date,
                             }
                             for t in sender.threads
                         ],
@@ -112,12 +129,16 @@ class GmailStorage:
 
                 compressed_data = self._compress_data(data)
                 db["data"] = compressed_data
+                db[f"state:{RANKINGS_KEY}"] = update_rankings_state(
+                    db.get(f"state:{RANKINGS_KEY}"), sender_threads
+                )
 
             logger.info(f"Successfully saved compressed data to {self.db_path}")
         except Exception as e:
             logger.error(f"Error saving data: {str(e)}")
             raise
 
+    @timed("storage.load")
     def load_data(
         self,
     ) -> Tuple[Optional[OrderedDict], Optional[Dict[str, GmailSender]], Optional[str]]:
@@ -162,6 +183,9 @@ class GmailStorage:
                             labels=thread_data["labels"],
                             sender=thread_data["sender"],
                             subject=thread_data["subject"],
+                            history_id=thread_data.get("history_id"),
+                            message_count=thread_data.get("message_count", 1),
+                            date=thread_data.get("date"),
                         )
                         sender.add_thread(thread)
                     sender_threads[email] = sender
@@ -172,6 +196,37 @@ class GmailStorage:
             logger.error(f"Error loading data: {str(e)}")
             return None, None, None
 
+    def get_state(self, key: str, default=None):
+        """Read a piece of sync state stored next to the cached data.
+
+        Args:
+            key: Name of the state entry
+            default: Value to return if the entry does not exist
+
+        Returns:
+            The stored value or default
+        """
+        try:
+            with shelve.open(self.db_path) as db:
+                return db.get(f"state:{key}", default)
+        except Exception as e:
+            logger.error(f"Error loading state {key}: {str(e)}")
+            return default
+
+    def set_state(self, key: str, value) -> None:
+        """Store a piece of sync state next to the cached data.
+
+        Args:
+            key: Name of the state entry
+            value: Picklable value to store
+        """
+        try:
+            with shelve.open(self.db_path) as db:
+                db[f"state:{key}"] = value
+        except Exception as e:
+            logger.error(f"Error saving state {key}: {str(e)}")
+            raise
+
     def clear_cache(self) -> None:
         """Clear all cached data."""
         try:
@@ -181,3 +236,38 @@ class GmailStorage:
         except Exception as e:
             logger.error(f"Error clearing cache: {str(e)}")
             raise
+
+
+def open_storage(
+    backend: str = None, db_path: str = None, cache_duration: Optional[int] = 24
+):
+    """Create a storage object for the given backend.
+
+    Args:
+        backend: 'shelve' for a single compressed blob, 'sqlite' for
+            per-thread rows with indexed lookups or 'chunked' for
+            per-sender compressed blocks read through an index
+        db_path: Path to the database file, the backend's default if None
+        cache_duration: How long to keep cached data in hours, None to keep
+            it until it is replaced
+
+    Returns:
+        GmailStorage, SQLiteStorage or ChunkedStorage instance
+    """
+    backend = backend or DEFAULT_STORAGE_BACKEND
+    if backend == "shelve":
+        storage_class = GmailStorage
+    elif backend == "sqlite":
+        from .sqlite_storage import SQLiteStorage
+
+        storage_class = SQLiteStorage
+    elif backend == "chunked":
+        from .chunked_storage import ChunkedStorage
+
+        storage_class = ChunkedStorage
+    else:
+        raise ValueError(f"Invalid storage backend: {backend}")
+
+    if db_path is None:
+        return storage_class(cache_duration=cache_duration)
+    return storage_class(db_path, cache_duration=cache_duration)
@@ -0,0 +1,1949 @@
+from __future__ import print_function
+import pickle
+import os.path
+import logging
+import time
+import socket
+from collections import OrderedDict
+from operator import itemgetter
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sized, Tuple, Optional
+from concurrent.futures import as_completed
+from rich.progress import (
+    Progress,
+    SpinnerColumn,
+    TextColumn,
+    BarColumn,
+    TimeElapsedColumn,
+)
+import ssl
+from urllib3.exceptions import SSLError
+from googleapiclient.errors import HttpError
+import threading
+import queue
+from datetime import datetime, timedelta
+import random
+import signal
+import uuid
+import sys
+import atexit
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from googleapiclient import errors
+from google.auth.exceptions import RefreshError
+
+from .sender import GmailSender
+from .thread import GmailThread
+from .storage import GmailStorage, open_storage
+from .scheduler import FetchScheduler
+from .ratelimit import QuotaTokenBucket, QuotaExceededError
+from .transport import ServicePool, build_service, resolve_service
+from .grouping import EMAIL_INDEX_KEY, EmailIndex, set_email_index
+from .metrics import current_rss, sync_metrics
+from .profiling import profiler, timed
+
+# 2 effective ways to give your program access:
+# 1. Easiest but generates an app called Quickstart: https://developers.google.com/gmail/api/quickstart/python
+# 1. Create a project by going to:
+#    https://console.developers.google.com/projectcreate
+# 2. Enable the Gmail APIs in your new project:
+#    NOTE: make sure your new project name is selected in the top left
+#    https://console.developers.google.com/apis
+#    Search for Gmail, select it, then click Enable
+# 3. Oauth consent screen: https://console.developers.google.com/apis/credentials/consent
+# 3. Create credentials:
+#    You'll see a button saying Create Credentials. Click that,
+#    Which API are you using? Gmail API
+#    Where will you be calling the API from? Other UI (e.g. Windows, CLI Tool)
+#    What data will you be accessing? User data
+
+
+logger = logging.getLogger(__name__)
+
+# If modifying these scopes, delete the file token.pickle.
+SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
+
+# Paths for credentials and token files
+CREDENTIALS_PATH = os.path.join(".env", "credentials.json")
+TOKEN_PATH = os.path.join(".env", "token.pickle")
+
+# Global quota-aware rate limiter. Gmail allows 250 quota units per second
+# per user and charges each method (and each batch sub-request) separately.
+rate_limiter = QuotaTokenBucket()
+
+# Maximum number of threads returned per threads.list page
+MAX_LIST_PAGE_SIZE = 500
+
+# Maximum number of threads.get calls packed into one batch HTTP request.
+# The client library allows up to 1000, but Gmail recommends keeping batches
+# small to avoid per-user rate limiting.
+MAX_BATCH_REQUESTS = 100
+
+# HTTP status codes that are worth retrying
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# Retries of single (non-batch) requests on rate limit and transient server
+# errors, with the client library's exponential backoff
+MAX_REQUEST_RETRIES = 5
+
+# Thread fetch formats. "metadata" only downloads the headers we read, "full"
+# downloads every message body and attachment part.
+FETCH_FORMATS = ("metadata", "full")
+DEFAULT_FETCH_FORMAT = "metadata"
+METADATA_HEADERS = ["From", "Subject"]
+METADATA_FIELDS = "historyId,messages(id,labelIds,internalDate,payload/headers)"
+
+# History record types that can change which threads are unread in the inbox
+HISTORY_TYPES = ["messageAdded", "messageDeleted", "labelAdded", "labelRemoved"]
+HISTORY_RECORD_KEYS = (
+    "messagesAdded",
+    "messagesDeleted",
+    "labelsAdded",
+    "labelsRemoved",
+)
+# Storage state key holding the mailbox historyId of the last sync
+HISTORY_ID_KEY = "history_id"
+# Storage state key holding the listing filter the cached data was built with
+SYNC_FILTER_KEY = "sync_filter"
+# Storage state key holding the progress of an unfinished listing sync
+CHECKPOINT_KEY = "checkpoint"
+# Seconds between checkpoints of partial results during a listing sync
+CHECKPOINT_INTERVAL = 60.0
+# Threads held in memory before a bounded-memory sync checks whether it has
+# to flush them to storage
+MIN_FLUSH_THREADS = 1000
+
+# Global flag for graceful shutdown
+shutdown_event = threading.Event()
+# Whether syncs draw a progress bar, off when several run side by side
+show_progress = True
+# Global fetch scheduler, created on first use and kept for the whole run
+fetch_scheduler = None
+fetch_scheduler_lock = threading.Lock()
+
+
+def get_fetch_scheduler() -> FetchScheduler:
+    """Get the long-lived fetch scheduler, creating it if needed."""
+    global fetch_scheduler
+    with fetch_scheduler_lock:
+        if fetch_scheduler is None:
+            fetch_scheduler = FetchScheduler()
+        return fetch_scheduler
+
+
+def cleanup_resources():
+    """Cleanup function to be called on exit."""
+    global fetch_scheduler
+    if fetch_scheduler is not None:
+        logger.debug("Cleaning up fetch scheduler...")
+        fetch_scheduler.shutdown(wait=False)
+        fetch_scheduler = None
+
+
+def signal_handler(signum, frame):
+    """Handle interrupt signals for graceful shutdown."""
+    if shutdown_event.is_set():
+        logger.info("\nForce quitting...")
+        sys.exit(1)
+
+    logger.info("\nReceived interrupt signal. Shutting down gracefully...")
+    shutdown_event.set()
+
+    # Give threads a chance to clean up
+    time.sleep(1)
+
+    if fetch_scheduler is not None:
+        logger.info("Shutting down fetch scheduler...")
+        fetch_scheduler.shutdown(wait=False)
+
+    logger.info("Shutdown complete.")
+    sys.exit(0)
+
+
+signal_handlers_installed = False
+
+
+def install_signal_handlers() -> None:
+    """Shut down gracefully on SIGINT/SIGTERM and clean up on exit.
+
+    Called by the command line before syncing rather than on import, so
+    importing the package doesn't change the host program's signal handling.
+    """
+    global signal_handlers_installed
+    if signal_handlers_installed:
+        return
+    atexit.register(cleanup_resources)
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal_handlers_installed = True
+
+
+def parse_thread(thread_id: str, thread_data: Optional[dict]) -> Optional[dict]:
+    """Turn a threads.get response into a sender/thread result.
+
+    Args:
+        thread_id: ID of the thread the response belongs to
+        thread_data: Deserialized threads.get response
+
+    Returns:
+        Dictionary with thread data or None if the thread should be skipped
+    """
+    if not thread_data or not thread_data.get("messages"):
+        return None
+
+    first_message = thread_data["messages"][0]
+    if not first_message or not isinstance(first_message, dict):
+        return None
+
+    label_ids = first_message.get("labelIds", [])
+    if not isinstance(label_ids, list):
+        return None
+
+    if "UNREAD" not in label_ids:
+        return None
+
+    sender = get_sender(first_message)
+    subject = get_subject(first_message)
+
+    if not sender:
+        logger.debug(f"No sender found for thread {thread_id}")
+        return None
+
+    return {
+        "sender": sender,
+        "thread": GmailThread(
+            thread_id,
+            label_ids,
+            sender,
+            subject,
+            history_id=thread_data.get("historyId"),
+            message_count=len(thread_data["messages"]),
+            date=get_thread_date(thread_data),
+        ),
+    }
+
+
+def get_thread_date(thread_data: dict) -> Optional[int]:
+    """Get the internalDate of a thread's latest message.
+
+    Args:
+        thread_data: Deserialized threads.get response
+
+    Returns:
+        Milliseconds since the epoch, or None if no message has a date
+    """
+    dates = [
+        int(message["internalDate"])
+        for message in thread_data.get("messages", [])
+        if isinstance(message, dict) and message.get("internalDate")
+    ]
+    return max(dates, default=None)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Check whether an HTTP error is a rate limit or transient server error."""
+    return (
+        isinstance(error, (HttpError, errors.HttpError))
+        and hasattr(error, "resp")
+        and error.resp.status in RETRYABLE_STATUS_CODES
+    )
+
+
+def acquire_quota(method: str, count: int = 1) -> None:
+    """Wait for quota for count calls of method, recording it in sync_metrics.
+
+    Args:
+        method: Gmail API method name, e.g. 'users.threads.get'
+        count: Number of calls, e.g. sub-requests in a batch
+
+    Raises:
+        QuotaExceededError: If the daily limit would be exceeded
+    """
+    waited = rate_limiter.acquire(method, count=count)
+    sync_metrics.record_quota(method, rate_limiter.cost(method, count), waited)
+
+
+def execute_request(request, method: str, **kwargs):
+    """Execute a request, recording its latency and errors in sync_metrics.
+
+    Args:
+        request: HttpRequest or BatchHttpRequest to execute
+        method: Gmail API method name, or 'batch' for a batch request
+        **kwargs: Passed on to request.execute()
+
+    Returns:
+        The response of the request
+    """
+    start = time.monotonic()
+    try:
+        return request.execute(**kwargs)
+    except Exception as e:
+        sync_metrics.record_error(e)
+        raise
+    finally:
+        sync_metrics.record_request(method, time.monotonic() - start)
+
+
+def backoff(error: Exception, seconds: float) -> None:
+    """Sleep before retrying after an error, recording it in sync_metrics.
+
+    Args:
+        error: Exception that caused the retry
+        seconds: Seconds to sleep
+    """
+    sync_metrics.record_retry(error, seconds)
+    time.sleep(seconds)
+
+
+def save_sender_data(
+    storage: GmailStorage,
+    senders: OrderedDict,
+    sender_threads: Dict[str, GmailSender],
+    last_thread_id: str,
+) -> None:
+    """Save sender data, timing it as the 'save' phase of sync_metrics.
+
+    Args:
+        storage: Storage to save to
+        senders: OrderedDict of sender email addresses and their message counts
+        sender_threads: Dict of GmailSender objects keyed by sender email
+        last_thread_id: ID of the last processed thread
+    """
+    with sync_metrics.phase("save") as phase:
+        storage.save_data(senders, sender_threads, last_thread_id)
+        phase.items = sum(senders.values())
+
+
+def build_thread_request(
+    service, thread_id: str, user_id: str = "me", fetch_format: str = None
+):
+    """Build a threads.get request for the given fetch format.
+
+    Args:
+        service: Authorized Gmail API service instance
+        thread_id: ID of the thread to fetch
+        user_id: User's email address or 'me'
+        fetch_format: 'metadata' to fetch only the From/Subject headers and
+            labels of each message, or 'full' to fetch complete messages
+
+    Returns:
+        Unexecuted threads.get HttpRequest
+    """
+    fetch_format = fetch_format or DEFAULT_FETCH_FORMAT
+    if fetch_format not in FETCH_FORMATS:
+        raise ValueError(f"Invalid fetch format: {fetch_format}")
+
+    if fetch_format == "metadata":
+        return (
+            service.users()
+            .threads()
+            .get(
+                userId=user_id,
+                id=thread_id,
+                format="metadata",
+                metadataHeaders=METADATA_HEADERS,
+                fields=METADATA_FIELDS,
+            )
+        )
+    return service.users().threads().get(userId=user_id, id=thread_id)
+
+
+def process_single_thread(
+    service,
+    thread,
+    user_id: str = "me",
+    max_retries: int = 3,
+    fetch_format: str = None,
+) -> Optional[dict]:
+    """Process a single thread with retry logic and rate limiting.
+
+    Args:
+        service: Authorized Gmail API service instance or ServicePool
+        thread: Thread object to process
+        user_id: User's email address or 'me'
+        max_retries: Maximum number of retry attempts
+        fetch_format: Thread fetch format ('metadata' or 'full')
+
+    Returns:
+        Dictionary with thread data or None if processing failed
+    """
+    service = resolve_service(service)
+    thread_id = thread["id"]
+    retry_count = 0
+    last_error = None
+
+    while retry_count < max_retries and not shutdown_event.is_set():
+        try:
+            # Wait for quota before making API call
+            acquire_quota("users.threads.get")
+
+            # Execute the request
+            thread_data = execute_request(
+                build_thread_request(service, thread_id, user_id, fetch_format),
+                "users.threads.get",
+            )
+
+            return parse_thread(thread_id, thread_data)
+
+        except (SSLError, ssl.SSLError) as e:
+            last_error = e
+            logger.debug(
+                f"SSL error processing thread {thread_id} (attempt {retry_count + 1}/{max_retries}): {str(e)}"
+            )
+            # Longer delay for SSL errors
+            backoff(e, 5 * (2**retry_count))
+
+        except (HttpError, errors.HttpError) as e:
+            if hasattr(e, "resp") and e.resp.status == 429:  # Rate limit exceeded
+                last_error = e
+                logger.debug(
+                    f"Rate limit exceeded for thread {thread_id} (attempt {retry_count + 1}/{max_retries})"
+                )
+                # Exponential backoff with jitter
+                sleep_time = (2**retry_count) + (random.random() * 0.1)
+                backoff(e, sleep_time)
+            elif hasattr(e, "resp") and e.resp.status in [
+                500,
+                502,
+                503,
+                504,
+            ]:  # Server errors
+                last_error = e
+                logger.debug(
+                    f"Server error processing thread {thread_id} (attempt {retry_count + 1}/{max_retries}): {str(e)}"
+                )
+                backoff(e, 2**retry_count)  # Exponential backoff
+            else:
+                logger.error(f"HTTP error processing thread {thread_id}: {str(e)}")
+                return None
+
+        except (TimeoutError, socket.timeout) as e:
+            last_error = e
+            logger.debug(
+                f"Timeout processing thread {thread_id} (attempt {retry_count + 1}/{max_retries})"
+            )
+            backoff(e, 2**retry_count)  # Exponential backoff
+
+        except (AttributeError, TypeError) as e:
+            last_error = e
+            logger.debug(
+                f"Data error processing thread {thread_id} (attempt {retry_count + 1}/{max_retries}): {str(e)}"
+            )
+            backoff(e, 1)  # Short delay for data errors
+
+        except QuotaExceededError:
+            raise
+
+        except Exception as e:
+            last_error = e
+            logger.error(f"Unexpected error processing thread {thread_id}: {str(e)}")
+            return None
+
+        retry_count += 1
+
+    if last_error and not shutdown_event.is_set():
+        # Only log the final error at WARNING level if all retries failed
+        if isinstance(last_error, (SSLError, ssl.SSLError)):
+            logger.warning(
+                f"Failed to process thread {thread_id} after {max_retries} attempts due to SSL errors"
+            )
+        elif (
+            isinstance(last_error, (HttpError, errors.HttpError))
+            and hasattr(last_error, "resp")
+            and last_error.resp.status in [429, 500, 502, 503, 504]
+        ):
+            logger.warning(
+                f"Failed to process thread {thread_id} after {max_retries} attempts due to server errors"
+            )
+        elif isinstance(last_error, (TimeoutError, socket.timeout)):
+            logger.warning(
+                f"Failed to process thread {thread_id} after {max_retries} attempts due to timeouts"
+            )
+        else:
+            logger.error(
+                f"Failed to process thread {thread_id} after {max_retries} attempts: {str(last_error)}"
+            )
+    return None
+
+
+def fetch_thread_batch(
+    service,
+    threads: List[dict],
+    user_id: str = "me",
+    max_retries: int = 3,
+    fetch_format: str = None,
+    on_throttle: Callable[[], None] = None,
+    on_latency: Callable[[float], None] = None,
+    on_failed: Callable[[List[str]], None] = None,
+) -> List[dict]:
+    """Fetch up to MAX_BATCH_REQUESTS threads in a single batch HTTP request.
+
+    Each thread is a separate sub-request of the batch. Sub-requests that fail
+    with a rate limit or server error are retried in a new, smaller batch with
+    the same exponential backoff used by process_single_thread; everything else
+    is dropped.
+
+    Args:
+        service: Authorized Gmail API service instance or ServicePool
+        threads: List of thread objects to fetch
+        user_id: User's email address or 'me'
+        max_retries: Maximum number of attempts per thread
+        fetch_format: Thread fetch format ('metadata' or 'full')
+        on_throttle: Called whenever Gmail answers with a rate limit or
+            server error, so a concurrency controller can back off
+        on_latency: Called with the seconds a batch request took when all
+            of its sub-requests succeeded, not counting quota waits and
+            backoff
+        on_failed: Called with the IDs of threads that could not be fetched,
+            other than threads that no longer exist
+
+    Returns:
+        List of result dictionaries as returned by parse_thread
+    """
+    service = resolve_service(service)
+    pending = {thread["id"]: thread for thread in threads[:MAX_BATCH_REQUESTS]}
+    results = []
+    dropped = []
+
+    def report_dropped() -> None:
+        if on_failed and dropped:
+            on_failed(dropped)
+
+    retry_count = 0
+    last_error = None
+
+    while pending and retry_count < max_retries and not shutdown_event.is_set():
+        failed = {}
+
+        def handle_response(request_id, response, exception):
+            if exception is not None:
+                sync_metrics.record_error(exception)
+                if is_retryable_error(exception):
+                    failed[request_id] = exception
+                elif getattr(getattr(exception, "resp", None), "status", None) == 404:
+                    logger.debug(f"Thread {request_id} no longer exists")
+                else:
+                    logger.error(
+                        f"HTTP error processing thread {request_id}: {str(exception)}"
+                    )
+                    dropped.append(request_id)
+                return
+
+            try:
+                result = parse_thread(request_id, response)
+            except (AttributeError, TypeError, KeyError) as e:
+                logger.debug(f"Data error processing thread {request_id}: {str(e)}")
+                return
+            if result:
+                results.append(result)
+
+        try:
+            # Every sub-request counts against the quota
+            acquire_quota("users.threads.get", count=len(pending))
+
+            batch = service.new_batch_http_request(callback=handle_response)
+            for thread_id in pending:
+                batch.add(
+                    build_thread_request(service, thread_id, user_id, fetch_format),
+                    request_id=thread_id,
+                )
+            sync_metrics.record_request("users.threads.get", count=len(pending))
+            start = time.monotonic()
+            execute_request(batch, "batch")
+
+            if not failed:
+                if on_latency:
+                    on_latency(time.monotonic() - start)
+                report_dropped()
+                return results
+
+            last_error = next(iter(failed.values()))
+            if on_throttle:
+                on_throttle()
+            logger.debug(
+                f"{len(failed)} of {len(pending)} batched requests failed "
+                f"(attempt {retry_count + 1}/{max_retries}), retrying them"
+            )
+            pending = {thread_id: pending[thread_id] for thread_id in failed}
+            throttled = [e for e in failed.values() if e.resp.status == 429]
+            if throttled:
+                # Exponential backoff with jitter
+                backoff(throttled[0], (2**retry_count) + (random.random() * 0.1))
+            else:
+                backoff(last_error, 2**retry_count)
+
+        except (SSLError, ssl.SSLError) as e:
+            last_error = e
+            logger.debug(
+                f"SSL error executing batch (attempt {retry_count + 1}/{max_retries}): {str(e)}"
+            )
+            backoff(e, 5 * (2**retry_count))
+
+        except (HttpError, errors.HttpError) as e:
+            if not is_retryable_error(e):
+                logger.error(f"HTTP error executing batch: {str(e)}")
+                dropped.extend(pending)
+                report_dropped()
+                return results
+            last_error = e
+            if on_throttle:
+                on_throttle()
+            logger.debug(
+                f"Batch request failed (attempt {retry_count + 1}/{max_retries}): {str(e)}"
+            )
+            backoff(e, (2**retry_count) + (random.random() * 0.1))
+
+        except (TimeoutError, socket.timeout) as e:
+            last_error = e
+            logger.debug(
+                f"Timeout executing batch (attempt {retry_count + 1}/{max_retries})"
+            )
+            backoff(e, 2**retry_count)
+
+        except QuotaExceededError:
+            raise
+
+        except Exception as e:
+            logger.error(f"Unexpected error executing batch: {str(e)}")
+            dropped.extend(pending)
+            report_dropped()
+            return results
+
+        retry_count += 1
+
+    if pending and last_error and not shutdown_event.is_set():
+        logger.warning(
+            f"Failed to process {len(pending)} threads after {max_retries} attempts: {str(last_error)}"
+        )
+    # Including threads left unfetched by a shutdown
+    dropped.extend(pending)
+    report_dropped()
+    return results
+
+
+def iter_chunks(items: Iterable, size: int) -> Iterator[list]:
+    """Split an iterable into lists of at most size items, lazily.
+
+    Args:
+        items: Iterable to split
+        size: Maximum number of items per chunk
+
+    Yields:
+        Lists of consecutive items
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def process_thread_batch(
+    service,
+    threads: Iterable[dict],
+    user_id: str = "me",
+    fetch_format: str = None,
+    scheduler: FetchScheduler = None,
+    on_progress: Callable[[int], None] = None,
+    checkpoint: Callable[[Dict[str, int], Dict[str, GmailSender], bool], None] = None,
+    checkpoint_interval: float = CHECKPOINT_INTERVAL,
+    flush: Callable[[Dict[str, GmailSender]], None] = None,
+    max_memory: int = None,
+    on_failed: Callable[[List[str]], None] = None,
+) -> Tuple[Dict[str, int], Dict[str, GmailSender]]:
+    """Process threads in parallel batch requests with adaptive concurrency.
+
+    Threads are split into batch HTTP requests of MAX_BATCH_REQUESTS, which
+    are run on the fetch scheduler. The scheduler decides how many batches
+    are in flight at once based on latency and throttling feedback. threads
+    is consumed lazily, so it can be a stream that is still being listed;
+    finished batches are aggregated as soon as they complete.
+
+    Every checkpoint_interval seconds, submitting pauses until the batches
+    in flight have finished and checkpoint is called with the results so
+    far and complete=True, meaning every thread taken from threads has been
+    processed. If processing stops early because of a shutdown or an
+    exception, checkpoint is called once more with whatever finished and
+    complete=False.
+
+    With flush, whenever at least MIN_FLUSH_THREADS threads are held and
+    the resident set size exceeds max_memory, flush is called to write the
+    held threads out and they are evicted from the returned senders, which
+    keep their counts.
+
+    Args:
+        service: Authorized Gmail API service instance, or a ServicePool to
+            give every worker its own service
+        threads: Thread objects to process, either a list or a stream
+        user_id: User's email address or 'me'
+        fetch_format: Thread fetch format ('metadata' or 'full')
+        scheduler: Scheduler to run batches on, the global one if None
+        on_progress: Called with the number of threads in each finished batch
+        checkpoint: Called with (senders, sender_threads, complete) to
+            persist partial results
+        checkpoint_interval: Seconds between two checkpoints
+        flush: Called with sender_threads to write out the threads held
+        max_memory: Resident set size in bytes above which to flush
+        on_failed: Called with the IDs of threads that could not be fetched
+
+    Returns:
+        Tuple containing:
+        - Dict of sender email addresses and their message counts
+        - Dict of GmailSender objects keyed by sender email
+    """
+    scheduler = scheduler or get_fetch_scheduler()
+    senders = {}
+    sender_threads = {}
+    pending = {}
+    held = 0
+
+    def collect(future) -> None:
+        nonlocal held
+        batch = pending.pop(future)
+        count = len(batch)
+        try:
+            results = future.result()
+        except QuotaExceededError:
+            for f in pending:
+                f.cancel()
+            raise
+        except Exception as e:
+            logger.debug(f"Error processing batch result: {str(e)}")
+            results = []
+            if on_failed:
+                on_failed([thread["id"] for thread in batch])
+
+        for result in results:
+            sender = result["sender"]
+            thread = result["thread"]
+
+            senders[sender] = senders.get(sender, 0) + 1
+
+            if sender in sender_threads:
+                sender_threads[sender].add_thread(thread)
+            else:
+                gmail_sender = GmailSender(sender)
+                gmail_sender.add_thread(thread)
+                sender_threads[sender] = gmail_sender
+        held += len(results)
+
+        if on_progress:
+            on_progress(count)
+
+    def save_partial() -> None:
+        # Keep batches that already finished, drop the ones still running
+        for f in list(pending):
+            if f.done() and not f.cancelled():
+                try:
+                    collect(f)
+                except Exception:
+                    pass
+            else:
+                f.cancel()
+        try:
+            checkpoint(senders, sender_threads, False)
+        except Exception as e:
+            logger.error(f"Error saving checkpoint: {str(e)}")
+
+    last_checkpoint = time.monotonic()
+    try:
+        for sub_batch in iter_chunks(threads, MAX_BATCH_REQUESTS):
+            if shutdown_event.is_set():
+                logger.info("Shutdown requested, stopping batch processing...")
+                break
+
+            future = scheduler.submit(
+                fetch_thread_batch,
+                service,
+                sub_batch,
+                user_id,
+                fetch_format=fetch_format,
+                on_throttle=scheduler.controller.on_throttle,
+                on_latency=scheduler.controller.on_success,
+                on_failed=on_failed,
+                items=len(sub_batch),
+            )
+            pending[future] = sub_batch
+
+            # Aggregate whatever has finished while we were listing/submitting
+            for done in [f for f in pending if f.done()]:
+                collect(done)
+
+            if flush and held >= MIN_FLUSH_THREADS:
+                rss = current_rss()
+                # Flush unconditionally where the RSS can't be read
+                if rss is None or rss > max_memory:
+                    flush(sender_threads)
+                    for gmail_sender in sender_threads.values():
+                        gmail_sender.evict_threads()
+                    held = 0
+
+            if checkpoint and time.monotonic() - last_checkpoint >= (
+                checkpoint_interval
+            ):
+                for done in as_completed(list(pending)):
+                    collect(done)
+                checkpoint(senders, sender_threads, True)
+                last_checkpoint = time.monotonic()
+
+        for future in as_completed(list(pending)):
+            if shutdown_event.is_set():
+                logger.info("Shutdown requested, cancelling remaining tasks...")
+                for f in pending:
+                    f.cancel()
+                break
+            collect(future)
+    except BaseException:
+        if checkpoint:
+            save_partial()
+        raise
+
+    if checkpoint and shutdown_event.is_set():
+        save_partial()
+
+    return senders, sender_threads
+
+
+@timed("fetch")
+def show_unread_inbox_threads(
+    service,
+    threads: Iterable[dict],
+    user_id: str = "me",
+    fetch_format: str = None,
+    checkpoint: Callable[[Dict[str, int], Dict[str, GmailSender], bool], None] = None,
+    checkpoint_interval: float = CHECKPOINT_INTERVAL,
+    flush: Callable[[Dict[str, GmailSender]], None] = None,
+    max_memory: int = None,
+    on_failed: Callable[[List[str]], None] = None,
+) -> Tuple[Dict[str, int], Dict[str, GmailSender]]:
+    """Process unread inbox threads and count messages by sender.
+
+    Args:
+        service: Authorized Gmail API service instance, or a ServicePool to
+            give every worker its own service
+        threads: Thread objects to process, either a list or a stream such
+            as a ThreadListing
+        user_id: User's email address or 'me'
+        fetch_format: Thread fetch format ('metadata' or 'full')
+        checkpoint: Called periodically to persist partial results, see
+            process_thread_batch
+        checkpoint_interval: Seconds between two checkpoints
+        flush: Called to write out held threads before they are evicted,
+            see process_thread_batch
+        max_memory: Resident set size in bytes above which to flush
+        on_failed: Called with the IDs of threads that could not be fetched
+
+    Returns:
+        Tuple containing:
+        - Dict of sender email addresses and their message counts
+        - Dict of GmailSender objects keyed by sender email
+    """
+    scheduler = get_fetch_scheduler()
+    start_time = time.monotonic()
+    total = len(threads) if isinstance(threads, Sized) else None
+    processed = 0
+
+    with Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+        TextColumn("[cyan]{task.completed}/{task.total} threads"),
+        TextColumn("[magenta]{task.fields[rate]:.1f} threads/s"),
+        TextColumn("[blue]x{task.fields[concurrency]}"),
+        TimeElapsedColumn(),
+        disable=not show_progress,
+    ) as progress:
+        task = progress.add_task(
+            "[cyan]Processing threads...",
+            total=total,
+            completed=0,
+            rate=0.0,
+            concurrency=scheduler.concurrency,
+        )
+
+        def update_progress(count: int) -> None:
+            nonlocal processed
+            processed += count
+            progress.update(
+                task,
+                total=total if total is not None else getattr(threads, "listed", None),
+                advance=count,
+                rate=scheduler.throughput,
+                concurrency=scheduler.concurrency,
+            )
+
+        try:
+            senders, sender_threads = process_thread_batch(
+                service,
+                threads,
+                user_id,
+                fetch_format,
+                scheduler=scheduler,
+                on_progress=update_progress,
+                checkpoint=checkpoint,
+                checkpoint_interval=checkpoint_interval,
+                flush=flush,
+                max_memory=max_memory,
+                on_failed=on_failed,
+            )
+        except KeyboardInterrupt:
+            logger.info("Keyboard interrupt received, initiating shutdown...")
+            shutdown_event.set()
+            raise
+
+    elapsed = time.monotonic() - start_time
+    sync_metrics.record_phase("fetch", elapsed, processed)
+    if processed and elapsed > 0:
+        logger.info(
+            f"Processed {processed} threads in {elapsed:.1f}s "
+            f"({processed / elapsed:.1f} threads/s, "
+            f"final concurrency {scheduler.concurrency})"
+        )
+    return senders, sender_threads
+
+
+class HistoryExpiredError(Exception):
+    """Raised when a stored historyId is too old for users.history.list."""
+
+
+def get_mailbox_history_id(service, user_id: str = "me") -> str:
+    """Get the current historyId of the mailbox.
+
+    Args:
+        service: Authorized Gmail API service instance
+        user_id: User's email address or 'me'
+
+    Returns:
+        The mailbox's current historyId
+    """
+    acquire_quota("users.getProfile")
+    return execute_request(
+        service.users().getProfile(userId=user_id),
+        "users.getProfile",
+        num_retries=MAX_REQUEST_RETRIES,
+    )["historyId"]
+
+
+@timed("history")
+def list_history_changes(
+    service, user_id: str, start_history_id: str
+) -> Tuple[set, str]:
+    """List the threads that changed since a historyId.
+
+    Args:
+        service: Authorized Gmail API service instance
+        user_id: User's email address or 'me'
+        start_history_id: historyId saved by the previous sync
+
+    Returns:
+        Tuple containing:
+        - Set of IDs of threads with added/deleted messages or label changes
+        - The mailbox historyId the changes are current up to
+
+    Raises:
+        HistoryExpiredError: If start_history_id is no longer available
+    """
+    changed_thread_ids = set()
+    latest_history_id = start_history_id
+    page_token = None
+
+    while True:
+        kwargs = {
+            "userId": user_id,
+            "startHistoryId": start_history_id,
+            "historyTypes": HISTORY_TYPES,
+        }
+        if page_token:
+            kwargs["pageToken"] = page_token
+
+        try:
+            acquire_quota("users.history.list")
+            response = execute_request(
+                service.users().history().list(**kwargs),
+                "users.history.list",
+                num_retries=MAX_REQUEST_RETRIES,
+            )
+        except (HttpError, errors.HttpError) as e:
+            if hasattr(e, "resp") and e.resp.status == 404:
+                raise HistoryExpiredError(
+                    f"History ID {start_history_id} is no longer available"
+                ) from e
+            raise
+
+        for record in response.get("history", []):
+            for change_type in HISTORY_RECORD_KEYS:
+                for change in record.get(change_type, []):
+                    thread_id = change.get("message", {}).get("threadId")
+                    if thread_id:
+                        changed_thread_ids.add(thread_id)
+
+        latest_history_id = response.get("historyId", latest_history_id)
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return changed_thread_ids, latest_history_id
+
+
+def merge_sender_results(
+    senders: Dict[str, int],
+    sender_threads: Dict[str, GmailSender],
+    new_senders: Dict[str, int],
+    new_sender_threads: Dict[str, GmailSender],
+    email_index: EmailIndex = None,
+) -> None:
+    """Merge newly fetched sender results into existing ones in place.
+
+    Args:
+        senders: Dict of sender email addresses and their message counts
+        sender_threads: Dict of GmailSender objects keyed by sender email
+        new_senders: Sender counts to merge in
+        new_sender_threads: GmailSender objects to merge in
+        email_index: Email index of sender_threads to keep up to date
+    """
+    for sender, count in new_senders.items():
+        senders[sender] = senders.get(sender, 0) + count
+        if sender in new_sender_threads:
+            if sender in sender_threads:
+                sender_threads[sender].add_threads(new_sender_threads[sender].threads)
+            else:
+                sender_threads[sender] = new_sender_threads[sender]
+                if email_index is not None:
+                    email_index.add(sender)
+
+
+def combine_sender_results(
+    senders: Dict[str, int],
+    sender_threads: Dict[str, GmailSender],
+    new_senders: Dict[str, int],
+    new_sender_threads: Dict[str, GmailSender],
+) -> Tuple[Dict[str, int], Dict[str, GmailSender]]:
+    """Combine two sets of sender results without modifying either of them.
+
+    Args:
+        senders: Dict of sender email addresses and their message counts
+        sender_threads: Dict of GmailSender objects keyed by sender email
+        new_senders: Sender counts to add
+        new_sender_threads: GmailSender objects to add
+
+    Returns:
+        Tuple containing the combined sender counts and GmailSender objects
+    """
+    combined_senders = dict(senders)
+    combined_sender_threads = dict(sender_threads)
+    for sender, count in new_senders.items():
+        combined_senders[sender] = combined_senders.get(sender, 0) + count
+        if sender not in new_sender_threads:
+            continue
+        if sender in combined_sender_threads:
+            gmail_sender = GmailSender(sender)
+            gmail_sender.add_threads(combined_sender_threads[sender].threads)
+            gmail_sender.add_threads(new_sender_threads[sender].threads)
+            combined_sender_threads[sender] = gmail_sender
+        else:
+            combined_sender_threads[sender] = new_sender_threads[sender]
+    return combined_senders, combined_sender_threads
+
+
+def remove_threads(
+    senders: Dict[str, int],
+    sender_threads: Dict[str, GmailSender],
+    thread_ids: set,
+    email_index: EmailIndex = None,
+) -> int:
+    """Remove threads from sender results in place.
+
+    Senders left without threads are dropped entirely.
+
+    Args:
+        senders: Dict of sender email addresses and their message counts
+        sender_threads: Dict of GmailSender objects keyed by sender email
+        thread_ids: IDs of the threads to remove
+        email_index: Email index of sender_threads to keep up to date
+
+    Returns:
+        Number of threads removed
+    """
+    removed = 0
+    for sender in list(sender_threads):
+        gmail_sender = sender_threads[sender]
+        for thread_id in [
+            t.thread_id for t in gmail_sender.threads if t.thread_id in thread_ids
+        ]:
+            gmail_sender.remove_thread(thread_id)
+            senders[sender] = senders.get(sender, 1) - 1
+            removed += 1
+        if not gmail_sender.threads:
+            del sender_threads[sender]
+            senders.pop(sender, None)
+            if email_index is not None:
+                email_index.remove(sender)
+    return removed
+
+
+def sync_history(
+    service,
+    storage: GmailStorage,
+    senders: OrderedDict,
+    sender_threads: Dict[str, GmailSender],
+    last_thread_id: str,
+    history_id: str,
+    fetch_format: str = None,
+    email_index: EmailIndex = None,
+) -> Tuple[OrderedDict, Dict[str, GmailSender]]:
+    """Bring cached data up to date using users.history.list.
+
+    Only threads with added/removed messages or label changes since
+    history_id are refetched; all other cached threads are kept as they are.
+    Cached copies are only replaced once the refetch finished. If the sync
+    is interrupted nothing is saved. If some threads could not be fetched,
+    their cached copies are kept and the stored historyId is not moved, so
+    the next sync fetches them again.
+
+    Args:
+        service: Authorized Gmail API service instance or ServicePool
+        storage: Storage holding the cached data
+        senders: Cached sender counts
+        sender_threads: Cached GmailSender objects keyed by sender email
+        last_thread_id: ID of the last processed thread
+        history_id: historyId saved by the previous sync
+        fetch_format: Thread fetch format ('metadata' or 'full')
+        email_index: Email index of sender_threads to keep up to date
+
+    Returns:
+        Tuple containing:
+        - OrderedDict of sender email addresses and their message counts
+        - Dict of GmailSender objects keyed by sender email
+
+    Raises:
+        HistoryExpiredError: If history_id is too old and a full sync is needed
+    """
+    with sync_metrics.phase("history") as phase:
+        changed_thread_ids, latest_history_id = list_history_changes(
+            resolve_service(service), "me", history_id
+        )
+        phase.items = len(changed_thread_ids)
+
+    if not changed_thread_ids:
+        logger.info("No changes since last sync")
+        storage.set_state(HISTORY_ID_KEY, latest_history_id)
+        return senders, sender_threads
+
+    logger.info(f"Found {len(changed_thread_ids)} changed threads since last sync")
+
+    # Refetch changed threads; threads that were deleted, read or archived
+    # are not returned by the fetch
+    failed_thread_ids = set()
+    new_senders, new_sender_threads = show_unread_inbox_threads(
+        service,
+        [{"id": thread_id} for thread_id in sorted(changed_thread_ids)],
+        fetch_format=fetch_format,
+        on_failed=failed_thread_ids.update,
+    )
+    if shutdown_event.is_set():
+        logger.info("Sync interrupted, keeping the cached data")
+        return senders, sender_threads
+
+    remove_threads(
+        senders,
+        sender_threads,
+        changed_thread_ids - failed_thread_ids,
+        email_index,
+    )
+    archived_thread_ids = {
+        thread.thread_id
+        for gmail_sender in new_sender_threads.values()
+        for thread in gmail_sender.threads
+        if not thread.has_label("INBOX")
+    }
+    remove_threads(new_senders, new_sender_threads, archived_thread_ids)
+    merge_sender_results(
+        senders, sender_threads, new_senders, new_sender_threads, email_index
+    )
+
+    sorted_senders = OrderedDict(
+        sorted(senders.items(), key=itemgetter(1), reverse=True)
+    )
+    save_sender_data(storage, sorted_senders, sender_threads, last_thread_id)
+    if failed_thread_ids:
+        logger.warning(
+            f"Could not refetch {len(failed_thread_ids)} changed threads, "
+            "they are fetched again by the next sync"
+        )
+    else:
+        storage.set_state(HISTORY_ID_KEY, latest_history_id)
+    return sorted_senders, sender_threads
+
+
+def get_sync_label_ids(unread_only: bool = True) -> List[str]:
+    """Get the labels a thread must have to be listed for syncing.
+
+    Args:
+        unread_only: Let Gmail drop read threads from the listing so they
+            are never fetched
+
+    Returns:
+        List of label IDs to pass to threads.list
+    """
+    return ["INBOX", "UNREAD"] if unread_only else ["INBOX"]
+
+
+def stream_sender_counts(
+    service_pool: ServicePool,
+    storage,
+    label_ids: List[str],
+    query: str,
+    fetch_format: str,
+    max_memory: int,
+) -> Tuple[OrderedDict, Dict[str, GmailSender]]:
+    """Sync straight into storage, holding at most a bounded set of threads.
+
+    Nothing is loaded from storage up front. Listed threads are looked up in
+    storage one page at a time, threads whose historyId did not change are
+    only marked as still listed, and the others are fetched. Fetched threads
+    are written to storage and evicted from memory whenever memory use
+    exceeds max_memory. Once every listed thread is processed, threads that
+    were not listed are dropped from storage.
+
+    Args:
+        service_pool: Pool of authorized Gmail API services
+        storage: Storage supporting streamed syncs (SQLiteStorage)
+        label_ids: Labels a thread must have to be listed
+        query: Gmail search query to further narrow the thread listing
+        fetch_format: Thread fetch format ('metadata' or 'full')
+        max_memory: Resident set size in bytes above which fetched threads
+            are flushed to storage
+
+    Returns:
+        Tuple containing:
+        - OrderedDict of sender email addresses and their thread counts
+        - Dict of GmailSender objects keyed by sender email, holding counts
+          only, with their threads left in storage
+    """
+    sync_id = uuid.uuid4().hex
+    start_history_id = get_mailbox_history_id(service_pool.get())
+    listing = ThreadListing(service_pool, "me", label_ids, query)
+
+    def iter_changed_threads() -> Iterator[dict]:
+        for page in iter_chunks(listing, MAX_LIST_PAGE_SIZE):
+            stored = storage.lookup_history_ids([thread["id"] for thread in page])
+            current = [
+                thread["id"]
+                for thread in page
+                if stored.get(thread["id"]) is not None
+                and stored[thread["id"]] == thread.get("historyId")
+            ]
+            storage.mark_synced(current, sync_id)
+            changed_threads.skipped += len(current)
+            current = set(current)
+            yield from (thread for thread in page if thread["id"] not in current)
+
+    # Gives the progress bar the number of listed threads left to fetch
+    changed_threads = FilteredListing(iter_changed_threads(), listing)
+
+    def flush(sender_threads: Dict[str, GmailSender]) -> None:
+        with sync_metrics.phase("save") as phase:
+            phase.items = storage.stream_threads(sender_threads, sync_id)
+        logger.info(f"Flushed {phase.items} threads to storage")
+
+    _, sender_threads = show_unread_inbox_threads(
+        service_pool,
+        changed_threads,
+        fetch_format=fetch_format,
+        flush=flush,
+        max_memory=max_memory,
+    )
+    if shutdown_event.is_set():
+        # Streamed threads stay stored, the next sync fetches the rest
+        flush(sender_threads)
+        logger.info("Sync interrupted, run again to finish it")
+        return storage.load_sender_counts()
+
+    flush(sender_threads)
+    del sender_threads
+    with sync_metrics.phase("save"):
+        removed = storage.finish_stream(sync_id, listing.first_thread_id)
+    logger.info(
+        f"Synced {listing.listed} threads ({changed_threads.skipped} unchanged, "
+        f"{removed} removed) with bounded memory"
+    )
+
+    senders, sender_threads = storage.load_sender_counts()
+    email_index = EmailIndex(sender_threads)
+    storage.set_state(HISTORY_ID_KEY, start_history_id)
+    storage.set_state(SYNC_FILTER_KEY, {"label_ids": label_ids, "query": query})
+    storage.set_state(EMAIL_INDEX_KEY, email_index.to_state())
+    storage.set_state(CHECKPOINT_KEY, None)
+    set_email_index(email_index)
+    return senders, sender_threads
+
+
+@timed("sync")
+def get_sender_counts(
+    fetch_format: str = None,
+    incremental: bool = True,
+    unread_only: bool = True,
+    query: str = None,
+    storage_backend: str = None,
+    checkpoint_interval: float = CHECKPOINT_INTERVAL,
+    db_path: str = None,
+    service_factory: Callable[[], Any] = None,
+    max_memory: int = None,
+    credentials_path: str = None,
+    token_path: str = None,
+) -> Tuple[Optional[OrderedDict], Optional[Dict[str, GmailSender]]]:
+    """Get counts of unread emails by sender and their associated threads.
+
+    When threads are listed, only threads that are new or whose historyId
+    differs from the cached one are fetched, and cached threads that are no
+    longer listed are dropped.
+
+    While threads are listed and fetched, partial results and the listing
+    page token are checkpointed to storage every checkpoint_interval
+    seconds and when the sync is interrupted, so a sync that did not finish
+    resumes from its last checkpoint on the next call.
+
+    With max_memory, the sync is streamed into storage instead, see
+    stream_sender_counts, and the returned senders hold counts only.
+
+    Args:
+        fetch_format: Thread fetch format ('metadata' or 'full')
+        incremental: Use the History API to only fetch changes since the
+            last sync when possible
+        unread_only: Only list unread inbox threads instead of listing the
+            whole inbox and discarding read threads after fetching them
+        query: Gmail search query to further narrow the thread listing
+        storage_backend: Storage backend for cached data ('shelve', 'sqlite' or
+            'chunked')
+        checkpoint_interval: Seconds between two checkpoints of a sync
+        db_path: Path of the cache, the backend's default path if None
+        service_factory: Callable building a Gmail service for each worker
+            thread, authorized services from the saved credentials if None
+        max_memory: Resident set size in bytes to keep the sync under by
+            streaming threads into storage, unbounded if None
+        credentials_path: OAuth client secrets file, CREDENTIALS_PATH if None
+        token_path: Saved token file of the account to sync, TOKEN_PATH if None
+
+    Returns:
+        Tuple containing:
+        - OrderedDict of sender email addresses and their message counts
+        - Dict of GmailSender objects keyed by sender email
+
+    Raises:
+        ValueError: If max_memory is given and the storage backend can't
+            stream a sync
+    """
+    # Cached threads carry their historyId, so an old cache only needs the
+    # threads that changed since and never has to be thrown away
+    storage = open_storage(storage_backend, db_path, cache_duration=None)
+    if max_memory is not None:
+        if not hasattr(storage, "stream_threads"):
+            raise ValueError("A bounded-memory sync needs the sqlite storage backend")
+        service_pool = (
+            get_service_pool(credentials_path, token_path)
+            if service_factory is None
+            else ServicePool(service_factory)
+        )
+        try:
+            return stream_sender_counts(
+                service_pool,
+                storage,
+                get_sync_label_ids(unread_only),
+                query,
+                fetch_format,
+                max_memory,
+            )
+        finally:
+            service_pool.close()
+    with sync_metrics.phase("load") as phase:
+        cached_senders, cached_sender_threads, last_thread_id = storage.load_data()
+        phase.items = sum((cached_senders or {}).values())
+
+    label_ids = get_sync_label_ids(unread_only)
+    sync_filter = {"label_ids": label_ids, "query": query}
+    if cached_senders is not None and storage.get_state(SYNC_FILTER_KEY) != sync_filter:
+        logger.info("Listing filter changed since last sync, will fetch fresh data")
+        cached_senders, cached_sender_threads, last_thread_id = None, None, None
+
+    email_index = None
+    if cached_sender_threads is not None:
+        email_index = EmailIndex.load(
+            cached_sender_threads, storage.get_state(EMAIL_INDEX_KEY)
+        )
+        set_email_index(email_index)
+
+    service_pool = None
+    try:
+        if service_factory is None:
+            service_pool = get_service_pool(credentials_path, token_path)
+        else:
+            service_pool = ServicePool(service_factory)
+        service = service_pool.get()
+
+        checkpoint_state = storage.get_state(CHECKPOINT_KEY)
+        if checkpoint_state and (
+            cached_senders is None or checkpoint_state.get("sync_filter") != sync_filter
+        ):
+            logger.info("Discarding checkpoint of an earlier sync")
+            checkpoint_state = None
+
+        # Gmail search queries can't be evaluated against history records,
+        # so a custom query always relists
+        history_id = storage.get_state(HISTORY_ID_KEY)
+        if (
+            incremental
+            and not query
+            and not checkpoint_state
+            and history_id
+            and cached_senders
+            and cached_sender_threads
+        ):
+            try:
+                result = sync_history(
+                    service_pool,
+                    storage,
+                    cached_senders,
+                    cached_sender_threads,
+                    last_thread_id,
+                    history_id,
+                    fetch_format,
+                    email_index=email_index,
+                )
+                storage.set_state(EMAIL_INDEX_KEY, email_index.to_state())
+                return result
+            except HistoryExpiredError as e:
+                logger.info(f"{str(e)}, falling back to full sync")
+                # Cached threads may be stale, so reprocess everything
+                last_thread_id = None
+
+        if checkpoint_state:
+            logger.info("Resuming interrupted sync from its last checkpoint")
+            start_history_id = checkpoint_state["history_id"]
+            resume_page_token = checkpoint_state["page_token"]
+            first_thread_id = checkpoint_state["first_thread_id"]
+            base_senders, base_sender_threads = cached_senders, cached_sender_threads
+        else:
+            # Record the history position before listing so that changes
+            # made while we sync are picked up by the next incremental sync
+            start_history_id = get_mailbox_history_id(service)
+            resume_page_token = None
+            first_thread_id = None
+            # If we have cached data, only process new threads
+            if last_thread_id and cached_senders and cached_sender_threads:
+                base_senders = cached_senders
+                base_sender_threads = cached_sender_threads
+            else:
+                base_senders, base_sender_threads = OrderedDict(), {}
+                email_index = EmailIndex(base_sender_threads)
+
+        # Threads are fetched while later pages are still being listed
+        listing = ThreadListing(
+            service_pool, "me", label_ids, query, page_token=resume_page_token
+        )
+
+        # historyId of every cached thread, to find the ones that changed
+        cached_history_ids = {
+            thread.thread_id: thread.history_id
+            for sender in base_sender_threads.values()
+            for thread in sender.threads
+        }
+        listed_thread_ids = set()
+        changed_thread_ids = set()
+        stale_thread_ids = set()
+
+        def iter_changed_threads() -> Iterator[dict]:
+            for thread in listing:
+                thread_id = thread["id"]
+                listed_thread_ids.add(thread_id)
+                if thread_id not in cached_history_ids:
+                    yield thread
+                elif cached_history_ids[thread_id] != thread.get("historyId"):
+                    changed_thread_ids.add(thread_id)
+                    stale_thread_ids.add(thread_id)
+                    yield thread
+
+        def drop_stale_threads() -> None:
+            # Cached copies of refetched threads are replaced by the new ones
+            if stale_thread_ids:
+                remove_threads(
+                    base_senders, base_sender_threads, stale_thread_ids, email_index
+                )
+                stale_thread_ids.clear()
+
+        threads = iter_changed_threads() if cached_history_ids else listing
+
+        def save_checkpoint(
+            senders: Dict[str, int],
+            sender_threads: Dict[str, GmailSender],
+            complete: bool,
+        ) -> None:
+            nonlocal resume_page_token
+            # Only move the resume point once every listed thread before it
+            # has been processed
+            if complete:
+                resume_page_token = listing.page_token
+
+            drop_stale_threads()
+            combined_senders, combined_sender_threads = combine_sender_results(
+                base_senders, base_sender_threads, senders, sender_threads
+            )
+            thread_count = sum(combined_senders.values())
+            save_sender_data(
+                storage,
+                OrderedDict(
+                    sorted(combined_senders.items(), key=itemgetter(1), reverse=True)
+                ),
+                combined_sender_threads,
+                first_thread_id or listing.first_thread_id,
+            )
+            storage.set_state(SYNC_FILTER_KEY, sync_filter)
+            storage.set_state(
+                CHECKPOINT_KEY,
+                {
+                    "sync_filter": sync_filter,
+                    "history_id": start_history_id,
+                    "page_token": resume_page_token,
+                    "first_thread_id": first_thread_id or listing.first_thread_id,
+                },
+            )
+            logger.info(f"Checkpointed {thread_count} threads")
+
+        new_senders, new_sender_threads = show_unread_inbox_threads(
+            service_pool,
+            threads,
+            fetch_format=fetch_format,
+            checkpoint=save_checkpoint,
+            checkpoint_interval=checkpoint_interval,
+        )
+
+        drop_stale_threads()
+        if shutdown_event.is_set():
+            logger.info("Sync interrupted, run again to resume from the checkpoint")
+            combined_senders, combined_sender_threads = combine_sender_results(
+                base_senders, base_sender_threads, new_senders, new_sender_threads
+            )
+            return (
+                OrderedDict(
+                    sorted(combined_senders.items(), key=itemgetter(1), reverse=True)
+                ),
+                combined_sender_threads,
+            )
+
+        if not listing.listed and not cached_history_ids:
+            logger.info("No threads found in inbox")
+            return cached_senders, cached_sender_threads
+
+        removed_count = 0
+        if cached_history_ids and not checkpoint_state:
+            # Threads that are no longer listed were read, archived or
+            # deleted. A resumed listing skipped earlier pages, so it can't
+            # tell which threads disappeared.
+            removed_count = remove_threads(
+                base_senders,
+                base_sender_threads,
+                set(cached_history_ids) - listed_thread_ids,
+                email_index,
+            )
+            if not new_senders and not changed_thread_ids and not removed_count:
+                logger.info("No changes since last sync")
+                storage.set_state(HISTORY_ID_KEY, start_history_id)
+                storage.set_state(CHECKPOINT_KEY, None)
+                return cached_senders, cached_sender_threads
+            logger.info(
+                f"Fetched {sum(new_senders.values())} new or changed threads "
+                f"({len(changed_thread_ids)} refetched, {removed_count} removed) "
+                "since last sync"
+            )
+
+        # Merge new data with cached data
+        merge_sender_results(
+            base_senders,
+            base_sender_threads,
+            new_senders,
+            new_sender_threads,
+            email_index,
+        )
+
+        # Sort senders by count
+        sorted_senders = OrderedDict(
+            sorted(base_senders.items(), key=itemgetter(1), reverse=True)
+        )
+
+        # Save data
+        save_sender_data(
+            storage,
+            sorted_senders,
+            base_sender_threads,
+            first_thread_id or listing.first_thread_id,
+        )
+        storage.set_state(HISTORY_ID_KEY, start_history_id)
+        storage.set_state(SYNC_FILTER_KEY, sync_filter)
+        storage.set_state(EMAIL_INDEX_KEY, email_index.to_state())
+        storage.set_state(CHECKPOINT_KEY, None)
+        set_email_index(email_index)
+
+        return sorted_senders, base_sender_threads
+
+    except Exception as e:
+        logger.error(f"Error getting sender counts: {str(e)}")
+        # If there's an error, return cached data if available
+        if cached_senders and cached_sender_threads:
+            logger.info("Returning cached data due to error")
+            return cached_senders, cached_sender_threads
+        raise
+
+    finally:
+        if service_pool is not None:
+            service_pool.close()
+
+
+@timed("credentials")
+def get_credentials(credentials_path: str = None, token_path: str = None):
+    """Load, refresh or create OAuth2 credentials for the Gmail API.
+
+    Args:
+        credentials_path: OAuth client secrets file, CREDENTIALS_PATH if None
+        token_path: Saved token file, TOKEN_PATH if None
+
+    Returns:
+        Valid credentials
+
+    Raises:
+        FileNotFoundError: If credentials.json is not found
+        RefreshError: If token refresh fails
+    """
+    credentials_path = credentials_path or CREDENTIALS_PATH
+    token_path = token_path or TOKEN_PATH
+    creds = None
+
+    # Check if token exists
+    if os.path.exists(token_path):
+        try:
+            with open(token_path, "rb") as token:
+                creds = pickle.load(token)
+        except Exception as e:
+            logger.error(f"Error loading token.pickle: {str(e)}")
+            # If token is corrupted, remove it
+            os.remove(token_path)
+            logger.info("Removed corrupted token.pickle")
+
+    # If no valid credentials exist, let the user log in
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            try:
+                creds.refresh(Request())
+            except RefreshError as e:
+                logger.error(f"Token refresh failed: {str(e)}")
+                logger.info("Removing expired token.pickle")
+                os.remove(token_path)
+                raise
+            except Exception as e:
+                logger.error(f"Error refreshing credentials: {str(e)}")
+                raise
+        else:
+            try:
+                if not os.path.exists(credentials_path):
+                    raise FileNotFoundError(
+                        f"Credentials file not found at {credentials_path}. "
+                        "Please place your credentials.json file there."
+                    )
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    credentials_path, SCOPES
+                )
+                creds = flow.run_local_server(port=0)
+            except Exception as e:
+                logger.error(f"Error running auth flow: {str(e)}")
+                raise
+
+        try:
+            # Ensure .env directory exists
+            os.makedirs(os.path.dirname(token_path), exist_ok=True)
+            with open(token_path, "wb") as token:
+                pickle.dump(creds, token)
+            logger.info(f"Saved new token to {token_path}")
+        except Exception as e:
+            logger.error(f"Error saving credentials: {str(e)}")
+            raise
+
+    return creds
+
+
+def get_gmail_service():
+    """Get an authorized Gmail API service instance.
+
+    Returns:
+        Authorized Gmail API service instance.
+
+    Raises:
+        FileNotFoundError: If credentials.json is not found
+        RefreshError: If token refresh fails
+    """
+    creds = get_credentials()
+
+    try:
+        return build_service(creds)
+    except Exception as e:
+        logger.error(f"Error building Gmail service: {str(e)}")
+        raise
+
+
+def get_service_pool(
+    credentials_path: str = None, token_path: str = None
+) -> ServicePool:
+    """Get a pool handing each worker thread its own Gmail service.
+
+    Credentials are loaded (and refreshed if needed) once up front and
+    shared by all services in the pool.
+
+    Args:
+        credentials_path: OAuth client secrets file, CREDENTIALS_PATH if None
+        token_path: Saved token file, TOKEN_PATH if None
+
+    Returns:
+        ServicePool building authorized Gmail API services
+
+    Raises:
+        FileNotFoundError: If credentials.json is not found
+        RefreshError: If token refresh fails
+    """
+    creds = get_credentials(credentials_path, token_path)
+    return ServicePool(lambda: build_service(creds))
+
+
+def iter_thread_pages(
+    service,
+    user_id: str,
+    label_ids: List[str] = None,
+    query: str = None,
+    page_token: str = None,
+) -> Iterator[Tuple[Optional[str], List[dict]]]:
+    """Page through the Threads of the user's mailbox with label_ids applied.
+
+    Args:
+        service: Authorized Gmail API service instance or ServicePool
+        user_id: User's email address or 'me'
+        label_ids: Only return Threads with all of these labelIds applied
+        query: Only return Threads matching this Gmail search query
+        page_token: Page token to resume listing from, None to start at the
+            first page
+
+    Yields:
+        Tuples of the page token used to request a page (None for the first
+        page) and the threads on that page
+    """
+    service = resolve_service(service)
+    list_kwargs = {
+        "userId": user_id,
+        "labelIds": label_ids or [],
+        "maxResults": MAX_LIST_PAGE_SIZE,
+    }
+    if query:
+        list_kwargs["q"] = query
+
+    try:
+        while True:
+            if page_token:
+                logger.debug(f"Getting threads with nextPageToken: {page_token}")
+            start = time.monotonic()
+            acquire_quota("users.threads.list")
+            request_kwargs = dict(list_kwargs)
+            if page_token:
+                request_kwargs["pageToken"] = page_token
+            response = execute_request(
+                service.users().threads().list(**request_kwargs),
+                "users.threads.list",
+                num_retries=MAX_REQUEST_RETRIES,
+            )
+            threads = response.get("threads", [])
+            sync_metrics.record_phase("list", time.monotonic() - start, len(threads))
+
+            yield page_token, threads
+
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return
+
+    except errors.HttpError as error:
+        logger.error(f"An error occurred while listing threads: {error}")
+        raise
+
+
+@timed("list")
+def list_threads_with_labels(
+    service, user_id: str, label_ids: List[str] = None, query: str = None
+) -> List[dict]:
+    """List all Threads of the user's mailbox with label_ids applied.
+
+    Args:
+        service: Authorized Gmail API service instance
+        user_id: User's email address or 'me'
+        label_ids: Only return Threads with all of these labelIds applied
+        query: Only return Threads matching this Gmail search query
+
+    Returns:
+        List of threads that match the criteria of the query
+    """
+    threads = []
+    for _, page in iter_thread_pages(service, user_id, label_ids, query):
+        threads.extend(page)
+    return threads
+
+
+class FilteredListing:
+    """Threads of a ThreadListing that passed a filter.
+
+    Exposes the listing's progress like ThreadListing does, less the
+    threads filtered out, so progress bars know how many threads to expect.
+
+    Attributes:
+        skipped: Number of listed threads filtered out so far
+    """
+
+    def __init__(self, threads: Iterator[dict], listing: "ThreadListing"):
+        """Initialize a FilteredListing.
+
+        Args:
+            threads: Iterator over the threads that passed the filter, which
+                counts the threads it drops in skipped
+            listing: ThreadListing the threads are read from
+        """
+        self.threads = threads
+        self.listing = listing
+        self.skipped = 0
+
+    @property
+    def listed(self) -> int:
+        """Get the number of listed threads that passed the filter."""
+        return self.listing.listed - self.skipped
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self.threads)
+
+
+class ThreadListing:
+    """Stream of listed threads, fetched page by page in the background.
+
+    Iterating starts a producer thread that calls threads.list and pushes
+    each page onto a bounded queue as soon as it arrives, so fetch workers
+    can start on the first page while later pages are still being listed,
+    and at most max_buffered_pages pages are held in memory.
+
+    Attributes:
+        listed: Number of threads listed so far
+        first_thread_id: ID of the first listed thread, None until listed
+        page_token: Page token of the page currently being consumed
+    """
+
+    def __init__(
+        self,
+        service,
+        user_id: str,
+        label_ids: List[str] = None,
+        query: str = None,
+        page_token: str = None,
+        max_buffered_pages: int = 4,
+    ):
+        """Initialize a ThreadListing.
+
+        Args:
+            service: Authorized Gmail API service instance or ServicePool;
+                with a pool the producer thread uses its own service
+            user_id: User's email address or 'me'
+            label_ids: Only return Threads with all of these labelIds applied
+            query: Only return Threads matching this Gmail search query
+            page_token: Page token to resume listing from
+            max_buffered_pages: Maximum pages listed ahead of the consumer
+        """
+        self.service = service
+        self.user_id = user_id
+        self.label_ids = label_ids
+        self.query = query
+        self.start_page_token = page_token
+        self.page_token = page_token
+        self.max_buffered_pages = max_buffered_pages
+        self.listed = 0
+        self.first_thread_id = None
+
+    def __iter__(self) -> Iterator[dict]:
+        pages = queue.Queue(maxsize=self.max_buffered_pages)
+        stop = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            while not stop.is_set() and not shutdown_event.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce() -> None:
+            try:
+                with profiler.span("list"):
+                    for page in iter_thread_pages(
+                        self.service,
+                        self.user_id,
+                        self.label_ids,
+                        self.query,
+                        self.start_page_token,
+                    ):
+                        if not put(page):
+                            return
+                put(done)
+            except BaseException as e:
+                put(e)
+
+        producer = threading.Thread(target=produce, name="gmail-list", daemon=True)
+        producer.start()
+
+        try:
+            while True:
+                try:
+                    item = pages.get(timeout=0.5)
+                except queue.Empty:
+                    if shutdown_event.is_set():
+                        return
+                    continue
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+
+                page_token, threads = item
+                self.page_token = page_token
+                if threads and self.first_thread_id is None:
+                    self.first_thread_id = threads[0]["id"]
+                self.listed += len(threads)
+                yield from threads
+        finally:
+            stop.set()
+
+
+def get_sender(message: dict) -> Optional[str]:
+    """Extract sender email from message headers.
+
+    Args:
+        message: Gmail message object
+
+    Returns:
+        Sender email address or None if not found
+    """
+    for header in message["payload"]["headers"]:
+        if header["name"] and header["name"].lower() == "from":
+            return header["value"]
+    return None
+
+
+def get_subject(message: dict) -> Optional[str]:
+    """Extract subject from message headers.
+
+    Args:
+        message: Gmail message object
+
+    Returns:
+        Subject line or None if not found
+    """
+    for header in message["payload"]["headers"]:
+        if header["name"] and header["name"].lower() == "subject":
+            return header["value"]
+    return None
@@ -1,17 +1,155 @@
-from typing import List
+import sys
+import threading
+from typing import Iterable, List, Optional
+
+# System labels get the lowest bits in a fixed order, so the masks of the
+# labels nearly every thread has are small ints shared by all threads.
+# User labels get the next free bit the first time they are seen.
+SYSTEM_LABELS = (
+    "INBOX",
+    "UNREAD",
+    "STARRED",
+    "IMPORTANT",
+    "SENT",
+    "DRAFT",
+    "SPAM",
+    "TRASH",
+    "CATEGORY_PERSONAL",
+    "CATEGORY_SOCIAL",
+    "CATEGORY_PROMOTIONS",
+    "CATEGORY_UPDATES",
+    "CATEGORY_FORUMS",
+)
+
+
+class LabelTable:
+    """Assigns every label ID a bit so label sets can be stored as ints.
+
+    Attributes:
+        labels: Label IDs in bit order
+    """
+
+    def __init__(self, labels: Iterable[str] = SYSTEM_LABELS):
+        """Initialize a LabelTable.
+
+        Args:
+            labels: Label IDs to assign the first bits to, in order
+        """
+        self.labels: List[str] = []
+        self._bits = {}
+        self._lock = threading.Lock()
+        for label in labels:
+            self.bit(label)
+
+    def bit(self, label: str) -> int:
+        """Get the bit position of a label, assigning the next free one if new.
+
+        Args:
+            label: Gmail label ID
+
+        Returns:
+            Bit position of the label
+        """
+        bit = self._bits.get(label)
+        if bit is None:
+            with self._lock:
+                bit = self._bits.get(label)
+                if bit is None:
+                    bit = len(self.labels)
+                    self.labels.append(sys.intern(label))
+                    self._bits[label] = bit
+        return bit
+
+    def mask(self, label: str) -> int:
+        """Get the bitmask of a single label without assigning it a bit.
+
+        Args:
+            label: Gmail label ID
+
+        Returns:
+            Bitmask of the label, 0 if the label has never been seen
+        """
+        bit = self._bits.get(label)
+        return 0 if bit is None else 1 << bit
+
+    def encode(self, labels: Iterable[str]) -> int:
+        """Encode label IDs as a bitmask.
+
+        Args:
+            labels: Gmail label IDs
+
+        Returns:
+            Bitmask with the bit of every label set
+        """
+        mask = 0
+        for label in labels:
+            mask |= 1 << self.bit(label)
+        return mask
+
+    def decode(self, mask: int) -> List[str]:
+        """Decode a bitmask into label IDs in bit order.
+
+        Args:
+            mask: Bitmask as returned by encode()
+
+        Returns:
+            List of label IDs
+        """
+        labels = []
+        bit = 0
+        while mask:
+            if mask & 1:
+                labels.append(self.labels[bit])
+            mask >>= 1
+            bit += 1
+        return labels
+
+
+# Label table shared by every GmailThread
+LABELS = LabelTable()
+UNREAD_MASK = 1 << LABELS.bit("UNREAD")
 
 
 class GmailThread:
     """Represents a Gmail thread with its metadata.
 
+    Threads use __slots__, intern their sender string and keep their labels
+    as a bitmask against the shared LABELS table, since caches hold
+    hundreds of thousands of them.
+
     Attributes:
         thread_id: The unique identifier for the thread
         labels: List of labels applied to the thread
+        label_mask: Bitmask of the thread's labels in LABELS
         sender: The sender's email address
         subject: The subject line of the thread
+        history_id: The thread's historyId when it was fetched, which
+            changes whenever the thread does
+        message_count: Number of messages in the thread
+        date: internalDate of the thread's latest message in milliseconds
+            since the epoch, None if unknown
     """
 
-    def __init__(self, thread_id: str, labels: List[str], sender: str, subject: str):
+    __slots__ = (
+        "thread_id",
+        "label_mask",
+        "sender",
+        "subject",
+        "history_id",
+        "message_count",
+        "date",
+    )
+
+    def __init__(
+        self,
+        thread_id: str,
+        labels: List[str],
+        sender: str,
+        subject: str,
+        history_id: Optional[str] = None,
+        message_count: int = 1,
+        date: Optional[int] = None,
+    ):
         """Initialize a new GmailThread.
 
         Args:
@@ -19,11 +157,42 @@ class GmailThread:
             labels: List of labels applied to the thread
             sender: The sender's email address
             subject: The subject line of the thread
+            history_id: The thread's historyId when it was fetched
+            message_count: Number of messages in the thread
+            date: internalDate of the thread's latest message in milliseconds
         """
         self.thread_id = thread_id
-        self.labels = labels
-        self.sender = sender
+        self.label_mask = LABELS.encode(labels)
+        self.sender = sys.intern(sender) if sender else sender
         self.subject = subject
+        self.history_id = history_id
+        self.message_count = message_count
+        self.date = date
+
+    @property
+    def labels(self) -> List[str]:
+        """Get the labels applied to the thread."""
+        return LABELS.decode(self.label_mask)
+
+    @labels.setter
+    def labels(self, labels: List[str]) -> None:
+        self.label_mask = LABELS.encode(labels)
+
+    @property
+    def is_unread(self) -> bool:
+        """Check whether the thread is unread."""
+        return bool(self.label_mask & UNREAD_MASK)
+
+    def has_label(self, label: str) -> bool:
+        """Check whether a label is applied to the thread.
+
+        Args:
+            label: Gmail label ID
+
+        Returns:
+            True if the thread has the label
+        """
+        return bool(self.label_mask & LABELS.mask(label))
 
     def __repr__(self) -> str:
         """Get a string representation of the GmailThread.
@@ -0,0 +1,98 @@
+import logging
+import threading
+from typing import Any, Callable, List
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+
+logger = logging.getLogger(__name__)
+
+# Socket timeout in seconds for Gmail API connections
+HTTP_TIMEOUT = 60
+
+
+def build_service(credentials, timeout: int = HTTP_TIMEOUT):
+    """Build a Gmail API service with its own authorized HTTP transport.
+
+    httplib2.Http keeps its connections open between requests, so a service
+    built here reuses one TLS connection for every request it makes. It is
+    not thread-safe and must only be used from one thread at a time.
+
+    Args:
+        credentials: OAuth2 credentials for the mailbox
+        timeout: Socket timeout in seconds
+
+    Returns:
+        Authorized Gmail API service instance
+    """
+    http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=timeout))
+    return build("gmail", "v1", http=http, cache_discovery=False)
+
+
+class ServicePool:
+    """Hands out one Gmail service per thread.
+
+    googleapiclient services share a single httplib2.Http, which is not
+    thread-safe. The pool builds a service for each worker thread the first
+    time it asks for one and returns the same service on every later call
+    from that thread, so each worker keeps its own keep-alive connection.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        """Initialize a ServicePool.
+
+        Args:
+            factory: Callable building a new service, called once per thread
+        """
+        self._factory = factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._services: List[Any] = []
+
+    def get(self):
+        """Get the calling thread's service, building it on first use."""
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._factory()
+            self._local.service = service
+            with self._lock:
+                self._services.append(service)
+            logger.debug(
+                f"Built Gmail service for {threading.current_thread().name} "
+                f"({len(self._services)} in pool)"
+            )
+        return service
+
+    @property
+    def size(self) -> int:
+        """Get the number of services built so far."""
+        with self._lock:
+            return len(self._services)
+
+    def close(self) -> None:
+        """Close the HTTP connections of every service in the pool."""
+        with self._lock:
+            services, self._services = self._services, []
+        for service in services:
+            close = getattr(service, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logger.debug(f"Error closing Gmail service: {str(e)}")
+        self._local = threading.local()
+
+
+def resolve_service(service):
+    """Get a usable service from either a ServicePool or a plain service.
+
+    Args:
+        service: A ServicePool or an authorized Gmail API service instance
+
+    Returns:
+        Gmail API service instance safe to use from the calling thread
+    """
+    if isinstance(service, ServicePool):
+        return service.get()
+    return service
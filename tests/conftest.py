@@ -0,0 +1,30 @@
+from collections import OrderedDict
+from unittest.mock import Mock
+
+from googleapiclient.errors import HttpError
+
+from gmail_stats.sender import GmailSender
+from gmail_stats.thread import GmailThread
+
+SAMPLE_THREADS = (
+    ("1", "Alice <alice@example.com>", ["INBOX", "UNREAD"]),
+    ("2", "Alice <alice@example.com>", ["INBOX"]),
+    ("3", "alice@example.com", ["INBOX", "UNREAD"]),
+    ("4", "bob@example.com", ["INBOX", "UNREAD"]),
+    ("5", "carol@example.com", ["INBOX"]),
+)
+
+
+def make_senders(*threads, date=None):
+    """Build a sender_threads dict from (thread_id, sender, labels) tuples."""
+    sender_threads = OrderedDict()
+    for thread_id, sender, labels in threads:
+        sender_threads.setdefault(sender, GmailSender(sender)).add_thread(
+            GmailThread(thread_id, labels, sender, f"Subject {thread_id}", date=date)
+        )
+    return sender_threads
+
+
+def make_http_error(status):
+    """Create an HttpError with the given status code."""
+    return HttpError(Mock(status=status, reason="error"), b"")
@@ -0,0 +1,229 @@
+import json
+from collections import OrderedDict
+
+import pytest
+from click.testing import CliRunner
+
+from gmail_stats.accounts import (
+    Account,
+    AccountRegistry,
+    combine_account_senders,
+    sender_counts,
+    sync_account,
+    sync_accounts,
+)
+from gmail_stats.cli import cli
+from gmail_stats.storage import open_storage
+
+from conftest import make_senders
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory, so .env paths are isolated."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def save_cache(account, sender_threads):
+    """Save sender data to an account's cache."""
+    open_storage(account.storage_backend, account.db_path).save_data(
+        OrderedDict((key, s.thread_count) for key, s in sender_threads.items()),
+        sender_threads,
+        "1",
+    )
+
+
+def test_account_defaults(workdir):
+    """Test accounts get their own token and cache files."""
+    account = Account("team@example.com", storage_backend="sqlite")
+
+    assert account.token_path == ".env/accounts/team@example.com/token.pickle"
+    assert account.db_path == ".env/accounts/team@example.com/gmail_data.sqlite3"
+    assert account.credentials_path is None
+    assert not account.logged_in
+    assert account.sync_options()["db_path"] == account.db_path
+
+
+@pytest.mark.parametrize("name", ["", "..", "a/b", "a b"])
+def test_account_rejects_invalid_names(name):
+    """Test names that can't be used as a directory are rejected."""
+    with pytest.raises(ValueError):
+        Account(name)
+
+
+def test_registry_round_trip(workdir):
+    """Test accounts are saved, reloaded and removed."""
+    registry = AccountRegistry()
+    registry.add(Account("one", quota_rate=50.0))
+    registry.add(Account("two", storage_backend="sqlite", daily_quota=1000))
+
+    with pytest.raises(ValueError):
+        registry.add(Account("one"))
+
+    loaded = AccountRegistry()
+    assert [a.name for a in loaded] == ["one", "two"]
+    assert loaded.get("one").quota_rate == 50.0
+    assert loaded.get("two").daily_quota == 1000
+    assert loaded.get("two").to_dict() == registry.get("two").to_dict()
+
+    loaded.remove("one")
+    assert [a.name for a in AccountRegistry()] == ["two"]
+    with pytest.raises(KeyError):
+        loaded.get("one")
+
+
+def test_combine_account_senders():
+    """Test sender counts are added up over accounts."""
+    first = sender_counts(
+        make_senders(("1", "a@example.com", ["UNREAD"]), ("2", "b@example.com", []))
+    )
+    second = sender_counts(make_senders(("3", "a@example.com", ["UNREAD"])))
+
+    combined = combine_account_senders(
+        [{"senders": first}, {"senders": second}, {"senders": {}}]
+    )
+
+    assert combined["a@example.com"].thread_count == 2
+    assert combined["a@example.com"].unread_count == 2
+    assert combined["b@example.com"].unread_count == 0
+
+
+def test_sync_account_uses_its_own_paths_and_quota(workdir, mocker):
+    """Test an account is synced with its credentials, cache and quota."""
+    get_counts = mocker.patch(
+        "gmail_stats.sync.get_sender_counts",
+        return_value=(None, make_senders(("1", "a@example.com", ["UNREAD"]))),
+    )
+    mocker.patch("gmail_stats.sync.rate_limiter")
+    account = Account("one", credentials_path="one.json", quota_rate=10.0)
+
+    result = sync_account(account, {"fetch_format": "metadata"})
+
+    assert result["ok"] and result["senders"]["a@example.com"][2] == 1
+    get_counts.assert_called_once_with(
+        fetch_format="metadata",
+        storage_backend="shelve",
+        db_path=account.db_path,
+        credentials_path="one.json",
+        token_path=account.token_path,
+    )
+    from gmail_stats import sync
+
+    assert sync.rate_limiter.units_per_second == 10.0
+
+
+def test_sync_account_reports_errors(workdir, mocker):
+    """Test a failing account returns its error instead of raising."""
+    mocker.patch(
+        "gmail_stats.sync.get_sender_counts", side_effect=RuntimeError("bad token")
+    )
+
+    result = sync_account(Account("one"), {})
+
+    assert not result["ok"]
+    assert result["error"] == "bad token"
+
+
+def test_sync_accounts_in_processes(workdir):
+    """Test accounts are read in worker processes, results in account order."""
+    accounts = [Account("one"), Account("two", storage_backend="sqlite")]
+    save_cache(accounts[0], make_senders(("1", "a@example.com", ["UNREAD"])))
+    save_cache(accounts[1], make_senders(("2", "b@example.com", [])))
+    finished = []
+
+    results = sync_accounts(
+        accounts, {}, offline=True, workers=2, on_result=finished.append
+    )
+
+    assert [r["account"] for r in results] == ["one", "two"]
+    assert sorted(r["account"] for r in finished) == ["one", "two"]
+    assert all(r["ok"] for r in results)
+    assert list(results[1]["senders"]) == ["b@example.com"]
+
+
+def test_accounts_commands(workdir):
+    """Test adding, listing and removing accounts from the command line."""
+    runner = CliRunner()
+
+    result = runner.invoke(
+        cli, ["accounts", "add", "one", "--storage", "sqlite", "--quota-rate", "50"]
+    )
+    assert result.exit_code == 0
+    assert "accounts login one" in result.output
+    assert runner.invoke(cli, ["accounts", "add", "one"]).exit_code == 2
+
+    result = runner.invoke(cli, ["accounts", "list"])
+    assert "one" in result.output and "sqlite" in result.output
+
+    assert runner.invoke(cli, ["accounts", "remove", "one"]).exit_code == 0
+    assert json.loads((workdir / ".env" / "accounts.json").read_text()) == {
+        "accounts": {}
+    }
+
+
+def test_account_option_selects_cache(workdir):
+    """Test --account reads that account's cache."""
+    registry = AccountRegistry()
+    registry.add(Account("one", storage_backend="sqlite"))
+    save_cache(registry.get("one"), make_senders(("1", "a@example.com", ["UNREAD"])))
+
+    result = CliRunner().invoke(
+        cli, ["--offline", "--account", "one", "show", "a@example.com"]
+    )
+
+    assert result.exit_code == 0
+    assert "Subject 1" in result.output
+    assert CliRunner().invoke(cli, ["--account", "nope", "list-senders"]).exit_code == 2
+
+
+def test_account_option_passes_account_to_sync(workdir, mocker):
+    """Test --account syncs with the account's files and storage backend."""
+    registry = AccountRegistry()
+    registry.add(Account("one", storage_backend="sqlite"))
+    get_counts = mocker.patch(
+        "gmail_stats.cli.get_sender_counts", return_value=(OrderedDict(), {})
+    )
+
+    result = CliRunner().invoke(
+        cli, ["--account", "one", "--max-memory", "100", "list-senders"]
+    )
+
+    assert result.exit_code == 0
+    options = get_counts.call_args.kwargs
+    assert options["db_path"] == registry.get("one").db_path
+    assert options["token_path"] == registry.get("one").token_path
+    assert options["max_memory"] == 100 * 2**20
+
+
+def test_sync_all_command(workdir, mocker):
+    """Test sync-all reports every account and the combined senders."""
+    registry = AccountRegistry()
+    registry.add(Account("one"))
+    registry.add(Account("two"))
+    sync = mocker.patch(
+        "gmail_stats.cli.sync_accounts",
+        return_value=[
+            {
+                "account": "one",
+                "ok": True,
+                "error": None,
+                "seconds": 1.0,
+                "senders": sender_counts(
+                    make_senders(("1", "shared@example.com", ["UNREAD"]))
+                ),
+            }
+        ],
+    )
+    (workdir / ".env" / "accounts" / "one").mkdir(parents=True)
+    (workdir / ".env" / "accounts" / "one" / "token.pickle").write_bytes(b"")
+
+    result = CliRunner().invoke(cli, ["--all-threads", "sync-all", "--workers", "4"])
+
+    assert result.exit_code == 1
+    assert "shared@example.com" in result.output
+    assert "not signed in" in result.output
+    accounts, options, offline, workers = sync.call_args.args
+    assert [a.name for a in accounts] == ["one"]
+    assert options["unread_only"] is False and "db_path" not in options
+    assert (offline, workers) == (False, 4)
@@ -0,0 +1,174 @@
+import json
+
+import pytest
+
+from benchmarks import bench_sync, microbench
+from benchmarks.fake_gmail import FakeGmailServer, FakeMailbox
+
+
+def test_fake_mailbox_is_deterministic():
+    """Test the synthetic mailbox gives every thread fixed metadata."""
+    first = FakeMailbox(1000, sender_count=10, unread_fraction=0.3)
+    second = FakeMailbox(1000, sender_count=10, unread_fraction=0.3)
+
+    assert first.unread == second.unread
+    assert 200 < len(first.unread) < 400
+    assert {first.sender(i) for i in range(1000)} <= {
+        f"Sender {s} <sender{s}@example.com>" for s in range(10)
+    }
+    assert first.index(first.thread_id(42)) == 42
+    assert first.index("zz") is None
+    assert first.index(first.thread_id(1000)) is None
+
+
+def test_fake_mailbox_pages_listing():
+    """Test threads.list pages through the listed threads in order."""
+    mailbox = FakeMailbox(250, unread_fraction=1.0)
+
+    ids, token = [], None
+    while True:
+        page = mailbox.list_threads(["INBOX", "UNREAD"], token, 100)
+        ids.extend(thread["id"] for thread in page["threads"])
+        token = page.get("nextPageToken")
+        if token is None:
+            break
+
+    assert ids == [mailbox.thread_id(i) for i in range(250)]
+
+
+def test_fake_server_answers_batches():
+    """Test the fake API answers batched threads.get through googleapiclient."""
+    mailbox = FakeMailbox(20, unread_fraction=1.0)
+    results = {}
+
+    def callback(request_id, response, exception):
+        assert exception is None
+        results[request_id] = response
+
+    with FakeGmailServer(mailbox) as server:
+        service = server.build_service()
+        batch = service.new_batch_http_request(callback=callback)
+        for index in range(5):
+            batch.add(
+                service.users()
+                .threads()
+                .get(userId="me", id=mailbox.thread_id(index), format="metadata"),
+                request_id=str(index),
+            )
+        batch.execute()
+        stats = server.stats.snapshot()
+
+    assert sorted(results) == ["0", "1", "2", "3", "4"]
+    assert results["3"]["messages"][0]["payload"]["headers"][0]["value"] == (
+        mailbox.sender(3)
+    )
+    assert stats["requests"]["batch"] == 1
+    assert stats["requests"]["threads.get"] == 5
+    assert stats["bytes_received"] > 0 and stats["bytes_sent"] > 0
+
+
+@pytest.mark.parametrize("storage_backend", ["shelve", "sqlite", "chunked"])
+def test_run_sync_benchmark(storage_backend):
+    """Test a full sync against the fake API fetches every listed thread."""
+    result = bench_sync.run_sync_benchmark(
+        300, sender_count=20, storage_backend=storage_backend
+    )
+
+    assert result["synced_threads"] == result["expected_threads"]
+    assert result["api_requests"]["threads.get"] == result["expected_threads"]
+    assert result["api_requests"]["getProfile"] == 1
+    assert result["threads_per_second"] > 0
+    assert result["bytes_received"] > result["bytes_sent"] > 0
+    assert result["peak_rss"] > 0
+    json.dumps(result)
+
+
+def test_run_sync_benchmark_retries_injected_errors():
+    """Test the sync recovers from injected 429 and 5xx responses."""
+    result = bench_sync.run_sync_benchmark(
+        200, sender_count=20, throttle_rate=0.05, error_rate=0.05
+    )
+
+    assert result["injected_errors"]
+    assert result["synced_threads"] == result["expected_threads"]
+
+
+def test_run_sync_benchmark_bounded_memory(mocker):
+    """Test a bounded-memory sync flushes to storage and keeps every thread."""
+    mocker.patch("gmail_stats.sync.MIN_FLUSH_THREADS", 50)
+    result = bench_sync.run_sync_benchmark(300, sender_count=20, max_memory=1)
+
+    assert result["synced_threads"] == result["expected_threads"]
+    save = result["sync_metrics"]["phases"]["save"]
+    assert save["threads"] == result["expected_threads"]
+    assert save["peak_rss_bytes"] > 0
+
+
+def test_build_dataset():
+    """Test the synthetic dataset has the requested threads and senders."""
+    senders, sender_threads = microbench.build_dataset(1000, 30)
+
+    assert sum(s.thread_count for s in sender_threads.values()) == 1000
+    assert 1 < len(sender_threads) <= 30
+    assert list(senders) == sorted(
+        sender_threads, key=lambda k: sender_threads[k].message_count, reverse=True
+    )
+    assert dict(senders) == {k: s.message_count for k, s in sender_threads.items()}
+
+
+def test_run_microbenchmarks():
+    """Test every case runs and reports time and allocation."""
+    results = microbench.run_microbenchmarks({"tiny": (300, 30)}, repeat=1)
+
+    cases = results["results"]["tiny"]
+    assert {
+        "storage.shelve.save",
+        "storage.shelve.load",
+        "storage.sqlite.save",
+        "storage.sqlite.load",
+        "sort_senders.unread_threads.grouped",
+        "display_sender_table.all",
+    } <= set(cases)
+    assert all(case["seconds"] > 0 for case in cases.values())
+    assert cases["storage.shelve.load"]["peak_bytes"] > 0
+    assert results["scales"] == {"tiny": [300, 30]}
+    json.dumps(results)
+
+
+def test_find_regressions():
+    """Test only cases beyond the thresholds are flagged."""
+    baseline = {
+        "version": microbench.BASELINE_VERSION,
+        "scales": {"10k": [10000, 1000], "100k": [100000, 10000]},
+        "results": {
+            "10k": {
+                "fast": {"seconds": 1.0, "peak_bytes": 100},
+                "slow": {"seconds": 1.0, "peak_bytes": 100},
+                "hungry": {"seconds": 1.0, "peak_bytes": 100},
+            },
+            "100k": {"fast": {"seconds": 1.0, "peak_bytes": 100}},
+        },
+    }
+    results = {
+        "version": microbench.BASELINE_VERSION,
+        # A differently sized 100k dataset isn't comparable
+        "scales": {"10k": [10000, 1000], "100k": [100000, 5000]},
+        "results": {
+            "10k": {
+                "fast": {"seconds": 1.2, "peak_bytes": 105},
+                "slow": {"seconds": 1.5, "peak_bytes": 100},
+                "hungry": {"seconds": 0.9, "peak_bytes": 120},
+                "new": {"seconds": 9.0, "peak_bytes": 900},
+            },
+            "100k": {"fast": {"seconds": 5.0, "peak_bytes": 100}},
+        },
+    }
+
+    regressions = microbench.find_regressions(results, baseline)
+
+    assert [(r["case"], r["metric"]) for r in regressions] == [
+        ("slow", "seconds"),
+        ("hungry", "peak_bytes"),
+    ]
+    assert regressions[0]["ratio"] == pytest.approx(1.5)
+    assert microbench.find_regressions(results, dict(baseline, version=0)) == []
@@ -0,0 +1,193 @@
+import zlib
+from collections import OrderedDict
+
+import pytest
+from click.testing import CliRunner
+
+from gmail_stats.chunked_storage import ChunkedStorage
+from gmail_stats.cli import cli
+from gmail_stats.sender import GmailSender
+from gmail_stats.storage import open_storage
+from gmail_stats.thread import GmailThread
+
+
+@pytest.fixture
+def temp_db_path(tmp_path):
+    """Create a temporary cache path."""
+    return str(tmp_path / "test_gmail_data.chunks")
+
+
+@pytest.fixture
+def sample_data():
+    """Create sample data for testing."""
+    senders = OrderedDict(
+        [("Test One <test1@example.com>", 2), ("test2@example.com", 1)]
+    )
+
+    sender_threads = {
+        "Test One <test1@example.com>": GmailSender("Test One <test1@example.com>"),
+        "test2@example.com": GmailSender("test2@example.com"),
+    }
+
+    thread1 = GmailThread(
+        "123",
+        ["INBOX", "UNREAD"],
+        "Test One <test1@example.com>",
+        "Subject 1",
+        history_id="9",
+        message_count=3,
+        date=1000,
+    )
+    thread2 = GmailThread("456", ["INBOX"], "Test One <test1@example.com>", "Subject 2")
+    thread3 = GmailThread("789", ["INBOX", "UNREAD"], "test2@example.com", "Subject 3")
+
+    sender_threads["Test One <test1@example.com>"].add_threads([thread1, thread2])
+    sender_threads["test2@example.com"].add_thread(thread3)
+
+    return senders, sender_threads, "123"
+
+
+@pytest.fixture
+def decompress(mocker):
+    """Count the blocks and indexes decompressed."""
+    return mocker.patch(
+        "gmail_stats.chunked_storage.zlib.decompress", side_effect=zlib.decompress
+    )
+
+
+def test_save_and_load_data(temp_db_path, sample_data):
+    """Test saving and loading data."""
+    senders, sender_threads, last_thread_id = sample_data
+    ChunkedStorage(temp_db_path).save_data(senders, sender_threads, last_thread_id)
+
+    loaded_senders, loaded_sender_threads, loaded_last_thread_id = ChunkedStorage(
+        temp_db_path
+    ).load_data()
+
+    assert loaded_senders == senders
+    assert loaded_last_thread_id == last_thread_id
+    for email, sender in loaded_sender_threads.items():
+        original = sender_threads[email]
+        assert sender.sender == original.sender
+        assert [
+            (t.thread_id, t.labels, t.subject, t.history_id, t.message_count, t.date)
+            for t in sender.threads
+        ] == [
+            (t.thread_id, t.labels, t.subject, t.history_id, t.message_count, t.date)
+            for t in original.threads
+        ]
+
+
+def test_load_empty_data(temp_db_path):
+    """Test loading without a cache file."""
+    storage = ChunkedStorage(temp_db_path)
+
+    assert storage.load_data() == (None, None, None)
+    assert storage.load_sender_counts() == (None, None)
+    assert storage.load_sender("test2@example.com") is None
+
+
+def test_load_rejects_other_files(temp_db_path):
+    """Test a file in another format is not read as a cache."""
+    with open(temp_db_path, "wb") as f:
+        f.write(b"not a chunked cache at all")
+
+    assert ChunkedStorage(temp_db_path).load_data() == (None, None, None)
+
+
+def test_load_sender_counts_reads_only_the_index(temp_db_path, sample_data, decompress):
+    """Test sender counts come from the index without any thread block."""
+    ChunkedStorage(temp_db_path).save_data(*sample_data)
+
+    senders, sender_threads = ChunkedStorage(temp_db_path).load_sender_counts()
+
+    assert decompress.call_count == 1
+    assert list(senders) == list(sample_data[0])
+    sender = sender_threads["Test One <test1@example.com>"]
+    assert (sender.message_count, sender.thread_count, sender.unread_count) == (
+        4,
+        2,
+        1,
+    )
+    assert sender.threads_evicted
+
+
+def test_load_sender_reads_one_block(temp_db_path, sample_data, decompress):
+    """Test loading a sender only decompresses its own block."""
+    storage = ChunkedStorage(temp_db_path)
+    storage.save_data(*sample_data)
+
+    sender = storage.load_sender("test2@example.com")
+    storage.load_sender("test2@example.com")
+
+    # The index once, then the block on each load
+    assert decompress.call_count == 3
+    assert [t.thread_id for t in sender.threads] == ["789"]
+    assert storage.load_sender("nobody@example.com") is None
+
+
+def test_readers_see_replaced_file(temp_db_path, sample_data):
+    """Test a save replaces the file under a reader holding the old mapping."""
+    senders, sender_threads, last_thread_id = sample_data
+    storage = ChunkedStorage(temp_db_path)
+    storage.save_data(senders, sender_threads, last_thread_id)
+    assert storage.load_sender("test2@example.com") is not None
+
+    del sender_threads["test2@example.com"]
+    del senders["test2@example.com"]
+    ChunkedStorage(temp_db_path).save_data(senders, sender_threads, last_thread_id)
+
+    assert storage.load_sender("test2@example.com") is None
+    assert list(storage.load_sender_counts()[1]) == ["Test One <test1@example.com>"]
+
+
+def test_state(temp_db_path):
+    """Test state round trips and is removed with the cache."""
+    storage = ChunkedStorage(temp_db_path)
+    assert storage.get_state("history_id") is None
+
+    storage.set_state("history_id", "42")
+    storage.set_state("checkpoint", {"page_token": "abc"})
+
+    assert ChunkedStorage(temp_db_path).get_state("history_id") == "42"
+    assert storage.get_state("checkpoint") == {"page_token": "abc"}
+    storage.clear_cache()
+    assert storage.get_state("history_id", "none") == "none"
+
+
+def test_clear_cache(temp_db_path, sample_data):
+    """Test clearing the cache."""
+    storage = ChunkedStorage(temp_db_path)
+    storage.save_data(*sample_data)
+
+    storage.clear_cache()
+
+    assert storage.load_data() == (None, None, None)
+
+
+def test_open_storage(tmp_path):
+    """Test open_storage creates a chunked storage."""
+    storage = open_storage("chunked", str(tmp_path / "data.chunks"))
+    assert isinstance(storage, ChunkedStorage)
+
+
+def test_cli_reads_blocks_on_demand(tmp_path, monkeypatch, sample_data, decompress):
+    """Test list-senders reads no block and show only one sender's block."""
+    monkeypatch.chdir(tmp_path)
+    open_storage("chunked").save_data(*sample_data)
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ["--offline", "--storage", "chunked", "list-senders"])
+    assert result.exit_code == 0
+    assert "test2@example.com" in result.output
+    # The page comes from the rankings in the state file
+    assert decompress.call_count == 0
+
+    # As in a new process
+    ChunkedStorage._mappings.clear()
+    decompress.reset_mock()
+    result = runner.invoke(
+        cli, ["--offline", "--storage", "chunked", "show", "test2@example.com"]
+    )
+    assert "Subject 3" in result.output
+    assert decompress.call_count == 2
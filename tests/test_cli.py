@@ -1,7 +1,18 @@
+import pstats
+import subprocess
+import sys
 import pytest
 from click.testing import CliRunner
-from gmail_stats.cli import cli, display_sender_table, display_sender_details
+from gmail_stats.cli import (
+    cli,
+    display_sender_table,
+    display_sender_details,
+    sort_senders,
+)
+from gmail_stats.metrics import SyncMetrics
 from gmail_stats.sender import GmailSender
+from gmail_stats.sqlite_storage import SQLiteStorage
+from gmail_stats.storage import GmailStorage
 from gmail_stats.thread import GmailThread
 from collections import OrderedDict
 
@@ -118,3 +129,270 @@ def test_display_sender_details(sample_senders):
     """Test the display_sender_details function."""
     # This is a visual test, we just check it doesn't raise exceptions
     display_sender_details(sample_senders["test1@example.com"])
+
+
+def test_sync_options(runner, mocker):
+    """Test that group options are passed on to get_sender_counts."""
+    get_counts = mocker.patch(
+        "gmail_stats.cli.get_sender_counts", return_value=(OrderedDict(), {})
+    )
+
+    result = runner.invoke(
+        cli, ["--all-threads", "--query", "is:starred", "list-senders"]
+    )
+
+    assert result.exit_code == 0
+    get_counts.assert_called_once_with(
+        fetch_format="metadata",
+        incremental=True,
+        unread_only=False,
+        query="is:starred",
+        storage_backend="shelve",
+        max_memory=None,
+    )
+
+
+def test_sort_senders_uses_aggregates(sample_senders):
+    """Test sorting by thread and unread counts."""
+    sample_senders["test2@example.com"].add_thread(
+        GmailThread("999", ["INBOX", "UNREAD"], "test2@example.com", "Subject 4")
+    )
+
+    assert [email for email, _ in sort_senders(sample_senders, "unread_threads")] == [
+        "test2@example.com",
+        "test1@example.com",
+    ]
+
+
+def test_sort_senders_top_n(sample_senders):
+    """Test heap-selected pages and the minimum count filter."""
+    for i in range(5):
+        sender = GmailSender(f"bulk{i}@example.com")
+        sender.add_threads(
+            [
+                GmailThread(f"b{i}-{j}", ["INBOX"], sender.sender, "Bulk")
+                for j in range(i + 3)
+            ]
+        )
+        sample_senders[sender.sender] = sender
+
+    full = [email for email, _ in sort_senders(sample_senders, "messages")]
+    page = sort_senders(sample_senders, "messages", limit=2, offset=1)
+
+    assert [email for email, _ in page] == full[1:3]
+    assert [email for email, _ in page] == [
+        "bulk3@example.com",
+        "bulk2@example.com",
+    ]
+    assert [
+        email for email, _ in sort_senders(sample_senders, "messages", min_count=6)
+    ] == ["bulk4@example.com", "bulk3@example.com"]
+
+
+def test_list_command_paging(runner, mocker, sample_senders):
+    """Test that --limit/--offset only render the requested page."""
+    mocker.patch("gmail_stats.cli.get_sender_counts", return_value=({}, sample_senders))
+
+    result = runner.invoke(cli, ["list-senders", "--limit", "1", "--offset", "1"])
+
+    assert result.exit_code == 0
+    assert "test2@example.com" in result.output
+    assert "test1@example.com" not in result.output
+    assert "Showing 2-2 of 2 senders" in result.output
+
+
+def test_offline_reads_cache_without_syncing(runner, mocker, tmp_path, sample_senders):
+    """Test that --offline answers from storage and never syncs."""
+    storage = GmailStorage(str(tmp_path / "gmail_data"))
+    storage.save_data(
+        OrderedDict((key, s.thread_count) for key, s in sample_senders.items()),
+        sample_senders,
+        "123",
+    )
+    mocker.patch("gmail_stats.cli.open_storage", return_value=storage)
+    get_counts = mocker.patch("gmail_stats.cli.get_sender_counts")
+
+    result = runner.invoke(cli, ["--offline", "list-senders"])
+
+    assert result.exit_code == 0
+    assert "test1@example.com" in result.output
+    get_counts.assert_not_called()
+
+
+def test_offline_without_cache(runner, mocker, tmp_path):
+    """Test that --offline with an empty cache says how to sync."""
+    storage = GmailStorage(str(tmp_path / "gmail_data"))
+    mocker.patch("gmail_stats.cli.open_storage", return_value=storage)
+
+    result = runner.invoke(cli, ["--offline", "show", "test@example.com"])
+
+    assert result.exit_code == 0
+    assert "run without --offline" in result.output
+
+
+def test_cli_import_does_not_load_gmail_client():
+    """Test that importing the cli leaves the Google client libraries unloaded."""
+    code = (
+        "import sys, gmail_stats.cli; "
+        "print(any(m.startswith(('googleapiclient', 'google_auth_oauthlib', "
+        "'httplib2', 'gmail_stats.sync')) for m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+
+    assert output.strip() == "False"
+
+
+def test_sync_names_resolve_lazily():
+    """Test that sync functions are still importable from the package."""
+    from gmail_stats import get_sender_counts
+    from gmail_stats.sync import get_sender_counts as sync_get_sender_counts
+
+    assert get_sender_counts is sync_get_sender_counts
+
+
+def test_stats_options(runner, mocker, tmp_path, sample_senders):
+    """Test --stats shows and --stats-file writes the sync metrics."""
+    metrics = SyncMetrics()
+    metrics.record_request("batch", 0.2)
+    metrics.record_retry(TimeoutError(), 2.0)
+    metrics.record_phase("fetch", 2.0, 3)
+    mocker.patch("gmail_stats.cli.sync_metrics", metrics)
+    mocker.patch(
+        "gmail_stats.cli.get_sender_counts", return_value=(None, sample_senders)
+    )
+    stats_file = tmp_path / "stats.prom"
+
+    result = runner.invoke(
+        cli, ["--stats", "--stats-file", str(stats_file), "list-senders"]
+    )
+
+    assert result.exit_code == 0
+    assert "Requests" in result.output
+    assert "timeout" in result.output
+    assert "Phases" in result.output
+    assert 'gmail_stats_requests_total{method="batch"} 1' in stats_file.read_text()
+
+
+def test_stats_without_sync(runner, mocker, tmp_path, monkeypatch):
+    """Test --stats says so when nothing was synced."""
+    monkeypatch.chdir(tmp_path)
+    mocker.patch("gmail_stats.cli.sync_metrics", SyncMetrics())
+    mocker.patch("gmail_stats.cli.load_cached_sender_counts", return_value=(None, None))
+
+    result = runner.invoke(cli, ["--offline", "--stats", "list-senders"])
+
+    assert result.exit_code == 0
+    assert "No sync ran" in result.output
+
+
+def test_profile_options(runner, mocker, tmp_path, sample_senders):
+    """Test --profile shows the phases and --profile-output writes cProfile data."""
+    storage = GmailStorage(str(tmp_path / "gmail_data"))
+    storage.save_data(
+        OrderedDict((key, s.thread_count) for key, s in sample_senders.items()),
+        sample_senders,
+        "123",
+    )
+    mocker.patch("gmail_stats.cli.open_storage", return_value=storage)
+    profile_output = tmp_path / "list.prof"
+
+    result = runner.invoke(
+        cli,
+        [
+            "--offline",
+            "--profile",
+            "--profile-output",
+            str(profile_output),
+            "list-senders",
+        ],
+    )
+
+    assert result.exit_code == 0
+    # The page comes from the stored rankings, so nothing is sorted
+    for phase in ("Profile", "storage.load", "render"):
+        assert phase in result.output
+    assert pstats.Stats(str(profile_output)).total_calls > 0
+
+
+def test_max_memory_needs_sqlite(runner, mocker):
+    """Test --max-memory is passed on in bytes and only works with sqlite."""
+    get_counts = mocker.patch(
+        "gmail_stats.cli.get_sender_counts", return_value=(OrderedDict(), {})
+    )
+
+    result = runner.invoke(cli, ["--max-memory", "256", "list-senders"])
+    assert result.exit_code == 2
+    assert "--storage sqlite" in result.output
+
+    result = runner.invoke(
+        cli, ["--storage", "sqlite", "--max-memory", "256", "list-senders"]
+    )
+    assert result.exit_code == 0
+    assert get_counts.call_args.kwargs["max_memory"] == 256 * 2**20
+
+
+def test_show_loads_evicted_threads(runner, mocker, tmp_path, sample_senders):
+    """Test show reads the threads a bounded-memory sync left in storage."""
+    storage = SQLiteStorage(str(tmp_path / "gmail_data.sqlite3"))
+    storage.save_data(
+        OrderedDict((key, s.thread_count) for key, s in sample_senders.items()),
+        sample_senders,
+        "123",
+    )
+    mocker.patch("gmail_stats.cli.open_storage", return_value=storage)
+    mocker.patch(
+        "gmail_stats.cli.get_sender_counts", return_value=storage.load_sender_counts()
+    )
+
+    result = runner.invoke(cli, ["--storage", "sqlite", "show", "test1@example.com"])
+
+    assert result.exit_code == 0
+    assert "Subject 1" in result.output and "Subject 2" in result.output
+
+
+def test_offline_show_reads_one_sender(runner, mocker, tmp_path):
+    """Test offline show on sqlite reads the sender through the indexes."""
+    storage = SQLiteStorage(str(tmp_path / "gmail_data.sqlite3"))
+    sender_threads = OrderedDict()
+    for thread_id, sender in (
+        ("1", "Alice <alice@example.com>"),
+        ("2", "alice@example.com"),
+        ("3", "bob@example.com"),
+    ):
+        sender_threads.setdefault(sender, GmailSender(sender)).add_thread(
+            GmailThread(thread_id, ["INBOX"], sender, f"Subject {thread_id}")
+        )
+    storage.save_data(
+        OrderedDict((key, s.thread_count) for key, s in sender_threads.items()),
+        sender_threads,
+        "3",
+    )
+    mocker.patch("gmail_stats.cli.open_storage", return_value=storage)
+    load_counts = mocker.patch("gmail_stats.cli.load_sender_counts")
+
+    result = runner.invoke(
+        cli, ["--offline", "--storage", "sqlite", "show", "bob@example.com"]
+    )
+    assert "Subject 3" in result.output
+
+    result = runner.invoke(
+        cli,
+        [
+            "--offline",
+            "--storage",
+            "sqlite",
+            "show",
+            "--group-by-email",
+            "alice@example.com",
+        ],
+    )
+    assert "Total Threads: 2" in result.output
+    assert "Subject 1" in result.output and "Subject 2" in result.output
+
+    result = runner.invoke(
+        cli, ["--offline", "--storage", "sqlite", "show", "nobody@example.com"]
+    )
+    assert "No messages found from nobody@example.com" in result.output
+    load_counts.assert_not_called()
@@ -0,0 +1,243 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pytest
+from click.testing import CliRunner
+
+from gmail_stats.cli import cli
+from gmail_stats.daemon import (
+    DaemonClient,
+    DaemonError,
+    GmailStatsDaemon,
+    SenderDataset,
+    connect_daemon,
+    socket_path,
+)
+from gmail_stats.storage import open_storage
+
+from conftest import SAMPLE_THREADS, make_senders
+
+# Options the CLI syncs with by default, plus the sqlite cache
+SYNC_OPTIONS = {
+    "fetch_format": "metadata",
+    "incremental": True,
+    "unread_only": True,
+    "query": None,
+    "storage_backend": "sqlite",
+}
+
+
+def save_cache(sender_threads):
+    """Save sender data to the default sqlite cache."""
+    open_storage("sqlite").save_data(
+        OrderedDict((key, s.thread_count) for key, s in sender_threads.items()),
+        sender_threads,
+        "1",
+    )
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory holding a cache, so .env paths are isolated."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(".env")
+    save_cache(make_senders(*SAMPLE_THREADS, date=1000))
+    return tmp_path
+
+
+@pytest.fixture
+def start_daemon(workdir):
+    """Start daemons serving in a thread, and stop them after the test."""
+    daemons = []
+
+    def start(**kwargs):
+        kwargs.setdefault("offline", True)
+        server = GmailStatsDaemon(dict(SYNC_OPTIONS), **kwargs)
+        server.start()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        daemons.append((server, thread))
+        return server
+
+    yield start
+    for server, thread in daemons:
+        server.stop()
+        thread.join(5)
+
+
+def test_socket_path():
+    """Test every cache gets its own socket."""
+    assert socket_path("sqlite") == os.path.join(".env", "gmail-stats-sqlite.sock")
+    assert socket_path("shelve", "/data/one") == "/data/one.sock"
+
+
+def test_dataset_queries():
+    """Test pages and senders are answered like the in-process commands."""
+    dataset = SenderDataset(make_senders(*SAMPLE_THREADS, date=1000))
+
+    page = dataset.senders(sort_by="unread_threads", limit=2)
+    assert page["total"] == 4
+    assert [row[0] for row in page["rows"]] == [
+        "Alice <alice@example.com>",
+        "alice@example.com",
+    ]
+
+    grouped = dataset.senders(group_by_email=True, min_count=3)
+    assert grouped == {"rows": [["alice@example.com", 3, 3, 2]], "total": 1}
+
+    sender = dataset.sender("alice@example.com", group_by_email=True)
+    assert sender["counts"][:3] == [3, 3, 2]
+    assert sorted(t["thread_id"] for t in sender["threads"]) == ["1", "2", "3"]
+    assert dataset.sender("nobody@example.com") is None
+
+
+def test_dataset_loads_evicted_threads(workdir):
+    """Test threads a bounded-memory sync left in storage are read back."""
+    storage = open_storage("sqlite")
+    _, sender_threads, _ = storage.load_data()
+    sender_threads["bob@example.com"].evict_threads()
+
+    sender = SenderDataset(sender_threads, storage).sender("bob@example.com")
+
+    assert [t["subject"] for t in sender["threads"]] == ["Subject 4"]
+
+
+def test_daemon_answers_queries(start_daemon):
+    """Test a running daemon answers status, page and sender requests."""
+    server = start_daemon()
+    client = DaemonClient(server.path)
+
+    status = client.request("status")
+    assert status["loaded"] and status["senders"] == 4 and status["threads"] == 5
+    rows, total = client.senders(sort_by="threads", limit=1)
+    assert total == 4
+    assert [(key, s.thread_count) for key, s in rows] == [
+        ("Alice <alice@example.com>", 2)
+    ]
+    sender = client.sender("bob@example.com")
+    assert sender.unread_count == 1
+    assert [t.labels for t in sender.threads] == [["INBOX", "UNREAD"]]
+    with pytest.raises(DaemonError):
+        client.request("nope")
+    assert oct(os.stat(server.path).st_mode & 0o777) == "0o600"
+
+
+def test_daemon_refreshes_on_request(start_daemon):
+    """Test a refresh swaps in new data and a failing one keeps the old."""
+    # The first sync runs as the daemon starts
+    syncs = [
+        make_senders(("9", "carol@example.com", ["UNREAD"]), date=1000),
+        make_senders(*SAMPLE_THREADS, date=1000),
+    ]
+
+    def sync(**options):
+        if not syncs:
+            raise RuntimeError("quota exceeded")
+        return None, syncs.pop()
+
+    server = start_daemon(offline=False, sync=sync, refresh_interval=3600)
+    client = DaemonClient(server.path, timeout=10)
+
+    result = client.request("refresh")
+    assert result["finished"] and result["last_refresh"]["ok"]
+    assert client.sender("carol@example.com") is not None
+
+    result = client.request("refresh")
+    assert result["last_refresh"] == {
+        "ok": False,
+        "error": "quota exceeded",
+        "finished_at": result["last_refresh"]["finished_at"],
+        "seconds": result["last_refresh"]["seconds"],
+    }
+    assert client.sender("carol@example.com") is not None
+
+
+def test_daemon_socket_is_exclusive(start_daemon, workdir):
+    """Test a second daemon fails and a stale socket file is replaced."""
+    server = start_daemon()
+    with pytest.raises(RuntimeError):
+        GmailStatsDaemon(dict(SYNC_OPTIONS), offline=True).start()
+
+    server.stop()
+    assert not os.path.exists(server.path)
+    with open(server.path, "w"):
+        pass
+    assert start_daemon().dataset is not None
+
+
+def test_connect_daemon_checks_options(start_daemon):
+    """Test clients only use a daemon synced with the same options."""
+    start_daemon()
+
+    assert connect_daemon(SYNC_OPTIONS) is not None
+    assert connect_daemon({**SYNC_OPTIONS, "unread_only": False}) is None
+    assert connect_daemon({**SYNC_OPTIONS, "storage_backend": "shelve"}) is None
+
+
+def test_cli_uses_running_daemon(start_daemon, mocker):
+    """Test commands ask the daemon instead of loading the data."""
+    start_daemon()
+    load = mocker.patch("gmail_stats.cli.load_sender_counts")
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ["--storage", "sqlite", "list-senders", "--limit", "2"])
+    assert result.exit_code == 0
+    assert "Showing 1-2 of 4 senders" in result.output
+
+    result = runner.invoke(
+        cli, ["--storage", "sqlite", "show", "--group-by-email", "alice@example.com"]
+    )
+    assert "Total Threads: 3" in result.output and "Subject 3" in result.output
+    load.assert_not_called()
+
+
+def test_cli_falls_back_without_daemon(start_daemon, mocker):
+    """Test --no-daemon, --full-sync and no daemon load the data in-process."""
+    load = mocker.patch(
+        "gmail_stats.cli.load_sender_counts",
+        return_value=(None, make_senders(("5", "dave@example.com", []), date=1000)),
+    )
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ["--storage", "sqlite", "list-senders"])
+    assert "dave@example.com" in result.output
+
+    start_daemon()
+    for options in (["--no-daemon"], ["--full-sync"]):
+        result = runner.invoke(cli, ["--storage", "sqlite", *options, "list-senders"])
+        assert "dave@example.com" in result.output
+    assert load.call_count == 3
+
+
+def test_daemon_commands(start_daemon):
+    """Test status, refresh and stop talk to the running daemon."""
+    runner = CliRunner()
+    result = runner.invoke(cli, ["--storage", "sqlite", "daemon", "status"])
+    assert result.exit_code == 1
+    assert "No daemon running" in result.output
+
+    server = start_daemon()
+    result = runner.invoke(cli, ["--storage", "sqlite", "daemon", "status"])
+    assert result.exit_code == 0
+    assert "cache reload every 15 min" in result.output
+
+    result = runner.invoke(cli, ["--storage", "sqlite", "daemon", "refresh"])
+    assert result.exit_code == 0 and "ok" in result.output
+
+    result = runner.invoke(cli, ["--storage", "sqlite", "daemon", "stop"])
+    assert result.exit_code == 0
+    server._thread.join(5)
+    assert not DaemonClient(server.path).alive()
+
+
+def test_daemon_refresh_without_refresh_yet(start_daemon, mocker):
+    """Test refresh reports a daemon that stopped before its first refresh."""
+    server = start_daemon()
+    mocker.patch.object(DaemonClient, "request", return_value=server.status())
+
+    result = CliRunner().invoke(cli, ["--storage", "sqlite", "daemon", "refresh"])
+
+    assert result.exit_code == 1
+    assert "no refresh yet" in result.output
+    assert not isinstance(result.exception, KeyError)
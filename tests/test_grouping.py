@@ -0,0 +1,88 @@
+import pytest
+from gmail_stats.grouping import (
+    EmailIndex,
+    SenderGroup,
+    get_email_index,
+    set_email_index,
+)
+from gmail_stats.sender import GmailSender
+from gmail_stats.thread import GmailThread
+
+
+@pytest.fixture
+def sender_threads():
+    """Create senders where two share an email address."""
+    senders = {}
+    for key, thread_id, labels, date in [
+        ("Alice <alice@example.com>", "1", ["INBOX", "UNREAD"], 100),
+        ("alice@example.com", "2", ["INBOX"], 300),
+        ("bob@example.com", "3", ["INBOX", "UNREAD"], 200),
+    ]:
+        sender = GmailSender(key)
+        sender.add_thread(GmailThread(thread_id, labels, key, "Subject", None, 2, date))
+        senders[key] = sender
+    return senders
+
+
+def test_email_index_groups(sender_threads):
+    """Test that senders sharing an address form one group."""
+    index = EmailIndex(sender_threads)
+
+    assert sorted(index) == ["alice@example.com", "bob@example.com"]
+    alice = index.get("alice@example.com")
+    assert isinstance(alice, SenderGroup)
+    assert alice.message_count == 4
+    assert alice.thread_count == 2
+    assert alice.unread_count == 1
+    assert (alice.first_seen, alice.last_seen) == (100, 300)
+    assert sorted(t.thread_id for t in alice.threads) == ["1", "2"]
+    assert index.get("carol@example.com") is None
+
+
+def test_email_index_incremental_updates(sender_threads):
+    """Test adding and removing senders without rebuilding."""
+    index = EmailIndex(sender_threads)
+
+    del sender_threads["alice@example.com"]
+    index.remove("alice@example.com")
+    assert index.get("alice@example.com").thread_count == 1
+
+    sender_threads["Bobby <bob@example.com>"] = GmailSender("Bobby <bob@example.com>")
+    index.add("Bobby <bob@example.com>")
+    assert len(index.get("bob@example.com").members) == 2
+
+    del sender_threads["Alice <alice@example.com>"]
+    index.remove("Alice <alice@example.com>")
+    assert index.get("alice@example.com") is None
+
+
+def test_email_index_state_round_trip(sender_threads, mocker):
+    """Test that a stored index is reused without parsing sender strings."""
+    state = EmailIndex(sender_threads).to_state()
+    assert state == {
+        "alice@example.com": ["Alice <alice@example.com>", "alice@example.com"],
+        "bob@example.com": ["bob@example.com"],
+    }
+
+    get_email = mocker.patch.object(GmailSender, "get_email")
+    index = EmailIndex.load(sender_threads, state)
+
+    get_email.assert_not_called()
+    assert index.get("alice@example.com").thread_count == 2
+
+
+def test_email_index_load_rebuilds_stale_state(sender_threads):
+    """Test that a stored index for other senders is rebuilt."""
+    index = EmailIndex.load(sender_threads, {"old@example.com": ["old@example.com"]})
+
+    assert sorted(index) == ["alice@example.com", "bob@example.com"]
+    assert EmailIndex.load(sender_threads, None).to_state() == index.to_state()
+
+
+def test_get_email_index_reuses_remembered_index(sender_threads):
+    """Test that the index kept by the sync is reused for the same senders."""
+    index = EmailIndex(sender_threads)
+    set_email_index(index)
+
+    assert get_email_index(sender_threads) is index
+    assert get_email_index(dict(sender_threads)) is not index
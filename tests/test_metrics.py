@@ -0,0 +1,184 @@
+import json
+import socket
+import ssl
+import tracemalloc
+
+import pytest
+
+from gmail_stats.metrics import (
+    Histogram,
+    SyncMetrics,
+    classify_error,
+    current_rss,
+    memory_snapshot,
+)
+
+from conftest import make_http_error
+
+
+@pytest.mark.parametrize(
+    "error, error_class",
+    [
+        (make_http_error(429), "rate_limit"),
+        (make_http_error(503), "server_error"),
+        (make_http_error(404), "other"),
+        (ssl.SSLError(), "ssl"),
+        (socket.timeout(), "timeout"),
+        (TimeoutError(), "timeout"),
+        (ValueError(), "other"),
+    ],
+)
+def test_classify_error(error, error_class):
+    """Test errors are classified by retry cause."""
+    assert classify_error(error) == error_class
+
+
+def test_histogram():
+    """Test observations land in the right buckets."""
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(2.65)
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(1.0) == float("inf")
+    assert Histogram().quantile(0.5) is None
+
+
+def test_sync_metrics_summary():
+    """Test every recorded counter shows up in the summary."""
+    metrics = SyncMetrics()
+    metrics.record_request("batch", 0.2)
+    metrics.record_request("users.threads.get", count=100)
+    metrics.record_error(make_http_error(429), count=3)
+    metrics.record_retry(make_http_error(429), 1.5)
+    metrics.record_retry(make_http_error(429), 2.5)
+    metrics.record_quota("users.threads.get", 1000, 0.25)
+    metrics.record_phase("fetch", 2.0, 100)
+    with metrics.phase("save") as phase:
+        phase.items = 100
+
+    summary = metrics.summary()
+
+    assert summary["requests"] == {"batch": 1, "users.threads.get": 100}
+    assert list(summary["latency"]) == ["batch"]
+    assert summary["errors"] == {"rate_limit": 3}
+    assert summary["retries"] == {"rate_limit": 2}
+    assert summary["backoff_seconds"] == {"rate_limit": 4.0}
+    assert summary["quota_units"] == {"users.threads.get": 1000}
+    assert summary["limiter_wait_seconds"] == 0.25
+    assert summary["phases"]["fetch"]["threads_per_second"] == 50.0
+    assert summary["phases"]["save"]["threads"] == 100
+    assert json.loads(metrics.to_json())["requests"] == summary["requests"]
+
+    metrics.reset()
+    assert metrics.summary()["requests"] == {}
+
+
+def test_sync_metrics_prometheus():
+    """Test the Prometheus export has cumulative histogram buckets."""
+    metrics = SyncMetrics()
+    metrics.record_request("batch", 0.01)
+    metrics.record_request("batch", 0.3)
+    metrics.record_request("batch", 60)
+    metrics.record_retry(TimeoutError(), 2)
+    metrics.record_phase("list", 1.0, 500)
+
+    text = metrics.to_prometheus()
+    lines = text.splitlines()
+
+    assert 'gmail_stats_requests_total{method="batch"} 3' in lines
+    assert (
+        'gmail_stats_request_duration_seconds_bucket{method="batch",le="0.025"} 1'
+        in lines
+    )
+    assert (
+        'gmail_stats_request_duration_seconds_bucket{method="batch",le="0.5"} 2'
+        in lines
+    )
+    assert (
+        'gmail_stats_request_duration_seconds_bucket{method="batch",le="+Inf"} 3'
+        in lines
+    )
+    assert 'gmail_stats_request_duration_seconds_count{method="batch"} 3' in lines
+    assert 'gmail_stats_retries_total{class="timeout"} 1' in lines
+    assert 'gmail_stats_phase_threads_total{phase="list"} 500' in lines
+    assert "# TYPE gmail_stats_quota_units_total counter" in lines
+    assert "# TYPE gmail_stats_request_duration_seconds histogram" in lines
+
+
+def test_sync_metrics_prometheus_families():
+    """Test every sample follows the declaration of its own family."""
+    metrics = SyncMetrics()
+    metrics.record_request("batch", 0.3)
+    metrics.record_request("users.getProfile", 0.1)
+    metrics.record_phase("list", 1.0, 500)
+
+    family, kind = None, None
+    for line in metrics.to_prometheus().splitlines():
+        if line.startswith("# TYPE "):
+            _, _, family, kind = line.split()
+            continue
+        if line.startswith("#"):
+            continue
+        name = line.split("{")[0].split()[0]
+        suffixes = ("_bucket", "_sum", "_count") if kind == "histogram" else ("",)
+        assert name in {family + suffix for suffix in suffixes}, line
+
+
+def test_sync_metrics_prometheus_parses():
+    """Test the Prometheus client parses the export."""
+    parser = pytest.importorskip("prometheus_client.parser")
+    metrics = SyncMetrics()
+    metrics.record_request("batch", 0.01)
+    metrics.record_request("batch", 0.3)
+
+    families = {
+        f.name: f
+        for f in parser.text_string_to_metric_families(metrics.to_prometheus())
+    }
+
+    histogram = families["gmail_stats_request_duration_seconds"]
+    assert histogram.type == "histogram"
+    samples = {(s.name, s.labels.get("le")): s.value for s in histogram.samples}
+    assert samples[("gmail_stats_request_duration_seconds_bucket", "+Inf")] == 2
+    assert samples[("gmail_stats_request_duration_seconds_count", None)] == 2
+    assert samples[("gmail_stats_request_duration_seconds_sum", None)] == 0.31
+
+
+def test_sync_metrics_write(tmp_path):
+    """Test the output format follows the file extension."""
+    metrics = SyncMetrics()
+    metrics.record_request("users.getProfile", 0.1)
+
+    metrics.write(str(tmp_path / "stats.json"))
+    metrics.write(str(tmp_path / "stats.prom"))
+
+    with open(tmp_path / "stats.json") as f:
+        assert json.load(f)["requests"] == {"users.getProfile": 1}
+    with open(tmp_path / "stats.prom") as f:
+        assert 'gmail_stats_requests_total{method="users.getProfile"} 1' in f.read()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["stats.json", "stats.prom"]
+
+
+def test_memory_snapshot():
+    """Test phases record the memory use when they end."""
+    assert current_rss() > 0
+    assert memory_snapshot()["traced_bytes"] is None
+
+    metrics = SyncMetrics()
+    tracemalloc.start()
+    try:
+        metrics.record_phase("fetch", 1.0, 10)
+    finally:
+        tracemalloc.stop()
+
+    phase = metrics.summary()["phases"]["fetch"]
+    assert phase["peak_rss_bytes"] >= phase["rss_bytes"] > 0
+    assert phase["traced_peak_bytes"] >= phase["traced_bytes"] >= 0
+    assert 'gmail_stats_phase_peak_rss_bytes{phase="fetch"}' in (
+        metrics.to_prometheus()
+    )
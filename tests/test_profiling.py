@@ -0,0 +1,122 @@
+import pstats
+import threading
+
+import pytest
+
+from gmail_stats.profiling import Profiler, profiler, timed
+
+
+def spans(profiler):
+    """Get (depth, name, calls) of every recorded span."""
+    return [(depth, span.name, span.calls) for depth, span in profiler.breakdown()]
+
+
+def test_spans_nest():
+    """Test spans opened inside other spans are nested in them."""
+    p = Profiler()
+    p.start()
+    with p.span("sync"):
+        with p.span("fetch"):
+            pass
+        with p.span("fetch"):
+            pass
+        with p.span("storage.save"):
+            pass
+    with p.span("render"):
+        pass
+    p.stop()
+
+    assert spans(p) == [
+        (0, "sync", 1),
+        (1, "fetch", 2),
+        (1, "storage.save", 1),
+        (0, "render", 1),
+    ]
+    sync = p.root.children["sync"]
+    assert sync.seconds >= sync.children["fetch"].seconds
+    assert p.wall_seconds >= sync.seconds
+
+
+def test_spans_of_other_threads_stay_top_level():
+    """Test spans of worker threads are not nested in the main thread's."""
+    p = Profiler()
+    p.start()
+    with p.span("sync"):
+
+        def work():
+            with p.span("list"):
+                pass
+
+        worker = threading.Thread(target=work, name="gmail-list")
+        worker.start()
+        worker.join()
+    p.stop()
+
+    assert spans(p) == [(0, "sync", 1), (0, "list [gmail-list]", 1)]
+
+
+def test_disabled_profiler_records_nothing():
+    """Test spans are ignored until the profiler is started."""
+    p = Profiler()
+    with p.span("sync"):
+        pass
+
+    assert p.breakdown() == []
+
+
+def test_span_records_on_error():
+    """Test a span is closed when its block raises."""
+    p = Profiler()
+    p.start()
+    with pytest.raises(ValueError):
+        with p.span("sync"):
+            raise ValueError()
+    with p.span("render"):
+        pass
+    p.stop()
+
+    assert spans(p) == [(0, "sync", 1), (0, "render", 1)]
+
+
+def test_timed_uses_global_profiler():
+    """Test the decorator times calls only while profiling."""
+
+    @timed("work")
+    def work(value):
+        return value * 2
+
+    profiler.start()
+    profiler.stop()
+    assert work(2) == 4
+    assert profiler.breakdown() == []
+
+    profiler.start()
+    try:
+        assert work(3) == 6
+    finally:
+        profiler.stop()
+
+    assert spans(profiler) == [(0, "work", 1)]
+
+
+def test_dump_stats(tmp_path):
+    """Test cProfile statistics are written as a .prof file."""
+    p = Profiler()
+    p.start(cprofile=True)
+    sum(range(1000))
+    p.stop()
+    path = tmp_path / "sync.prof"
+
+    p.dump_stats(str(path))
+
+    assert pstats.Stats(str(path)).total_calls > 0
+
+
+def test_dump_stats_without_cprofile(tmp_path):
+    """Test dumping fails when cProfile did not run."""
+    p = Profiler()
+    p.start()
+    p.stop()
+
+    with pytest.raises(RuntimeError):
+        p.dump_stats(str(tmp_path / "sync.prof"))
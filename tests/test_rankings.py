@@ -0,0 +1,178 @@
+import random
+from collections import OrderedDict
+
+import pytest
+from click.testing import CliRunner
+
+from gmail_stats.cli import cli, sort_senders
+from gmail_stats.rankings import (
+    RANKINGS_KEY,
+    Ranking,
+    SenderRankings,
+    load_rankings,
+    update_rankings_state,
+)
+from gmail_stats.storage import STORAGE_BACKENDS, open_storage
+from gmail_stats.thread import GmailThread
+
+from conftest import SAMPLE_THREADS, make_senders
+
+
+def save(storage, sender_threads):
+    """Save sender data as a sync would."""
+    storage.save_data(
+        OrderedDict((key, s.thread_count) for key, s in sender_threads.items()),
+        sender_threads,
+        "1",
+    )
+
+
+def test_page_matches_sort_senders():
+    """Test every page is the one sorting the senders gives."""
+    sender_threads = make_senders(*SAMPLE_THREADS)
+    rankings = SenderRankings.build(sender_threads)
+
+    for sort_by in ("messages", "threads", "unread_threads"):
+        for group_by_email in (False, True):
+            rows, total = rankings.page(sort_by, group_by_email, limit=2, offset=1)
+            expected = sort_senders(sender_threads, sort_by, group_by_email, 2, 1)
+            assert [row[0] for row in rows] == [key for key, _ in expected]
+            assert total == (3 if group_by_email else 4)
+
+
+def test_page_min_count_and_grouped_counts():
+    """Test min_count cuts the ranking and groups add up their senders."""
+    rankings = SenderRankings.build(make_senders(*SAMPLE_THREADS))
+
+    assert rankings.page("unread_threads", group_by_email=True, min_count=2) == (
+        [("alice@example.com", 3, 3, 2)],
+        1,
+    )
+    rows, total = rankings.page("threads", min_count=1, offset=3)
+    assert rows == [("carol@example.com", 1, 1, 0)] and total == 4
+    assert rankings.page("threads", min_count=5) == ([], 0)
+    with pytest.raises(ValueError):
+        rankings.page("subjects")
+
+
+def test_update_matches_rebuild():
+    """Test incremental updates end up ranked like a fresh ranking."""
+    rng = random.Random(7)
+    counts = {
+        f"sender{i}": (rng.randint(1, 9), rng.randint(1, 5), 0) for i in range(200)
+    }
+    ranking = Ranking()
+    ranking.update(counts)
+
+    for _ in range(50):
+        for key in rng.sample(sorted(counts), 3):
+            counts[key] = (rng.randint(1, 9), rng.randint(1, 5), rng.randint(0, 1))
+        counts.pop(rng.choice(sorted(counts)))
+        counts[f"new{rng.random()}"] = (rng.randint(1, 9), 1, 1)
+        assert ranking.update(counts) <= 5
+
+        rebuilt = Ranking({key: ranking.rows[key] for key in counts})
+        assert ranking.orders == rebuilt.orders
+    assert ranking.update(counts) == 0
+
+
+def test_state_round_trip():
+    """Test stored rankings restore to the same pages and old versions are dropped."""
+    rankings = SenderRankings.build(make_senders(*SAMPLE_THREADS))
+
+    restored = SenderRankings.from_state(rankings.to_state())
+
+    assert restored.page("threads") == rankings.page("threads")
+    assert restored.page(group_by_email=True) == rankings.page(group_by_email=True)
+    assert SenderRankings.from_state(None) is None
+    assert SenderRankings.from_state({**rankings.to_state(), "version": 0}) is None
+
+
+def test_update_rankings_state_keeps_tie_order():
+    """Test senders keep their place among ties across saves."""
+    sender_threads = make_senders(*SAMPLE_THREADS)
+    state = update_rankings_state(None, sender_threads)
+
+    # Dict order changes, counts don't
+    reordered = OrderedDict(reversed(list(sender_threads.items())))
+    state = update_rankings_state(state, reordered)
+
+    rows, _ = SenderRankings.from_state(state).page("threads")
+    assert [row[0] for row in rows] == list(sender_threads)
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+def test_storages_save_rankings(backend, tmp_path):
+    """Test every storage ranks the senders it saves."""
+    storage = open_storage(backend, str(tmp_path / "gmail_data"))
+    assert load_rankings(storage) is None
+
+    sender_threads = make_senders(*SAMPLE_THREADS)
+    save(storage, sender_threads)
+    assert load_rankings(storage).page("messages", limit=1)[0] == [
+        ("Alice <alice@example.com>", 2, 2, 1)
+    ]
+
+    sender_threads["carol@example.com"].add_thread(
+        GmailThread("6", ["UNREAD"], "carol@example.com", "Subject 6")
+    )
+    sender_threads["carol@example.com"].add_thread(
+        GmailThread("7", ["UNREAD"], "carol@example.com", "Subject 7")
+    )
+    del sender_threads["bob@example.com"]
+    save(storage, sender_threads)
+
+    rows, total = load_rankings(storage).page("unread_threads")
+    assert rows[0] == ("carol@example.com", 3, 3, 2) and total == 3
+
+
+def test_streamed_sync_saves_rankings(tmp_path):
+    """Test a bounded-memory sync ranks the senders it streamed."""
+    storage = open_storage("sqlite", str(tmp_path / "gmail_data.db"))
+    save(storage, make_senders(*SAMPLE_THREADS))
+
+    storage.stream_threads(make_senders(("8", "dave@example.com", ["UNREAD"])), "s1")
+    storage.finish_stream("s1", "8")
+
+    assert load_rankings(storage).page() == ([("dave@example.com", 1, 1, 1)], 1)
+
+
+def test_offline_list_senders_reads_no_sender(tmp_path, monkeypatch, mocker):
+    """Test offline list-senders renders a page without loading senders."""
+    monkeypatch.chdir(tmp_path)
+    save(open_storage("sqlite"), make_senders(*SAMPLE_THREADS))
+    load_counts = mocker.patch("gmail_stats.cli.load_sender_counts")
+    runner = CliRunner()
+
+    result = runner.invoke(
+        cli,
+        [
+            "--offline",
+            "--storage",
+            "sqlite",
+            "list-senders",
+            "--group-by-email",
+            "--limit",
+            "1",
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert "alice@example.com" in result.output
+    assert "Showing 1-1 of 3 senders" in result.output
+    load_counts.assert_not_called()
+
+
+def test_offline_list_senders_without_rankings(tmp_path, monkeypatch):
+    """Test caches saved before rankings existed are still listed."""
+    monkeypatch.chdir(tmp_path)
+    storage = open_storage("sqlite")
+    save(storage, make_senders(*SAMPLE_THREADS))
+    storage.set_state(RANKINGS_KEY, None)
+
+    result = CliRunner().invoke(
+        cli, ["--offline", "--storage", "sqlite", "list-senders"]
+    )
+
+    assert result.exit_code == 0
+    assert "bob@example.com" in result.output
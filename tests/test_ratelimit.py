@@ -0,0 +1,104 @@
+import pytest
+from gmail_stats.ratelimit import (
+    QuotaTokenBucket,
+    QuotaExceededError,
+    SECONDS_PER_DAY,
+)
+
+
+class FakeClock:
+    """Clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def available(bucket, method, count=1):
+    """Take quota for count calls of method if it is available without waiting."""
+    try:
+        bucket.acquire(method, count, timeout=0)
+        return True
+    except TimeoutError:
+        return False
+
+
+def test_cost_per_method():
+    """Test that methods are charged their Gmail quota cost."""
+    bucket = QuotaTokenBucket()
+
+    assert bucket.cost("users.threads.get") == 10
+    assert bucket.cost("users.threads.get", count=100) == 1000
+    assert bucket.cost("users.history.list") == 2
+    assert bucket.cost("users.getProfile") == 1
+
+
+def test_acquire_within_burst():
+    """Test that requests within the bucket don't wait."""
+    clock = FakeClock()
+    bucket = QuotaTokenBucket(units_per_second=250, clock=clock)
+
+    assert bucket.acquire("users.threads.get", count=25) == 0
+    assert bucket.units_consumed == 250
+    assert not available(bucket, "users.threads.get")
+
+
+def test_refill_over_time():
+    """Test that tokens refill at the configured rate."""
+    clock = FakeClock()
+    bucket = QuotaTokenBucket(units_per_second=100, clock=clock)
+    bucket.acquire("users.threads.get", count=10)
+
+    clock.advance(0.05)
+    assert not available(bucket, "users.threads.get")
+    clock.advance(0.05)
+    assert available(bucket, "users.threads.get")
+
+
+def test_large_request_goes_into_debt():
+    """Test that a request larger than the bucket is allowed but paid for."""
+    clock = FakeClock()
+    bucket = QuotaTokenBucket(units_per_second=250, clock=clock)
+
+    assert available(bucket, "users.threads.get", count=100)
+    clock.advance(2.9)
+    assert not available(bucket, "users.getProfile")
+    clock.advance(0.2)
+    assert available(bucket, "users.getProfile")
+
+
+def test_acquire_blocks_until_refilled():
+    """Test that acquire waits instead of failing."""
+    bucket = QuotaTokenBucket(units_per_second=1000, burst=10)
+    bucket.acquire("users.threads.get")
+
+    waited = bucket.acquire("users.threads.get")
+    assert waited > 0
+
+
+def test_acquire_timeout():
+    """Test that acquire gives up after the timeout."""
+    bucket = QuotaTokenBucket(units_per_second=1, burst=10)
+    bucket.acquire("users.threads.get")
+
+    with pytest.raises(TimeoutError):
+        bucket.acquire("users.threads.get", timeout=0.01)
+
+
+def test_daily_limit():
+    """Test that the daily budget is enforced and resets after a day."""
+    clock = FakeClock()
+    bucket = QuotaTokenBucket(units_per_second=1000, daily_limit=20, clock=clock)
+    bucket.acquire("users.threads.get", count=2)
+
+    with pytest.raises(QuotaExceededError):
+        bucket.acquire("users.getProfile")
+
+    clock.advance(SECONDS_PER_DAY)
+    assert available(bucket, "users.threads.get", count=2)
+    assert bucket.units_consumed == 40
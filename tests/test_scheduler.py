@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+from gmail_stats.scheduler import AIMDController, FetchScheduler
+
+
+def test_controller_additive_increase():
+    """Test that healthy requests grow the limit by about one per round."""
+    controller = AIMDController(initial=2, maximum=4)
+
+    for _ in range(3):
+        controller.on_success(0.1)
+    assert controller.concurrency == 3
+
+    for _ in range(100):
+        controller.on_success(0.1)
+    assert controller.concurrency == 4
+
+
+def test_controller_multiplicative_decrease():
+    """Test that throttling halves the limit once per cooldown."""
+    controller = AIMDController(initial=8, cooldown=60)
+
+    controller.on_throttle()
+    assert controller.concurrency == 4
+
+    # Failures from requests already in flight don't count again
+    controller.on_throttle()
+    assert controller.concurrency == 4
+
+
+def test_controller_minimum():
+    """Test that the limit never drops below the minimum."""
+    controller = AIMDController(initial=1, minimum=1, cooldown=0)
+
+    controller.on_throttle()
+    controller.on_throttle()
+    assert controller.concurrency == 1
+
+
+def test_controller_slow_requests_decrease():
+    """Test that latency above the target shrinks the limit."""
+    controller = AIMDController(initial=4, latency_target=1.0)
+
+    controller.on_success(5.0)
+    assert controller.concurrency == 2
+
+
+def test_scheduler_limits_in_flight_tasks():
+    """Test that no more tasks run at once than the controller allows."""
+    scheduler = FetchScheduler(AIMDController(initial=2, maximum=2))
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def task():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+        return True
+
+    futures = [scheduler.submit(task, items=10) for _ in range(8)]
+    assert all(f.result() for f in futures)
+    assert max(peak) <= 2
+    assert scheduler.in_flight == 0
+    assert scheduler.throughput > 0
+    scheduler.shutdown()
+
+
+def test_scheduler_failed_task_keeps_concurrency():
+    """Test that a task failing for other reasons than throttling doesn't back off."""
+    scheduler = FetchScheduler(AIMDController(initial=4, maximum=4))
+
+    def task():
+        raise ValueError("boom")
+
+    future = scheduler.submit(task)
+    with pytest.raises(ValueError):
+        future.result()
+    assert scheduler.concurrency == 4
+    assert scheduler.in_flight == 0
+    scheduler.shutdown()
+
+
+def test_scheduler_slow_task_keeps_concurrency():
+    """Test that time a task spends outside its requests isn't taken as latency."""
+    scheduler = FetchScheduler(AIMDController(initial=4, latency_target=0.01))
+
+    # E.g. waiting on the quota bucket
+    scheduler.submit(time.sleep, 0.05).result()
+
+    assert scheduler.concurrency == 4
+    scheduler.shutdown()
+
+
+def test_scheduler_rejects_after_shutdown():
+    """Test that no tasks are accepted after shutdown."""
+    scheduler = FetchScheduler()
+    scheduler.shutdown()
+
+    with pytest.raises(RuntimeError):
+        scheduler.submit(lambda: None)
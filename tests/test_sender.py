@@ -65,3 +65,96 @@ def test_gmail_sender_empty():
     sender = GmailSender("test@example.com")
     assert len(sender.threads) == 0
     assert sender.message_count == 0
+
+
+def test_gmail_sender_remove_thread():
+    """Test removing a thread from GmailSender."""
+    sender = GmailSender("test@example.com")
+    thread = GmailThread("123", ["INBOX"], "test@example.com", "Test Subject")
+    sender.add_thread(thread)
+
+    assert sender.remove_thread("123") == thread
+    assert sender.threads == []
+    assert sender.message_count == 0
+    assert sender.remove_thread("123") is None
+
+
+def test_gmail_sender_aggregates():
+    """Test that counts and dates are maintained as threads come and go."""
+    sender = GmailSender("test@example.com")
+    sender.add_threads(
+        [
+            GmailThread(
+                "1", ["INBOX", "UNREAD"], "test@example.com", "A", None, 3, 100
+            ),
+            GmailThread("2", ["INBOX"], "test@example.com", "B", None, 1, 300),
+            GmailThread(
+                "3", ["INBOX", "UNREAD"], "test@example.com", "C", None, 2, 200
+            ),
+        ]
+    )
+
+    assert sender.message_count == 6
+    assert sender.thread_count == 3
+    assert sender.unread_count == 2
+    assert (sender.first_seen, sender.last_seen) == (100, 300)
+
+    sender.remove_thread("2")
+    assert sender.message_count == 5
+    assert sender.unread_count == 2
+    assert (sender.first_seen, sender.last_seen) == (100, 200)
+
+    sender.remove_thread("1")
+    sender.remove_thread("3")
+    assert sender.message_count == 0
+    assert sender.unread_count == 0
+    assert sender.first_seen is None and sender.last_seen is None
+
+
+def test_gmail_sender_get_email_is_cached():
+    """Test that the email address is only parsed once."""
+    sender = GmailSender("Test User <test@example.com>")
+
+    assert sender.get_email() == "test@example.com"
+    assert sender.get_email() is sender.get_email()
+
+
+def test_gmail_sender_evict_threads_keeps_counts():
+    """Test that evicting threads keeps the aggregates they added up to."""
+    sender = GmailSender("test@example.com")
+    sender.add_threads(
+        [
+            GmailThread("1", ["UNREAD"], "test@example.com", "A", date=100),
+            GmailThread("2", [], "test@example.com", "B", message_count=3, date=200),
+        ]
+    )
+
+    assert not sender.threads_evicted
+    assert sender.evict_threads() == 2
+    assert sender.threads == []
+    assert sender.threads_evicted
+    assert (sender.message_count, sender.thread_count, sender.unread_count) == (
+        4,
+        2,
+        1,
+    )
+    assert (sender.first_seen, sender.last_seen) == (100, 200)
+
+    sender.add_thread(GmailThread("3", ["UNREAD"], "test@example.com", "C", date=50))
+    assert sender.thread_count == sender.num_threads() == 3
+    assert sender.unread_count == 2
+    assert sender.first_seen == 50
+
+
+def test_gmail_sender_from_counts():
+    """Test creating a sender holding counts only."""
+    sender = GmailSender.from_counts("test@example.com", 10, 4, 2, 100, 300)
+
+    assert sender.threads == []
+    assert sender.threads_evicted
+    assert (sender.message_count, sender.thread_count, sender.unread_count) == (
+        10,
+        4,
+        2,
+    )
+    assert (sender.first_seen, sender.last_seen) == (100, 300)
@@ -0,0 +1,268 @@
+import sqlite3
+import pytest
+from collections import OrderedDict
+from gmail_stats.sqlite_storage import SQLiteStorage
+from gmail_stats.storage import GmailStorage, open_storage
+from gmail_stats.sender import GmailSender
+from gmail_stats.thread import GmailThread
+
+
+@pytest.fixture
+def temp_db_path(tmp_path):
+    """Create a temporary database path."""
+    return str(tmp_path / "test_gmail_data.sqlite3")
+
+
+@pytest.fixture
+def sample_data():
+    """Create sample data for testing."""
+    senders = OrderedDict(
+        [("Test One <test1@example.com>", 2), ("test2@example.com", 1)]
+    )
+
+    sender_threads = {
+        "Test One <test1@example.com>": GmailSender("Test One <test1@example.com>"),
+        "test2@example.com": GmailSender("test2@example.com"),
+    }
+
+    thread1 = GmailThread(
+        "123", ["INBOX", "UNREAD"], "Test One <test1@example.com>", "Subject 1"
+    )
+    thread2 = GmailThread("456", ["INBOX"], "Test One <test1@example.com>", "Subject 2")
+    thread3 = GmailThread("789", ["INBOX", "UNREAD"], "test2@example.com", "Subject 3")
+
+    sender_threads["Test One <test1@example.com>"].add_threads([thread1, thread2])
+    sender_threads["test2@example.com"].add_thread(thread3)
+
+    return senders, sender_threads, "123"
+
+
+def count_rows(db_path, table):
+    """Count the rows of a table."""
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_save_and_load_data(temp_db_path, sample_data):
+    """Test saving and loading data."""
+    senders, sender_threads, last_thread_id = sample_data
+    storage = SQLiteStorage(temp_db_path)
+
+    storage.save_data(senders, sender_threads, last_thread_id)
+    loaded_senders, loaded_sender_threads, loaded_last_thread_id = SQLiteStorage(
+        temp_db_path
+    ).load_data()
+
+    assert dict(loaded_senders) == dict(senders)
+    assert loaded_last_thread_id == last_thread_id
+    for email, sender in loaded_sender_threads.items():
+        assert len(sender.threads) == len(sender_threads[email].threads)
+        for t1, t2 in zip(sender.threads, sender_threads[email].threads):
+            assert t1.thread_id == t2.thread_id
+            assert t1.subject == t2.subject
+            assert t1.labels == t2.labels
+
+
+def test_load_empty_data(temp_db_path):
+    """Test loading from an empty database."""
+    assert SQLiteStorage(temp_db_path).load_data() == (None, None, None)
+
+
+def test_save_only_writes_changes(temp_db_path, sample_data, mocker):
+    """Test that unchanged rows are not rewritten and removed ones deleted."""
+    senders, sender_threads, last_thread_id = sample_data
+    storage = SQLiteStorage(temp_db_path)
+    storage.save_data(senders, sender_threads, last_thread_id)
+
+    # Mark one thread read and drop the other sender entirely
+    sender = sender_threads["Test One <test1@example.com>"]
+    sender.threads[0].labels = ["INBOX"]
+    del sender_threads["test2@example.com"]
+    del senders["test2@example.com"]
+
+    logger = mocker.patch("gmail_stats.sqlite_storage.logger")
+    storage.save_data(senders, sender_threads, last_thread_id)
+
+    logger.info.assert_called_with(
+        f"Saved 1 changed and removed 1 threads in {temp_db_path}"
+    )
+    assert count_rows(temp_db_path, "threads") == 2
+    assert count_rows(temp_db_path, "senders") == 1
+    loaded = storage.load_sender("Test One <test1@example.com>")
+    assert [t.labels for t in loaded.threads] == [["INBOX"], ["INBOX"]]
+
+
+def test_load_sender(temp_db_path, sample_data):
+    """Test loading a single sender."""
+    senders, sender_threads, last_thread_id = sample_data
+    storage = SQLiteStorage(temp_db_path)
+    storage.save_data(senders, sender_threads, last_thread_id)
+
+    sender = storage.load_sender("test2@example.com")
+
+    assert sender.sender == "test2@example.com"
+    assert [t.thread_id for t in sender.threads] == ["789"]
+    assert storage.load_sender("nobody@example.com") is None
+
+
+def test_load_senders_by_email(temp_db_path, sample_data):
+    """Test loading senders through the email index."""
+    senders, sender_threads, last_thread_id = sample_data
+    storage = SQLiteStorage(temp_db_path)
+    storage.save_data(senders, sender_threads, last_thread_id)
+
+    found = storage.load_senders_by_email("test1@example.com")
+
+    assert [s.sender for s in found] == ["Test One <test1@example.com>"]
+    assert found[0].num_threads() == 2
+
+
+def test_state(temp_db_path):
+    """Test storing sync state."""
+    storage = SQLiteStorage(temp_db_path)
+
+    assert storage.get_state("sync_filter") is None
+    storage.set_state("sync_filter", {"label_ids": ["INBOX"], "query": None})
+    assert storage.get_state("sync_filter") == {"label_ids": ["INBOX"], "query": None}
+
+
+def test_clear_cache(temp_db_path, sample_data):
+    """Test clearing the cache."""
+    storage = SQLiteStorage(temp_db_path)
+    storage.save_data(*sample_data)
+
+    storage.clear_cache()
+
+    assert storage.load_data() == (None, None, None)
+
+
+def test_schema_set_up_once(temp_db_path, sample_data, mocker):
+    """Test only the first connection of a storage creates and migrates the schema."""
+    migrate = mocker.spy(SQLiteStorage, "_migrate")
+    storage = SQLiteStorage(temp_db_path)
+
+    storage.save_data(*sample_data)
+    storage.set_state("history_id", "1")
+    storage.load_data()
+    assert migrate.call_count == 1
+
+    # The schema is created again in the new database
+    storage.clear_cache()
+    storage.save_data(*sample_data)
+    assert migrate.call_count == 2
+    assert storage.load_data()[0] == sample_data[0]
+
+
+def test_open_storage(tmp_path):
+    """Test choosing a storage backend."""
+    assert isinstance(open_storage("shelve", str(tmp_path / "db")), GmailStorage)
+    assert isinstance(open_storage("sqlite", str(tmp_path / "db")), SQLiteStorage)
+    with pytest.raises(ValueError):
+        open_storage("csv")
+
+
+def test_history_id_round_trip(temp_db_path, sample_data):
+    """Test that thread historyIds are stored and change detection sees them."""
+    senders, sender_threads, last_thread_id = sample_data
+    sender_threads["test2@example.com"].threads[0].history_id = "42"
+    storage = SQLiteStorage(temp_db_path)
+    storage.save_data(senders, sender_threads, last_thread_id)
+
+    _, loaded_sender_threads, _ = SQLiteStorage(temp_db_path).load_data()
+    assert loaded_sender_threads["test2@example.com"].threads[0].history_id == "42"
+
+    sender_threads["test2@example.com"].threads[0].history_id = "43"
+    storage.save_data(senders, sender_threads, last_thread_id)
+    _, loaded_sender_threads, _ = SQLiteStorage(temp_db_path).load_data()
+    assert loaded_sender_threads["test2@example.com"].threads[0].history_id == "43"
+
+
+def test_migrates_databases_without_history_id(temp_db_path, sample_data):
+    """Test that databases from before historyIds were stored still open."""
+    with sqlite3.connect(temp_db_path) as conn:
+        conn.execute(
+            "CREATE TABLE threads (thread_id TEXT PRIMARY KEY, "
+            "sender TEXT NOT NULL, email TEXT NOT NULL, subject TEXT)"
+        )
+        conn.execute(
+            "INSERT INTO threads VALUES ('1', 'a@example.com', 'a@example.com', 'Hi')"
+        )
+
+    sender = SQLiteStorage(temp_db_path).load_sender("a@example.com")
+
+    assert sender.threads[0].history_id is None
+
+
+def test_cache_without_expiry(temp_db_path, sample_data):
+    """Test that a cache_duration of None never expires the cache."""
+    senders, sender_threads, last_thread_id = sample_data
+    SQLiteStorage(temp_db_path).save_data(senders, sender_threads, last_thread_id)
+
+    assert SQLiteStorage(temp_db_path, cache_duration=0).load_data()[0] is None
+    storage = SQLiteStorage(temp_db_path, cache_duration=None)
+    assert dict(storage.load_data()[0]) == dict(senders)
+
+
+def test_thread_aggregates_round_trip(temp_db_path):
+    """Test that message counts and dates survive a save and load."""
+    sender = GmailSender("a@example.com")
+    sender.add_thread(
+        GmailThread("1", ["INBOX", "UNREAD"], "a@example.com", "Hi", "7", 4, 1000)
+    )
+    SQLiteStorage(temp_db_path).save_data(
+        OrderedDict([("a@example.com", 1)]), {"a@example.com": sender}, "1"
+    )
+
+    loaded = SQLiteStorage(temp_db_path).load_sender("a@example.com")
+
+    assert loaded.message_count == 4
+    assert loaded.unread_count == 1
+    assert loaded.first_seen == loaded.last_seen == 1000
+
+
+def test_streamed_sync(temp_db_path, sample_data):
+    """Test streaming threads in, keeping unchanged ones and dropping the rest."""
+    senders, sender_threads, last_thread_id = sample_data
+    storage = SQLiteStorage(temp_db_path)
+    storage.save_data(senders, sender_threads, last_thread_id)
+
+    assert storage.lookup_history_ids(["123", "789", "missing"]) == {
+        "123": None,
+        "789": None,
+    }
+
+    # 456 is unchanged, 789 is gone and 999 is new
+    storage.mark_synced(["456"], "sync-1")
+    new_sender = GmailSender("New <new@example.com>")
+    new_sender.add_thread(
+        GmailThread("999", ["INBOX", "UNREAD"], new_sender.sender, "New", "7", 2, 1000)
+    )
+    changed = GmailSender("Test One <test1@example.com>")
+    changed.add_thread(
+        GmailThread("123", ["INBOX"], changed.sender, "Subject 1", "8", 1, 2000)
+    )
+    written = storage.stream_threads(
+        {new_sender.sender: new_sender, changed.sender: changed}, "sync-1"
+    )
+    assert written == 2
+    assert storage.finish_stream("sync-1", "999") == 1
+
+    counts, count_senders = storage.load_sender_counts()
+    assert list(counts.items()) == [
+        ("Test One <test1@example.com>", 2),
+        ("New <new@example.com>", 1),
+    ]
+    new = count_senders["New <new@example.com>"]
+    assert (new.message_count, new.unread_count, new.first_seen) == (2, 1, 1000)
+    assert new.threads_evicted
+    assert count_senders["Test One <test1@example.com>"].unread_count == 0
+    assert storage.lookup_history_ids(["123"]) == {"123": "8"}
+
+    loaded_senders, loaded_threads, loaded_last = SQLiteStorage(
+        temp_db_path
+    ).load_data()
+    assert loaded_senders == counts
+    assert loaded_last == "999"
+    assert [t.thread_id for t in loaded_threads["New <new@example.com>"].threads] == [
+        "999"
+    ]
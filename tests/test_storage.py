@@ -88,3 +88,32 @@ def test_save_data_error(temp_db_path, sample_data):
 
     # Restore permissions
     os.chmod(os.path.dirname(temp_db_path), 0o755)
+
+
+def test_state(temp_db_path):
+    """Test storing sync state."""
+    storage = GmailStorage(temp_db_path)
+
+    assert storage.get_state("history_id") is None
+    assert storage.get_state("history_id", "0") == "0"
+
+    storage.set_state("history_id", "12345")
+    assert storage.get_state("history_id") == "12345"
+
+
+def test_history_id_round_trip(temp_db_path, sample_data):
+    """Test that thread historyIds are saved and loaded."""
+    senders, sender_threads, last_thread_id = sample_data
+    thread = next(iter(sender_threads.values())).threads[0]
+    thread.history_id = "42"
+    storage = GmailStorage(temp_db_path)
+
+    storage.save_data(senders, sender_threads, last_thread_id)
+    _, loaded_sender_threads, _ = storage.load_data()
+
+    loaded = {
+        t.thread_id: t.history_id
+        for sender in loaded_sender_threads.values()
+        for t in sender.threads
+    }
+    assert loaded[thread.thread_id] == "42"
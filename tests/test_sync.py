@@ -0,0 +1,697 @@
+import threading
+import pytest
+from unittest.mock import Mock
+from googleapiclient.errors import HttpError
+
+from gmail_stats.sync import (
+    build_thread_request,
+    fetch_thread_batch,
+    list_history_changes,
+    list_threads_with_labels,
+    iter_chunks,
+    FilteredListing,
+    ThreadListing,
+    process_thread_batch,
+    sync_history,
+    HistoryExpiredError,
+    get_sender_counts,
+    CHECKPOINT_KEY,
+    MAX_BATCH_REQUESTS,
+    METADATA_FIELDS,
+)
+from gmail_stats.metrics import SyncMetrics
+from gmail_stats.ratelimit import QuotaTokenBucket
+from gmail_stats.sender import GmailSender
+from gmail_stats.storage import GmailStorage
+from gmail_stats.transport import ServicePool
+from gmail_stats.thread import GmailThread
+from conftest import make_http_error
+
+
+def make_thread_data(thread_id, sender="test@example.com", labels=None):
+    """Create a threads.get response for a single-message thread."""
+    return {
+        "id": thread_id,
+        "messages": [
+            {
+                "id": thread_id,
+                "labelIds": labels if labels is not None else ["INBOX", "UNREAD"],
+                "payload": {
+                    "headers": [
+                        {"name": "From", "value": sender},
+                        {"name": "Subject", "value": f"Subject {thread_id}"},
+                    ]
+                },
+            }
+        ],
+    }
+
+
+class FakeBatch:
+    """Minimal stand-in for googleapiclient's BatchHttpRequest."""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.request_ids = []
+
+    def add(self, request, request_id=None):
+        self.service.requests.append(request)
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        self.service.executed_batches.append(list(self.request_ids))
+        for request_id in self.request_ids:
+            response, exception = self.service.respond(request_id)
+            self.callback(request_id, response, exception)
+
+
+class FakeService:
+    """Fake Gmail service whose batch sub-requests answer from a script."""
+
+    def __init__(self, failures=None, labels=None):
+        self.executed_batches = []
+        self.requests = []
+        self.failures = dict(failures or {})
+        self.labels = labels or {}
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def users(self):
+        return self
+
+    def threads(self):
+        return self
+
+    def get(self, **kwargs):
+        return kwargs
+
+    def respond(self, thread_id):
+        remaining = self.failures.get(thread_id, [])
+        if remaining:
+            return None, make_http_error(remaining.pop(0))
+        return make_thread_data(thread_id, labels=self.labels.get(thread_id)), None
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(mocker):
+    """Skip backoff sleeps."""
+    mocker.patch("gmail_stats.sync.time.sleep")
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(mocker):
+    """Use a rate limiter that never has to wait."""
+    return mocker.patch(
+        "gmail_stats.sync.rate_limiter", QuotaTokenBucket(units_per_second=1e9)
+    )
+
+
+def test_fetch_thread_batch_single_request():
+    """Test that all threads are fetched with one batch request."""
+    service = FakeService(labels={"2": ["INBOX"]})
+    threads = [{"id": str(i)} for i in range(3)]
+
+    results = fetch_thread_batch(service, threads)
+
+    assert service.executed_batches == [["0", "1", "2"]]
+    assert sorted(r["thread"].thread_id for r in results) == ["0", "1"]
+    assert results[0]["sender"] == "test@example.com"
+
+
+def test_fetch_thread_batch_retries_only_failed():
+    """Test that only failed sub-requests are retried."""
+    service = FakeService(failures={"1": [429], "2": [503]})
+    threads = [{"id": str(i)} for i in range(3)]
+
+    results = fetch_thread_batch(service, threads)
+
+    assert service.executed_batches == [["0", "1", "2"], ["1", "2"]]
+    assert sorted(r["thread"].thread_id for r in results) == ["0", "1", "2"]
+
+
+def test_fetch_thread_batch_records_metrics(mocker):
+    """Test that requests, errors, retries and quota are recorded."""
+    metrics = mocker.patch("gmail_stats.sync.sync_metrics", SyncMetrics())
+    service = FakeService(failures={"1": [429], "2": [503]})
+    threads = [{"id": str(i)} for i in range(3)]
+
+    fetch_thread_batch(service, threads)
+
+    summary = metrics.summary()
+    assert summary["requests"] == {"users.threads.get": 5, "batch": 2}
+    assert summary["latency"]["batch"]["count"] == 2
+    assert summary["errors"] == {"rate_limit": 1, "server_error": 1}
+    # Both failures are retried in one batch, backing off for the 429
+    assert summary["retries"] == {"rate_limit": 1}
+    assert summary["backoff_seconds"]["rate_limit"] >= 1
+    assert summary["quota_units"] == {"users.threads.get": 50}
+
+
+def test_fetch_thread_batch_drops_non_retryable():
+    """Test that client errors are not retried."""
+    service = FakeService(failures={"1": [404]})
+    threads = [{"id": str(i)} for i in range(2)]
+
+    results = fetch_thread_batch(service, threads)
+
+    assert service.executed_batches == [["0", "1"]]
+    assert [r["thread"].thread_id for r in results] == ["0"]
+
+
+def test_fetch_thread_batch_gives_up_after_max_retries():
+    """Test that persistently failing threads are dropped."""
+    service = FakeService(failures={"1": [500, 500, 500]})
+    threads = [{"id": str(i)} for i in range(2)]
+
+    results = fetch_thread_batch(service, threads, max_retries=3)
+
+    assert len(service.executed_batches) == 3
+    assert [r["thread"].thread_id for r in results] == ["0"]
+
+
+def test_process_thread_batch_splits_batches():
+    """Test that large thread lists are split into batch requests."""
+    service = FakeService()
+    threads = [{"id": str(i)} for i in range(MAX_BATCH_REQUESTS + 5)]
+
+    senders, sender_threads = process_thread_batch(service, threads)
+
+    assert sorted(len(b) for b in service.executed_batches) == [
+        5,
+        MAX_BATCH_REQUESTS,
+    ]
+    assert senders == {"test@example.com": MAX_BATCH_REQUESTS + 5}
+    assert sender_threads["test@example.com"].num_threads() == MAX_BATCH_REQUESTS + 5
+
+
+def test_build_thread_request_metadata():
+    """Test that metadata fetches request only the headers we read."""
+    request = build_thread_request(FakeService(), "123")
+
+    assert request == {
+        "userId": "me",
+        "id": "123",
+        "format": "metadata",
+        "metadataHeaders": ["From", "Subject"],
+        "fields": METADATA_FIELDS,
+    }
+
+
+def test_build_thread_request_full():
+    """Test that full fetches use the API defaults."""
+    request = build_thread_request(FakeService(), "123", fetch_format="full")
+
+    assert request == {"userId": "me", "id": "123"}
+
+
+def test_build_thread_request_invalid_format():
+    """Test that unknown fetch formats are rejected."""
+    with pytest.raises(ValueError):
+        build_thread_request(FakeService(), "123", fetch_format="raw")
+
+
+def test_fetch_thread_batch_uses_fetch_format():
+    """Test that batched sub-requests use the requested fetch format."""
+    service = FakeService()
+
+    fetch_thread_batch(service, [{"id": "1"}], fetch_format="full")
+
+    assert service.requests == [{"userId": "me", "id": "1"}]
+
+
+def make_history_service(*pages):
+    """Create a mock service whose history.list returns the given pages."""
+    service = Mock()
+    service.users().history().list.return_value.execute.side_effect = list(pages)
+    return service
+
+
+def test_list_history_changes():
+    """Test collecting changed thread IDs across history pages."""
+    service = make_history_service(
+        {
+            "history": [
+                {"messagesAdded": [{"message": {"id": "m1", "threadId": "t1"}}]},
+                {"labelsRemoved": [{"message": {"id": "m2", "threadId": "t2"}}]},
+            ],
+            "nextPageToken": "page2",
+            "historyId": "200",
+        },
+        {
+            "history": [
+                {"messagesDeleted": [{"message": {"id": "m3", "threadId": "t1"}}]}
+            ],
+            "historyId": "201",
+        },
+    )
+
+    changed, history_id = list_history_changes(service, "me", "100")
+
+    assert changed == {"t1", "t2"}
+    assert history_id == "201"
+
+
+def test_list_history_changes_no_changes():
+    """Test that a quiet mailbox keeps the returned historyId."""
+    service = make_history_service({"historyId": "150"})
+
+    changed, history_id = list_history_changes(service, "me", "100")
+
+    assert changed == set()
+    assert history_id == "150"
+
+
+def test_list_history_changes_expired():
+    """Test that a 404 from history.list means the historyId expired."""
+    service = make_history_service(make_http_error(404))
+
+    with pytest.raises(HistoryExpiredError):
+        list_history_changes(service, "me", "100")
+
+
+def test_sync_history_applies_changes(mocker):
+    """Test that changed threads are replaced and unchanged ones kept."""
+    kept = GmailThread("t1", ["INBOX", "UNREAD"], "a@example.com", "Kept")
+    read = GmailThread("t2", ["INBOX", "UNREAD"], "b@example.com", "Read")
+    sender_a = GmailSender("a@example.com")
+    sender_a.add_thread(kept)
+    sender_b = GmailSender("b@example.com")
+    sender_b.add_thread(read)
+    senders = {"a@example.com": 1, "b@example.com": 1}
+    sender_threads = {"a@example.com": sender_a, "b@example.com": sender_b}
+
+    new_thread = GmailThread("t3", ["INBOX", "UNREAD"], "a@example.com", "New")
+    new_sender = GmailSender("a@example.com")
+    new_sender.add_thread(new_thread)
+    fetch = mocker.patch(
+        "gmail_stats.sync.show_unread_inbox_threads",
+        return_value=({"a@example.com": 1}, {"a@example.com": new_sender}),
+    )
+    service = make_history_service(
+        {
+            "history": [
+                {"labelsRemoved": [{"message": {"id": "m2", "threadId": "t2"}}]},
+                {"messagesAdded": [{"message": {"id": "m3", "threadId": "t3"}}]},
+            ],
+            "historyId": "200",
+        }
+    )
+    storage = Mock()
+
+    result_senders, result_threads = sync_history(
+        service, storage, senders, sender_threads, "t1", "100"
+    )
+
+    assert fetch.call_args[0][1] == [{"id": "t2"}, {"id": "t3"}]
+    assert dict(result_senders) == {"a@example.com": 2}
+    assert [t.thread_id for t in result_threads["a@example.com"].threads] == [
+        "t1",
+        "t3",
+    ]
+    storage.save_data.assert_called_once()
+    storage.set_state.assert_called_once_with("history_id", "200")
+
+
+class FakeHistoryService(FakeService):
+    """FakeService whose history.list reports some threads as changed."""
+
+    def __init__(self, changed, failures=None):
+        super().__init__(failures)
+        self.changed = changed
+
+    def history(self):
+        response = {
+            "history": [
+                {"messagesAdded": [{"message": {"threadId": thread_id}}]}
+                for thread_id in self.changed
+            ],
+            "historyId": "9",
+        }
+        return Mock(list=Mock(return_value=Mock(execute=Mock(return_value=response))))
+
+
+def make_cached_sender():
+    """Create cached data holding thread t1 of test@example.com."""
+    sender = GmailSender("test@example.com")
+    sender.add_thread(
+        GmailThread("t1", ["INBOX", "UNREAD"], "test@example.com", "Cached")
+    )
+    return {"test@example.com": 1}, {"test@example.com": sender}
+
+
+def test_sync_history_interrupted_keeps_cache(mocker):
+    """Test an interrupted refetch neither drops threads nor moves the historyId."""
+    mocker.patch(
+        "gmail_stats.sync.shutdown_event", Mock(is_set=Mock(return_value=True))
+    )
+    senders, sender_threads = make_cached_sender()
+    storage = Mock()
+
+    result_senders, result_threads = sync_history(
+        FakeHistoryService(["t1"]), storage, senders, sender_threads, "t1", "5"
+    )
+
+    assert result_senders == {"test@example.com": 1}
+    assert [t.subject for t in result_threads["test@example.com"].threads] == ["Cached"]
+    storage.save_data.assert_not_called()
+    storage.set_state.assert_not_called()
+
+
+def test_sync_history_failed_fetch_keeps_cached_copy():
+    """Test threads that could not be refetched are kept and fetched next time."""
+    senders, sender_threads = make_cached_sender()
+    service = FakeHistoryService(["t1", "t2"], failures={"t1": [500, 500, 500]})
+    storage = Mock()
+
+    result_senders, result_threads = sync_history(
+        service, storage, senders, sender_threads, "t1", "5"
+    )
+
+    assert result_senders == {"test@example.com": 2}
+    assert [t.subject for t in result_threads["test@example.com"].threads] == [
+        "Cached",
+        "Subject t2",
+    ]
+    storage.save_data.assert_called_once()
+    storage.set_state.assert_not_called()
+
+
+def test_sync_history_no_changes(mocker):
+    """Test that a no-change refresh only calls history.list."""
+    fetch = mocker.patch("gmail_stats.sync.show_unread_inbox_threads")
+    service = make_history_service({"historyId": "100"})
+    storage = Mock()
+
+    sync_history(service, storage, {}, {}, "t1", "100")
+
+    fetch.assert_not_called()
+    storage.save_data.assert_not_called()
+    storage.set_state.assert_called_once_with("history_id", "100")
+
+
+def test_list_threads_with_labels_filters_server_side():
+    """Test that labels and query are passed to every threads.list call."""
+    service = Mock()
+    service.users().threads().list.return_value.execute.side_effect = [
+        {"threads": [{"id": "1"}], "nextPageToken": "page2"},
+        {"threads": [{"id": "2"}]},
+    ]
+
+    threads = list_threads_with_labels(
+        service, "me", ["INBOX", "UNREAD"], "from:news@example.com"
+    )
+
+    assert threads == [{"id": "1"}, {"id": "2"}]
+    calls = service.users().threads().list.call_args_list
+    assert calls[-2].kwargs == {
+        "userId": "me",
+        "labelIds": ["INBOX", "UNREAD"],
+        "maxResults": 500,
+        "q": "from:news@example.com",
+    }
+    assert calls[-1].kwargs["pageToken"] == "page2"
+    assert calls[-1].kwargs["q"] == "from:news@example.com"
+
+
+def test_list_threads_with_labels_empty_last_page():
+    """Test that a last page without threads is handled."""
+    service = Mock()
+    service.users().threads().list.return_value.execute.side_effect = [
+        {"threads": [{"id": "1"}], "nextPageToken": "page2"},
+        {},
+    ]
+
+    assert list_threads_with_labels(service, "me", ["INBOX"]) == [{"id": "1"}]
+
+
+def test_fetch_thread_batch_reports_throttling():
+    """Test that rate limit responses are reported to the caller."""
+    service = FakeService(failures={"1": [429]})
+    on_throttle = Mock()
+
+    fetch_thread_batch(service, [{"id": "1"}], on_throttle=on_throttle)
+
+    on_throttle.assert_called_once()
+
+
+def test_fetch_thread_batch_reports_request_latency(mocker):
+    """Test only successful requests report latency, without quota waits."""
+    quota_wait = threading.Event()
+    mocker.patch(
+        "gmail_stats.sync.acquire_quota",
+        side_effect=lambda *args, **kwargs: quota_wait.wait(0.05),
+    )
+    service = FakeService(failures={"1": [429]})
+    on_latency = Mock()
+
+    fetch_thread_batch(service, [{"id": "1"}], on_latency=on_latency)
+
+    on_latency.assert_called_once()
+    assert on_latency.call_args.args[0] < 0.05
+
+
+def test_fetch_thread_batch_charges_every_sub_request(no_rate_limit):
+    """Test that each batched threads.get is charged against the quota."""
+    fetch_thread_batch(FakeService(), [{"id": str(i)} for i in range(3)])
+
+    assert no_rate_limit.units_consumed == 30
+
+
+def test_process_thread_batch_with_service_pool():
+    """Test that workers take their service from a ServicePool."""
+    service = FakeService()
+    pool = ServicePool(lambda: service)
+    threads = [{"id": str(i)} for i in range(3)]
+
+    senders, _ = process_thread_batch(pool, threads)
+
+    assert senders == {"test@example.com": 3}
+    assert pool.size >= 1
+
+
+def make_list_service(*pages):
+    """Create a mock service whose threads.list returns the given pages."""
+    service = Mock()
+    service.users().threads().list.return_value.execute.side_effect = list(pages)
+    return service
+
+
+def test_iter_chunks():
+    """Test lazily splitting a stream into chunks."""
+    assert list(iter_chunks(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_chunks([], 2)) == []
+
+
+def test_thread_listing_streams_pages():
+    """Test that a ThreadListing yields threads from every page."""
+    service = make_list_service(
+        {"threads": [{"id": "1"}, {"id": "2"}], "nextPageToken": "page2"},
+        {"threads": [{"id": "3"}]},
+    )
+    listing = ThreadListing(service, "me", ["INBOX"])
+
+    assert [t["id"] for t in listing] == ["1", "2", "3"]
+    assert listing.listed == 3
+    assert listing.first_thread_id == "1"
+    assert listing.page_token == "page2"
+
+
+def test_thread_listing_resumes_from_page_token():
+    """Test that listing can start from a saved page token."""
+    service = make_list_service({"threads": [{"id": "3"}]})
+    listing = ThreadListing(service, "me", ["INBOX"], page_token="page2")
+
+    assert [t["id"] for t in listing] == ["3"]
+    assert service.users().threads().list.call_args.kwargs["pageToken"] == "page2"
+
+
+def test_filtered_listing_counts_threads_to_fetch():
+    """Test a filtered listing reports the listed threads it lets through."""
+    service = make_list_service(
+        {"threads": [{"id": "1"}, {"id": "2"}, {"id": "3"}]},
+    )
+    listing = ThreadListing(service, "me", ["INBOX"])
+
+    def iter_odd():
+        for thread in listing:
+            if int(thread["id"]) % 2:
+                yield thread
+            else:
+                filtered.skipped += 1
+
+    filtered = FilteredListing(iter_odd(), listing)
+
+    assert [t["id"] for t in filtered] == ["1", "3"]
+    assert filtered.listed == 2
+
+
+def test_thread_listing_propagates_errors():
+    """Test that listing errors are raised in the consuming thread."""
+    service = make_list_service(make_http_error(500))
+
+    with pytest.raises(HttpError):
+        list(ThreadListing(service, "me", ["INBOX"]))
+
+
+def test_process_thread_batch_consumes_stream():
+    """Test that threads can be processed from a generator."""
+    service = FakeService()
+    threads = ({"id": str(i)} for i in range(MAX_BATCH_REQUESTS * 2 + 1))
+    progress = []
+
+    senders, _ = process_thread_batch(service, threads, on_progress=progress.append)
+
+    assert senders == {"test@example.com": MAX_BATCH_REQUESTS * 2 + 1}
+    assert sorted(progress) == [1, MAX_BATCH_REQUESTS, MAX_BATCH_REQUESTS]
+
+
+class FakeMailbox(FakeService):
+    """FakeService that also answers threads.list and getProfile."""
+
+    def __init__(self, pages, history_id="500"):
+        super().__init__()
+        self.pages = pages
+        self.history_id = history_id
+        self.list_tokens = []
+
+    def list(self, **kwargs):
+        token = kwargs.get("pageToken")
+        self.list_tokens.append(token)
+        page = self.pages[token]
+        if isinstance(page, Exception):
+            return Mock(execute=Mock(side_effect=page))
+        return Mock(execute=Mock(return_value=page))
+
+    def getProfile(self, **kwargs):
+        return Mock(execute=Mock(return_value={"historyId": self.history_id}))
+
+
+def test_process_thread_batch_checkpoints():
+    """Test that checkpoints only see fully processed threads."""
+    service = FakeService()
+    threads = ({"id": str(i)} for i in range(MAX_BATCH_REQUESTS * 2))
+    checkpoints = []
+
+    process_thread_batch(
+        service,
+        threads,
+        checkpoint=lambda s, t, complete: checkpoints.append((dict(s), complete)),
+        checkpoint_interval=0,
+    )
+
+    assert checkpoints == [
+        ({"test@example.com": MAX_BATCH_REQUESTS}, True),
+        ({"test@example.com": MAX_BATCH_REQUESTS * 2}, True),
+    ]
+
+
+def test_process_thread_batch_flushes_without_rss(mocker):
+    """Test held threads are flushed where the RSS can't be read."""
+    mocker.patch("gmail_stats.sync.MIN_FLUSH_THREADS", 1)
+    mocker.patch("gmail_stats.sync.current_rss", return_value=None)
+    service = FakeService()
+    threads = ({"id": str(i)} for i in range(MAX_BATCH_REQUESTS * 2))
+    flushed = []
+
+    # Checkpoints wait for the first batch, so it is held at the next check
+    senders, sender_threads = process_thread_batch(
+        service,
+        threads,
+        checkpoint=lambda s, t, complete: None,
+        checkpoint_interval=0,
+        flush=lambda t: flushed.append(len(t["test@example.com"].threads)),
+        max_memory=2**40,
+    )
+
+    assert flushed == [MAX_BATCH_REQUESTS]
+    assert senders == {"test@example.com": MAX_BATCH_REQUESTS * 2}
+    assert sender_threads["test@example.com"].thread_count == MAX_BATCH_REQUESTS * 2
+
+
+def test_get_sender_counts_resumes_from_checkpoint(mocker, tmp_path):
+    """Test that an interrupted sync keeps its progress and resumes."""
+    pages = {
+        None: {
+            "threads": [{"id": f"a{i}"} for i in range(MAX_BATCH_REQUESTS)],
+            "nextPageToken": "p2",
+        },
+        "p2": {
+            "threads": [{"id": f"b{i}"} for i in range(MAX_BATCH_REQUESTS)],
+            "nextPageToken": "p3",
+        },
+        "p3": RuntimeError("token expired"),
+    }
+    service = FakeMailbox(pages)
+    storage = GmailStorage(str(tmp_path / "gmail_data"))
+    mocker.patch("gmail_stats.sync.open_storage", return_value=storage)
+    mocker.patch(
+        "gmail_stats.sync.get_service_pool",
+        side_effect=lambda *paths: ServicePool(lambda: service),
+    )
+
+    with pytest.raises(RuntimeError):
+        get_sender_counts(checkpoint_interval=0)
+
+    checkpoint = storage.get_state(CHECKPOINT_KEY)
+    assert checkpoint["page_token"] == "p2"
+    assert checkpoint["history_id"] == "500"
+    senders, _, _ = storage.load_data()
+    assert dict(senders) == {"test@example.com": MAX_BATCH_REQUESTS * 2}
+
+    pages["p3"] = {"threads": [{"id": "c0"}]}
+    service.list_tokens.clear()
+    service.history_id = "600"
+
+    senders, sender_threads = get_sender_counts(checkpoint_interval=0)
+
+    assert service.list_tokens == ["p2", "p3"]
+    assert dict(senders) == {"test@example.com": MAX_BATCH_REQUESTS * 2 + 1}
+    assert sender_threads["test@example.com"].num_threads() == (
+        MAX_BATCH_REQUESTS * 2 + 1
+    )
+    assert storage.get_state(CHECKPOINT_KEY) is None
+    assert storage.get_state("history_id") == "500"
+
+
+def test_get_sender_counts_refetches_changed_threads(mocker, tmp_path):
+    """Test that only new or changed threads are fetched and gone ones dropped."""
+    sender = GmailSender("test@example.com")
+    sender.add_threads(
+        [
+            GmailThread("t1", ["INBOX", "UNREAD"], "test@example.com", "Same", "1"),
+            GmailThread("t2", ["INBOX", "UNREAD"], "test@example.com", "Old", "2"),
+            GmailThread("t3", ["INBOX", "UNREAD"], "test@example.com", "Read", "3"),
+        ]
+    )
+    storage = GmailStorage(str(tmp_path / "gmail_data"))
+    storage.save_data({"test@example.com": 3}, {"test@example.com": sender}, "t1")
+    storage.set_state("sync_filter", {"label_ids": ["INBOX", "UNREAD"], "query": None})
+    service = FakeMailbox(
+        {
+            None: {
+                "threads": [
+                    {"id": "t1", "historyId": "1"},
+                    {"id": "t2", "historyId": "9"},
+                    {"id": "t4", "historyId": "4"},
+                ]
+            }
+        }
+    )
+    mocker.patch("gmail_stats.sync.open_storage", return_value=storage)
+    mocker.patch(
+        "gmail_stats.sync.get_service_pool",
+        side_effect=lambda *paths: ServicePool(lambda: service),
+    )
+
+    senders, sender_threads = get_sender_counts(incremental=False)
+
+    assert sorted(r["id"] for r in service.requests) == ["t2", "t4"]
+    assert dict(senders) == {"test@example.com": 3}
+    threads = {t.thread_id: t for t in sender_threads["test@example.com"].threads}
+    assert sorted(threads) == ["t1", "t2", "t4"]
+    assert threads["t2"].subject == "Subject t2"
+    assert storage.get_state("email_index") == {
+        "test@example.com": ["test@example.com"]
+    }
@@ -1,5 +1,5 @@
 import pytest
-from gmail_stats.thread import GmailThread
+from gmail_stats.thread import GmailThread, LabelTable, LABELS
 
 
 def test_gmail_thread_creation():
@@ -46,3 +46,47 @@ def test_gmail_thread_no_labels():
     )
 
     assert thread.labels == []
+
+
+def test_gmail_thread_label_mask():
+    """Test that labels are kept as a bitmask and decoded in table order."""
+    thread = GmailThread("123", ["UNREAD", "INBOX"], "test@example.com", "Subject")
+
+    assert thread.labels == ["INBOX", "UNREAD"]
+    assert thread.label_mask == LABELS.encode(["INBOX", "UNREAD"])
+    assert thread.is_unread
+    assert thread.has_label("INBOX")
+    assert not thread.has_label("STARRED")
+    assert not thread.has_label("Label_never_seen")
+
+
+def test_gmail_thread_user_labels():
+    """Test that user labels get their own bits in the shared table."""
+    thread = GmailThread("123", ["INBOX", "Label_42"], "test@example.com", "Subject")
+
+    assert thread.labels == ["INBOX", "Label_42"]
+    assert not thread.is_unread
+
+    thread.labels = ["Label_42"]
+    assert thread.labels == ["Label_42"]
+    assert not thread.has_label("INBOX")
+
+
+def test_gmail_thread_is_compact():
+    """Test that threads have no __dict__ and share sender strings."""
+    sender = "".join(["test@", "example.com"])
+    first = GmailThread("1", ["INBOX"], sender, "One")
+    second = GmailThread("2", ["INBOX"], "test@example.com", "Two")
+
+    assert not hasattr(first, "__dict__")
+    assert first.sender is second.sender
+
+
+def test_label_table():
+    """Test encoding and decoding label sets."""
+    table = LabelTable(["A", "B"])
+
+    assert table.encode(["B"]) == 2
+    assert table.encode(["C", "A"]) == 5
+    assert table.decode(7) == ["A", "B", "C"]
+    assert table.mask("D") == 0
@@ -0,0 +1,52 @@
+import threading
+from unittest.mock import Mock
+
+from gmail_stats.transport import ServicePool, resolve_service
+
+
+def test_service_pool_reuses_service_per_thread():
+    """Test that a thread gets the same service on every call."""
+    factory = Mock(side_effect=lambda: object())
+    pool = ServicePool(factory)
+
+    assert pool.get() is pool.get()
+    assert factory.call_count == 1
+    assert pool.size == 1
+
+
+def test_service_pool_separate_service_per_thread():
+    """Test that each thread gets its own service."""
+    pool = ServicePool(lambda: object())
+    services = []
+
+    def worker():
+        services.append(pool.get())
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(service) for service in services}) == 3
+    assert pool.size == 3
+
+
+def test_service_pool_close():
+    """Test that closing the pool closes every service."""
+    service = Mock()
+    pool = ServicePool(lambda: service)
+    pool.get()
+
+    pool.close()
+
+    service.close.assert_called_once()
+    assert pool.size == 0
+
+
+def test_resolve_service():
+    """Test resolving pools and plain services."""
+    service = object()
+
+    assert resolve_service(service) is service
+    assert resolve_service(ServicePool(lambda: service)) is service